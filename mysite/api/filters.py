@@ -0,0 +1,49 @@
+
+import django_filters
+from rest_framework import filters
+from catalog.filters import AttributeFilter
+from catalog.fuzzy import fuzzy_search
+from catalog.models import Category, Product
+from catalog.search import search_products
+from catalog.tree import get_tree
+
+
+class ProductFilterSet(django_filters.FilterSet):
+    """
+    Filters for the product API. `category__slug` matches products filed under
+    the category or any of its subcategories, and each repeated `attribute`
+    (`name:value[,value...]`) must be matched by one and the same variant.
+    """
+    category__slug = django_filters.CharFilter(method='filter_category_slug')
+    attribute = AttributeFilter()
+
+    class Meta:
+        model = Product
+        fields = ['category__slug', 'brand', 'is_active', 'attribute']
+
+    def filter_category_slug(self, queryset, name, value):
+        category = get_tree().get_by_slug(value)
+        if category is None:
+            return queryset.none()
+        return queryset.filter(
+            pk__in=Category.products_in_range(category['tree_id'], category['lft'], category['rght'])
+        )
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """
+    Resolves the `search` query parameter through the catalog search index
+    instead of `icontains` lookups, ordering the results by relevance.
+
+    A search with no exact results is retried with typo-tolerant matching;
+    the corrected query is then left on the view as `did_you_mean`.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        results = search_products(query, queryset)
+        if not results.exists():
+            results, view.did_you_mean = fuzzy_search(query, queryset)
+        return results
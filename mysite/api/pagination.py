@@ -0,0 +1,55 @@
+
+from collections import OrderedDict
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from catalog.pagination import EstimatedCountPaginator, InvalidCursor, KeysetPaginator
+
+
+class OptionalCursorPagination(PageNumberPagination):
+    """
+    Page-number pagination with a capped/estimated count, switching to keyset
+    pagination when the request carries a `cursor` parameter (empty for the
+    first page). Cursor pages are keyed on the active ordering, so they work
+    with `?ordering=` and never count or OFFSET through earlier rows.
+    """
+    django_paginator_class = EstimatedCountPaginator
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.keyset_page = None
+        if self.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view=view)
+
+        paginator = KeysetPaginator(queryset, self.get_page_size(request))
+        try:
+            self.keyset_page = paginator.page(request.query_params.get(self.cursor_query_param) or None)
+        except InvalidCursor:
+            raise NotFound('Invalid cursor.')
+        return list(self.keyset_page.object_list)
+
+    def get_paginated_response(self, data):
+        if self.keyset_page is None:
+            response = super().get_paginated_response(data)
+            response.data['count_is_estimate'] = self.page.paginator.count_is_estimate
+            return response
+        return Response(OrderedDict([
+            ('next', self._cursor_link(self.keyset_page.next_cursor)),
+            ('previous', self._cursor_link(self.keyset_page.previous_cursor)),
+            ('results', data),
+        ]))
+
+    def _cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response_schema(self, schema):
+        schema = super().get_paginated_response_schema(schema)
+        schema['properties']['count_is_estimate'] = {'type': 'boolean'}
+        return schema
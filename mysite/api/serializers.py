@@ -1,16 +1,40 @@
+from decimal import Decimal
 
-from django.db import transaction
 from rest_framework import serializers
-from catalog.models import Product, Category, ProductVariant, ProductImage
+from catalog.models import Product, ProductCard, Category, ProductVariant, ProductImage
+from catalog.wishlists import MAX_BULK_PRODUCTS, request_wishlist_ids
+from cart.stores import ADD, OPERATIONS, REMOVE
 from accounts.models import User
+from orders.checkout import CheckoutError, place_order
 from orders.models import Order, OrderItem
 from reviews.models import Review
 from pages.models import Contact
 
+class InWishlistField(serializers.ReadOnlyField):
+    """
+    Whether the product (or card) is on the requesting user's wishlist, checked
+    against the user's wishlist id set, which is loaded once per request.
+    """
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        request = self.context.get('request')
+        return request is not None and instance.pk in request_wishlist_ids(request)
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
+    """
+    Derivative URLs come from the names recorded when the image was rendered,
+    falling back to the original while rendering is pending.
+    """
     class Meta:
         model = ProductImage
-        fields = ['image', 'alt_text']
+        fields = [
+            'image', 'alt_text', 'derivatives_ready', 'thumbnail_url', 'medium_url', 'large_url',
+            'avif_srcset', 'webp_srcset',
+        ]
 
 
 class ProductVariantSerializer(serializers.ModelSerializer):
@@ -23,16 +47,42 @@ class ProductSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     variants = ProductVariantSerializer(many=True, read_only=True)
     category = serializers.StringRelatedField()
+    in_wishlist = InWishlistField()
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'slug', 'description', 'brand', 'category', 'images', 'variants']
+        fields = ['id', 'name', 'slug', 'description', 'brand', 'category', 'images', 'variants', 'in_wishlist']
+
+
+# Flat, denormalized representation used for listing pages
+class ProductCardSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='product_id', read_only=True)
+    in_wishlist = InWishlistField()
+
+    class Meta:
+        model = ProductCard
+        fields = [
+            'id', 'name', 'slug', 'summary', 'brand', 'brand_name', 'brand_slug',
+            'category_ids', 'min_price', 'max_price', 'in_stock', 'image_alt',
+            'thumbnail_url', 'medium_url', 'large_url', 'rating_average', 'rating_count',
+            'in_wishlist',
+        ]
+
+
+class WishlistUpdateSerializer(serializers.Serializer):
+    add = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+    remove = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+
+    def validate(self, data):
+        if len(data['add']) + len(data['remove']) > MAX_BULK_PRODUCTS:
+            raise serializers.ValidationError(f'At most {MAX_BULK_PRODUCTS} products can be changed at once.')
+        return data
 
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug', 'description', 'parent']
+        fields = ['id', 'name', 'slug', 'description', 'parent', 'product_count']
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -43,23 +93,27 @@ class UserSerializer(serializers.ModelSerializer):
 
 # Optimized for displaying order details
 class OrderItemSerializer(serializers.ModelSerializer):
-    # Use a custom field to get the full product name
-    product_name = serializers.CharField(source='variant.display_name', read_only=True)
-    price = serializers.DecimalField(source='variant.price', max_digits=10, decimal_places=2, read_only=True)
+    # The full product name ("<product> - <variant>"); null once the variant is deleted
+    product_name = serializers.CharField(source='variant', read_only=True)
+    price = serializers.DecimalField(source='price_at_purchase', max_digits=10, decimal_places=2, read_only=True)
+    # Annotated by OrderItem.objects.with_subtotals()
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
 
     class Meta:
         model = OrderItem
-        fields = ['id', 'product_name', 'quantity', 'price']
+        fields = ['id', 'product_name', 'quantity', 'price', 'subtotal']
 
 
-# Optimized for displaying orders
+# Optimized for displaying orders; expects Order.objects.with_totals()
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     user = UserSerializer(read_only=True)
+    item_count = serializers.IntegerField(source='line_count', read_only=True)
+    quantity = serializers.IntegerField(source='items_quantity', read_only=True)
 
     class Meta:
         model = Order
-        fields = ['id', 'user', 'status', 'total', 'placed_at', 'items']
+        fields = ['id', 'user', 'status', 'total', 'item_count', 'quantity', 'placed_at', 'items']
 
 
 class ReviewSerializer(serializers.ModelSerializer):
@@ -82,6 +136,70 @@ class CartItemSerializer(serializers.Serializer):
     quantity = serializers.IntegerField(min_value=1)
 
 
+MAX_CART_OPERATIONS = 100
+
+
+class CartOperationSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=OPERATIONS, default=ADD)
+    variant_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=0, default=1)
+
+
+class CartBatchSerializer(serializers.Serializer):
+    """
+    Cart operations applied in order. The variants added or updated are all
+    fetched with one in_bulk query and must belong to active products; they
+    are kept in `variants` for the response.
+    """
+    operations = CartOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, operations):
+        if len(operations) > MAX_CART_OPERATIONS:
+            raise serializers.ValidationError(f'At most {MAX_CART_OPERATIONS} operations can be applied at once.')
+        if any(op['action'] == ADD and op['quantity'] < 1 for op in operations):
+            raise serializers.ValidationError('Added quantities must be at least 1.')
+        ids = {op['variant_id'] for op in operations if op['action'] != REMOVE}
+        self.variants = (
+            ProductVariant.objects.filter(product__is_active=True).select_related('product').in_bulk(ids)
+        )
+        missing = sorted(ids - self.variants.keys())
+        if missing:
+            raise serializers.ValidationError(
+                f"Unknown or unavailable variants: {', '.join(map(str, missing))}."
+            )
+        return [(op['action'], op['variant_id'], op['quantity']) for op in operations]
+
+
+class CartLineSerializer(serializers.Serializer):
+    variant_id = serializers.IntegerField()
+    sku = serializers.CharField(source='variant.sku')
+    name = serializers.CharField(source='variant.name')
+    product_name = serializers.CharField(source='variant.product.name')
+    product_slug = serializers.CharField(source='variant.product.slug')
+    price = serializers.DecimalField(source='variant.price', max_digits=10, decimal_places=2)
+    quantity = serializers.IntegerField()
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class CartSerializer(serializers.Serializer):
+    """ A cart's items with their totals, from a dict of `id` and `items` (the store's lines). """
+    id = serializers.UUIDField(allow_null=True)
+    items = CartLineSerializer(many=True)
+    item_count = serializers.SerializerMethodField()
+    quantity = serializers.SerializerMethodField()
+    subtotal = serializers.SerializerMethodField()
+
+    def get_item_count(self, cart):
+        return len(cart['items'])
+
+    def get_quantity(self, cart):
+        return sum(line.quantity for line in cart['items'])
+
+    def get_subtotal(self, cart):
+        subtotal = sum((line.subtotal for line in cart['items']), Decimal('0.00'))
+        return serializers.DecimalField(max_digits=12, decimal_places=2).to_representation(subtotal)
+
+
 class OrderCreateSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, write_only=True)
 
@@ -90,51 +208,12 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         fields = ('items',)
 
     def create(self, validated_data):
-        items_data = validated_data.pop('items')
-        user = self.context['request'].user
-
-        # Start a database transaction
-        with transaction.atomic():
-            # Create the order instance
-            order = Order.objects.create(user=user, status='pending')
-            
-            total_price = 0
-            order_items = []
-
-            for item_data in items_data:
-                try:
-                    variant = ProductVariant.objects.select_for_update().get(id=item_data['variant_id'])
-                except ProductVariant.DoesNotExist:
-                    raise serializers.ValidationError(f"Variant with id {item_data['variant_id']} not found.")
-
-                # Check stock
-                if variant.stock < item_data['quantity']:
-                    raise serializers.ValidationError(f"Not enough stock for {variant.display_name}. Available: {variant.stock}")
-
-                # Create OrderItem
-                order_item = OrderItem(
-                    order=order,
-                    variant=variant,
-                    quantity=item_data['quantity']
-                )
-                order_items.append(order_item)
-                
-                total_price += variant.price * item_data['quantity']
-                
-                # Decrease stock
-                variant.stock -= item_data['quantity']
-
-            # Bulk create the order items for efficiency
-            OrderItem.objects.bulk_create(order_items)
-            
-            # Update variant stock in bulk
-            ProductVariant.objects.bulk_update([item.variant for item in order_items], ['stock'])
-
-            # Set the total price and save the order
-            order.total = total_price
-            order.save()
-
-        return order
+        # All variants are locked and their stock taken in a few statements (see orders.checkout).
+        items = [(item['variant_id'], item['quantity']) for item in validated_data['items']]
+        try:
+            return place_order(self.context['request'].user, items)
+        except CheckoutError as e:
+            raise serializers.ValidationError(str(e))
 
 class ContactSerializer(serializers.ModelSerializer):
     class Meta:
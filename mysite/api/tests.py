@@ -1,3 +1,78 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from catalog.models import Brand, Product, ProductVariant
+from catalog.suggest import suggestion_index
+
+
+class ProductSuggestTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        suggestion_index.reset()
+        brand = Brand.objects.create(name='Rolex', slug='rolex')
+        product = Product.objects.create(name='Submariner', slug='submariner', brand=brand)
+        ProductVariant.objects.create(product=product, sku='RLX-126610', name='Black', price=10)
+
+    def test_suggest_links_to_catalog_pages(self):
+        response = self.client.get('/api/v1/products/suggest/', {'q': 'sub'})
+        self.assertEqual(response.status_code, 200)
+        urls = [suggestion['url'] for suggestion in response.json()['suggestions']]
+        self.assertIn('/products/submariner/', urls)
+
+
+class CatalogExportTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        product = Product.objects.create(name='Submariner', slug='submariner')
+        ProductVariant.objects.create(product=product, sku='RLX-126610', name='Black', price=10)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+
+    def test_feed_links_to_product_pages(self):
+        response = self.client.get('/api/v1/catalog/export/xml/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/products/submariner/', b''.join(response.streaming_content).decode())
+
+    def test_error_is_raised_before_streaming(self):
+        with mock.patch.object(Product, 'get_absolute_url', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.get('/api/v1/catalog/export/csv/')
+
+
+class CartUpdateTests(TestCase):
+
+    def setUp(self):
+        product = Product.objects.create(name='Submariner', slug='submariner')
+        self.black = ProductVariant.objects.create(product=product, sku='RLX-126610', name='Black', price=10)
+        self.green = ProductVariant.objects.create(product=product, sku='RLX-126610LV', name='Green', price=12)
+        self.client.force_login(User.objects.create_user('buyer'))
+        self.client.post('/api/v1/cart/', {'variant_id': self.black.pk, 'quantity': 1}, content_type='application/json')
+
+    def cart_quantities(self):
+        return {item['variant_id']: item['quantity'] for item in self.client.get('/api/v1/cart/').json()['items']}
+
+    def test_update_changes_held_variant(self):
+        response = self.client.patch(
+            '/api/v1/cart/', {'variant_id': self.black.pk, 'quantity': 3}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cart_quantities(), {self.black.pk: 3})
+
+    def test_update_of_missing_variant_is_not_found(self):
+        response = self.client.patch(
+            '/api/v1/cart/', {'variant_id': self.green.pk, 'quantity': 2}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.cart_quantities(), {self.black.pk: 1})
+
+    def test_batch_skips_updates_of_missing_variants(self):
+        response = self.client.post('/api/v1/cart/batch/', {'operations': [
+            {'action': 'update', 'variant_id': self.green.pk, 'quantity': 2},
+            {'action': 'update', 'variant_id': self.black.pk, 'quantity': 4},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cart_quantities(), {self.black.pk: 4})
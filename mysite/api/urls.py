@@ -28,6 +28,14 @@ urlpatterns = [
 
     # Cart endpoint (not a standard ViewSet)
     path('cart/', views.CartView.as_view(), name='cart'),
+    path('cart/batch/', views.CartBatchView.as_view(), name='cart_batch'),
+
+    # Wishlist membership and bulk changes
+    path('wishlist/', views.WishlistView.as_view(), name='wishlist'),
+
+    # Staff catalog import and export
+    path('catalog/import/', views.CatalogImportView.as_view(), name='catalog_import'),
+    path('catalog/export/<str:feed>/', views.CatalogExportView.as_view(), name='catalog_export'),
     
     # Include the viewset routes
     path('', include(router.urls)),
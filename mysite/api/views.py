@@ -1,23 +1,48 @@
 
-from rest_framework import viewsets, permissions, mixins, status
+from rest_framework import viewsets, permissions, mixins, status, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.parsers import MultiPartParser
 from rest_framework.views import APIView
-from django.db.models import Sum, Count
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, Sum, Count
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags
 from django_filters.rest_framework import DjangoFilterBackend
-from catalog.models import Product, Category
+from catalog.facets import facet_counts
+from catalog.exporter import CONTENT_TYPES, FEED_FORMATS, export_lines
+from catalog.recommendations import bought_together
+from catalog.wishlists import add_products, remove_products, request_wishlist_ids
+from catalog.importer import CatalogImporter, guess_format, open_text, read_records
+from catalog.suggest import suggest as catalog_suggestions
+from catalog.tree import get_tree
+from catalog.filters import ProductFilter
+from catalog.models import Product, ProductCard, Category
+from cart.services import apply_batch, cart_lines, cart_quantities, clear_cart, user_cart
+from cart.stores import ADD, UPDATE
 from accounts.models import User
-from orders.models import Order
+from orders.models import Order, OrderItem
 from reviews.models import Review
 from pages.models import Contact
+from .filters import ProductFilterSet, ProductSearchFilter
+from .pagination import OptionalCursorPagination
 from .serializers import (
     ProductSerializer, 
+    ProductCardSerializer,
+    CartBatchSerializer,
+    CartSerializer,
     CategorySerializer, 
     UserSerializer, 
     OrderSerializer,
     OrderCreateSerializer,
     ReviewSerializer,
-    ContactSerializer
+    ContactSerializer,
+    WishlistUpdateSerializer,
 )
 
 
@@ -30,22 +55,93 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.AllowAny] # Allow public read-only access
     filterset_fields = ['name', 'parent__name'] 
     search_fields = ['name', 'description']
-    ordering_fields = ['name']
+    ordering_fields = ['name', 'product_count']
+
+    @action(detail=False)
+    def tree(self, request, *args, **kwargs):
+        """
+        `GET /api/v1/categories/tree/`: the whole hierarchy as nested nodes with
+        product counts, served from the in-memory category tree. Responses carry
+        an ETag, and a matching If-None-Match gets a 304.
+        """
+        tree = get_tree()
+        etag = f'"{tree.etag}"'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(tree.nested(), headers={'ETag': etag})
 
 
 class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API endpoint that allows products to be viewed.
-    Supports filtering, searching, and ordering.
+    Supports filtering, searching, ordering and opt-in keyset paging (`?cursor=`).
+    Searches go through the catalog search index and are ranked by relevance,
+    with any requested ordering used as a tie-breaker.
     """
     queryset = Product.objects.filter(is_active=True).prefetch_related('variants', 'images')
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny] # Allow public read-only access
-    filterset_fields = ['category__slug', 'brand', 'is_active']
-    search_fields = ['name', 'description']
+    pagination_class = OptionalCursorPagination
+    # Search runs last so its relevance ordering takes precedence.
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, ProductSearchFilter]
+    filterset_class = ProductFilterSet
     ordering_fields = ['name', 'brand', 'created_at']
     ordering = ['-created_at']
 
+    def list(self, request, *args, **kwargs):
+        """
+        List products, adding a `facets` block with brand, category, price
+        and attribute counts for the whole filtered result set, and a
+        `did_you_mean` query when a misspelt search had to be corrected.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        facets = facet_counts(queryset)
+        did_you_mean = getattr(self, 'did_you_mean', None)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+            response.data['facets'] = facets
+            response.data['did_you_mean'] = did_you_mean
+            return response
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response({'results': serializer.data, 'facets': facets, 'did_you_mean': did_you_mean})
+
+    @action(detail=True)
+    def related(self, request, pk=None):
+        """
+        `GET /api/v1/products/{id}/related/`: cards of the products most often
+        bought together with this one, read from the precomputed neighbour table.
+        """
+        if not pk.isdigit():
+            raise Http404
+        return Response(ProductCardSerializer(bought_together(pk), many=True, context=self.get_serializer_context()).data)
+
+    @action(detail=False)
+    def suggest(self, request, *args, **kwargs):
+        """
+        `GET /api/v1/products/suggest/?q=`: typeahead suggestions (products,
+        brands, categories and SKUs) answered from an in-memory prefix index.
+        """
+        query = request.query_params.get('q', '')
+        return Response({'query': query, 'suggestions': catalog_suggestions(query)})
+
+    @action(detail=False)
+    def cards(self, request, *args, **kwargs):
+        """
+        `GET /api/v1/products/cards/`: a page of flat product cards read from the
+        denormalized card table in a single query. Accepts the same parameters as
+        the HTML product list (`search`, `price_min`/`price_max`, `brand`,
+        `category`, `ordering`).
+        """
+        queryset = ProductFilter(request.query_params, queryset=ProductCard.objects.all(), request=request).qs
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(ProductCardSerializer(page, many=True, context=self.get_serializer_context()).data)
+        return Response(ProductCardSerializer(queryset, many=True, context=self.get_serializer_context()).data)
+
 
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -66,11 +162,12 @@ class OrderViewSet(mixins.CreateModelMixin,
     """
     API endpoint that allows users to create and view their orders.
 
-    - `GET /api/v1/orders/`: List all of the user's orders.
+    - `GET /api/v1/orders/`: List all of the user's orders (pass `cursor` for keyset paging).
     - `GET /api/v1/orders/{id}/`: Retrieve a specific order.
     - `POST /api/v1/orders/`: Create a new order.
     """
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OptionalCursorPagination
     filterset_fields = ['status', 'placed_at']
     ordering_fields = ['placed_at', 'total']
     ordering = ['-placed_at']
@@ -82,9 +179,11 @@ class OrderViewSet(mixins.CreateModelMixin,
         Admins can see all orders.
         """
         user = self.request.user
+        items = OrderItem.objects.with_subtotals().select_related('variant__product')
+        orders = Order.objects.with_totals().select_related('user').prefetch_related(Prefetch('items', queryset=items))
         if user.is_staff:
-            return Order.objects.all().prefetch_related('items__variant__product')
-        return Order.objects.filter(user=user).prefetch_related('items__variant__product')
+            return orders
+        return orders.filter(user=user)
 
     def get_serializer_class(self):
         """
@@ -97,7 +196,7 @@ class OrderViewSet(mixins.CreateModelMixin,
 class ReviewViewSet(viewsets.ModelViewSet):
     """
     API endpoint for product reviews.
-    - `GET /api/v1/reviews/`: List all reviews.
+    - `GET /api/v1/reviews/`: List all reviews (pass `cursor` for keyset paging).
     - `GET /api/v1/reviews/{id}/`: Retrieve a specific review.
     - `POST /api/v1/reviews/`: Create a new review.
     - `PATCH /api/v1/reviews/{id}/`: Update a review.
@@ -106,6 +205,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = OptionalCursorPagination
     filterset_fields = ['product', 'rating']
     search_fields = ['comment']
     ordering_fields = ['created_at', 'rating']
@@ -123,43 +223,142 @@ class ContactViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
     permission_classes = [permissions.AllowAny]
 
 class CartView(APIView):
+    """
+    The requesting user's cart, the same `Cart` the web shop uses:
+    - `GET /api/v1/cart/`: Its items and totals.
+    - `POST /api/v1/cart/`: Add a variant (`{"variant_id": id, "quantity": n}`).
+    - `PATCH /api/v1/cart/`: Set the quantity of a variant in the cart; 0 removes it.
+      Variants not in the cart are a 404 (they are added with POST).
+    - `DELETE /api/v1/cart/`: Empty the cart.
+
+    Changes respond with the updated items and totals.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
+    def cart_response(self, cart):
+        lines = cart_lines(cart.id) if cart else []
+        return Response(CartSerializer({'id': cart.id if cart else None, 'items': lines}).data)
+
+    def validate(self, operations):
+        serializer = CartBatchSerializer(data={'operations': operations})
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['operations']
+
+    def apply(self, operations):
+        operations = self.validate(operations)
+        cart = user_cart(self.request.user, create=True)
+        apply_batch(cart.id, operations)
+        return self.cart_response(cart)
+
     def get(self, request, *args, **kwargs):
-        cart = request.session.get('cart', {})
-        return Response(cart, status=status.HTTP_200_OK)
+        return self.cart_response(user_cart(request.user))
 
     def post(self, request, *args, **kwargs):
-        cart = request.session.get('cart', {})
-        variant_id = request.data.get('variant_id')
-        quantity = request.data.get('quantity', 1)
-
-        if variant_id in cart:
-            cart[variant_id]['quantity'] += quantity
-        else:
-            cart[variant_id] = {'quantity': quantity}
-        
-        request.session['cart'] = cart
-        return Response(cart, status=status.HTTP_200_OK)
+        return self.apply([{
+            'action': ADD, 'variant_id': request.data.get('variant_id'), 'quantity': request.data.get('quantity', 1),
+        }])
 
     def patch(self, request, *args, **kwargs):
-        cart = request.session.get('cart', {})
-        variant_id = request.data.get('variant_id')
-        quantity = request.data.get('quantity')
-
-        if variant_id in cart:
-            if quantity <= 0:
-                del cart[variant_id]
-            else:
-                cart[variant_id]['quantity'] = quantity
-
-        request.session['cart'] = cart
-        return Response(cart, status=status.HTTP_200_OK)
+        operations = self.validate([{
+            'action': UPDATE, 'variant_id': request.data.get('variant_id'), 'quantity': request.data.get('quantity'),
+        }])
+        cart = user_cart(request.user)
+        if cart is None or operations[0][1] not in cart_quantities(cart.id):
+            raise NotFound('Your cart does not hold this variant.')
+        apply_batch(cart.id, operations)
+        return self.cart_response(cart)
 
     def delete(self, request, *args, **kwargs):
-        request.session['cart'] = {}
+        cart = user_cart(request.user)
+        if cart:
+            clear_cart(cart.id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+class CartBatchView(CartView):
+    """
+    - `POST /api/v1/cart/batch/`: Apply many operations to the cart in one transaction
+      (`{"operations": [{"action": "add" | "update" | "remove", "variant_id": id, "quantity": n}]}`),
+      in order; responds with the updated items and totals. Updates of variants
+      not in the cart are skipped.
+    """
+    http_method_names = ['post', 'options']
+
+    def post(self, request, *args, **kwargs):
+        return self.apply(request.data.get('operations'))
+
+class WishlistView(APIView):
+    """
+    - `GET /api/v1/wishlist/`: The ids of the products on the user's wishlist.
+    - `POST /api/v1/wishlist/`: Add and remove many products at once
+      (`{"add": [ids], "remove": [ids]}`): one INSERT and one DELETE.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        return Response({'product_ids': sorted(request_wishlist_ids(request))})
+
+    def post(self, request, *args, **kwargs):
+        serializer = WishlistUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        added = add_products(request.user, serializer.validated_data['add'])
+        removed = remove_products(request.user, serializer.validated_data['remove'])
+        return Response({'added': sorted(added), 'removed': removed}, status=status.HTTP_200_OK)
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class CatalogImportView(APIView):
+    """
+    - `POST /api/v1/catalog/import/`: Import an uploaded CSV or JSON Lines catalog file
+      (`file`, optional `format`, `dry_run` and `batch_size`). Staff only.
+
+    Each batch commits on its own, like the import_catalog command; images are read
+    from the CATALOG_IMPORT_IMAGES_DIR setting.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        uploaded = request.FILES.get('file')
+        if uploaded is None:
+            return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('format') or guess_format(uploaded.name)
+        if file_format not in ('csv', 'jsonl'):
+            return Response({'format': ['Expected "csv" or "jsonl".']}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            batch_size = int(request.data.get('batch_size', 500))
+        except ValueError:
+            return Response({'batch_size': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        importer = CatalogImporter(
+            batch_size=max(1, min(batch_size, 5000)),
+            images_dir=getattr(settings, 'CATALOG_IMPORT_IMAGES_DIR', None),
+            dry_run=request.data.get('dry_run') in ('1', 'true', 'True'),
+        )
+        report = importer.run(read_records(open_text(uploaded), file_format))
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class CatalogExportView(APIView):
+    """
+    - `GET /api/v1/catalog/export/<feed>/`: Stream the catalog as `csv`, `jsonl` or a Google
+      Merchant `xml` feed; `?since=<ISO 8601 time>` only returns items changed since then. Staff only.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, feed, *args, **kwargs):
+        if feed not in FEED_FORMATS:
+            return Response({'detail': 'Unknown feed format.'}, status=status.HTTP_404_NOT_FOUND)
+        since = request.query_params.get('since')
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                return Response({'since': ['Invalid date and time.']}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        lines = export_lines(feed, since=since or None, base_url=request.build_absolute_uri('/'))
+        response = StreamingHttpResponse(lines, content_type=CONTENT_TYPES[feed])
+        response['Content-Disposition'] = f'attachment; filename="catalog.{feed}"'
+        return response
+
 class PaymentViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
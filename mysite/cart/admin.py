@@ -12,14 +12,38 @@ class CartItemInline(admin.TabularInline):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'session_key', 'created_at', 'updated_at')
+    list_display = ('id', 'user', 'session_key', 'line_count', 'items_quantity', 'items_subtotal', 'created_at', 'updated_at')
     list_filter = ('created_at', 'updated_at')
+    list_select_related = ('user',)
     search_fields = ('user__email', 'session_key')
     inlines = [CartItemInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
+
+    @admin.display(description='Lines', ordering='line_count')
+    def line_count(self, obj):
+        return obj.line_count
+
+    @admin.display(description='Quantity', ordering='items_quantity')
+    def items_quantity(self, obj):
+        return obj.items_quantity
+
+    @admin.display(description='Subtotal', ordering='items_subtotal')
+    def items_subtotal(self, obj):
+        return obj.items_subtotal
+
 
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
-    list_display = ('cart', 'variant', 'quantity')
+    list_display = ('cart', 'variant', 'quantity', 'line_subtotal')
+    list_select_related = ('variant__product',)
     search_fields = ('cart__id', 'variant__sku', 'variant__name')
     autocomplete_fields = ['cart', 'variant']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_subtotals()
+
+    @admin.display(description='Subtotal', ordering='line_subtotal')
+    def line_subtotal(self, obj):
+        return obj.line_subtotal
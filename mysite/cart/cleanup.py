@@ -0,0 +1,41 @@
+"""
+Garbage collection of abandoned anonymous carts.
+
+Every anonymous visitor who adds an item gets a Cart row. Anonymous carts
+left unchanged for CART_ABANDONED_DAYS days are deleted, oldest first and
+batch_size carts per transaction: each batch reads its ids through the
+(user, updated_at) index and deletes them together with their items, so no
+batch holds locks for long. Carts of users are kept, and carts filled
+anonymously become the user's on login (see services.merge_session_cart).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Cart
+from .stores import get_cart_store
+from .summary import invalidate_summaries
+
+
+def abandoned_carts(days=None):
+    days = settings.CART_ABANDONED_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    return Cart.objects.filter(user__isnull=True, updated_at__lt=cutoff)
+
+
+def delete_abandoned_carts(days=None, batch_size=1000):
+    """ Delete the abandoned anonymous carts; returns how many were deleted. """
+    carts = abandoned_carts(days).order_by('updated_at').values_list('pk', flat=True)
+    store = get_cart_store()
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(carts[:batch_size])
+            if not ids:
+                return deleted
+            Cart.objects.filter(pk__in=ids).delete()
+        store.forget(ids)
+        invalidate_summaries(ids)
+        deleted += len(ids)
@@ -1,17 +1,11 @@
+from django.utils.functional import SimpleLazyObject
 
-from .models import Cart
+from .summary import request_cart_summary
 
 def cart(request):
     """
-    A context processor to make the cart available on all pages.
+    A context processor to make the cart summary (item count, quantity,
+    subtotal) available on all pages. It is resolved lazily from the cart
+    summary cache, so pages that don't show it cost nothing.
     """
-    cart_obj = None
-    cart_id = request.session.get('cart_id')
-    if cart_id:
-        try:
-            cart_obj = Cart.objects.get(id=cart_id)
-        except Cart.DoesNotExist:
-            # If cart_id in session is invalid, remove it
-            request.session.pop('cart_id', None)
-            
-    return {'cart': cart_obj}
+    return {'cart_summary': SimpleLazyObject(lambda: request_cart_summary(request))}
@@ -0,0 +1,43 @@
+
+from django.core.management.base import BaseCommand, CommandError
+from catalog.utils import chunked
+from cart.stores import RedisCartStore, get_cart_store
+
+
+class Command(BaseCommand):
+    help = 'Checks that the carts held in Redis match their persisted cart items.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of carts compared per batch.'
+        )
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Persist the carts that differ from their cart items.'
+        )
+
+    def handle(self, *args, **options):
+        store = get_cart_store()
+        if not isinstance(store, RedisCartStore):
+            raise CommandError('Carts are kept in the database (CART_STORE), there is nothing to check.')
+
+        checked = 0
+        inconsistent = 0
+        for cart_ids in chunked(store.cart_ids(), options['batch_size']):
+            checked += len(cart_ids)
+            for cart_id in store.inconsistent(cart_ids):
+                inconsistent += 1
+                self.stdout.write(f'Cart {cart_id} differs from its persisted items.')
+                if options['fix']:
+                    store.persist(cart_id)
+
+        if inconsistent and not options['fix']:
+            raise CommandError(f'{inconsistent} of {checked} carts differ from their persisted items.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully checked {checked} carts ({inconsistent} fixed).'
+            if inconsistent else f'Successfully checked {checked} carts.'
+        ))
@@ -0,0 +1,36 @@
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from cart.cleanup import abandoned_carts, delete_abandoned_carts
+
+
+class Command(BaseCommand):
+    help = 'Deletes anonymous carts that have not changed for a number of days.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.CART_ABANDONED_DAYS,
+            help='Age in days after which an unchanged anonymous cart is abandoned.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of carts deleted per transaction.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the abandoned carts.'
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = abandoned_carts(options['days']).count()
+            self.stdout.write(f'{count} abandoned carts would be deleted.')
+            return
+
+        deleted = delete_abandoned_carts(options['days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully deleted {deleted} abandoned carts.'))
@@ -1,10 +1,37 @@
 
 import uuid
 from django.db import models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from catalog.models import ProductVariant
 
 
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotate each cart with its line count (`line_count`), number of units
+        (`items_quantity`) and subtotal at current prices (`items_subtotal`),
+        all computed by one aggregate query.
+        """
+        return self.annotate(
+            line_count=Count('items'),
+            items_quantity=Coalesce(Sum('items__quantity'), 0),
+            items_subtotal=Coalesce(
+                Sum(F('items__quantity') * F('items__variant__price'), output_field=DecimalField()), 0,
+                output_field=DecimalField(),
+            ),
+        )
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_subtotals(self):
+        """ Annotate each item with `line_subtotal`, its quantity times the variant's price. """
+        return self.annotate(
+            line_subtotal=ExpressionWrapper(F('quantity') * F('variant__price'), output_field=DecimalField())
+        )
+
+
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(
@@ -18,18 +45,33 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # The user's latest cart, and abandoned anonymous carts (user IS NULL) by age.
+            models.Index(fields=['user', 'updated_at'], name='cart_user_updated_idx'),
+        ]
+
     def __str__(self):
         if self.user:
             return f"Cart for {self.user.email}"
         return f"Anonymous Cart - {self.session_key or self.id}"
 
+    def _totals(self):
+        # Carts fetched with_totals() carry the annotations already.
+        if not hasattr(self, 'items_subtotal'):
+            totals = Cart.objects.filter(pk=self.pk).with_totals().values('items_quantity', 'items_subtotal').get()
+            self.items_quantity, self.items_subtotal = totals['items_quantity'], totals['items_subtotal']
+        return self.items_quantity, self.items_subtotal
+
     @property
     def total_price(self):
-        return sum(item.subtotal for item in self.items.all())
+        return self._totals()[1]
 
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self._totals()[0]
 
 
 class CartItem(models.Model):
@@ -38,6 +80,8 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         # Ensures a product variant can only appear once in a cart.
         # To change quantity, you update the existing record.
@@ -49,6 +93,8 @@ class CartItem(models.Model):
 
     @property
     def subtotal(self):
+        if hasattr(self, 'line_subtotal'):
+            return self.line_subtotal
         # Ensure variant has a price before calculating
         if self.variant and self.variant.price is not None:
             return self.variant.price * self.quantity
@@ -0,0 +1,130 @@
+"""
+Cart operations shared by the web shop and the API.
+
+Views find the cart with session_cart() or user_cart() and change it only
+through these functions. The configured cart store writes the items (adding
+is a single upsert statement with the database store), and every change
+marks the cart as updated (see cart.cleanup) and writes its summary through
+once it commits. Totals come from that summary, one aggregate query, rather
+than from summing items in Python. When a visitor logs in, the cart they
+filled anonymously is merged into their own (merge_session_cart).
+"""
+from django.core.exceptions import ValidationError
+
+from .models import Cart
+from .stores import get_cart_store
+from .summary import compute_summary, invalidate_summaries, write_through
+
+
+def create_cart(user, session_key=None):
+    """ Create a new cart, associated with the user if authenticated, else with the session. """
+    if user.is_authenticated:
+        return Cart.objects.create(user=user)
+    return Cart.objects.create(session_key=session_key)
+
+
+def session_cart(request, create=False):
+    """ The cart of the request's session, created (and remembered) if asked to. """
+    cart_id = request.session.get('cart_id')
+    cart = None
+    if cart_id:
+        try:
+            cart = Cart.objects.filter(pk=cart_id).first()
+        except ValidationError:
+            pass
+    if cart is None and create:
+        if request.session.session_key is None:
+            request.session.save()
+        cart = create_cart(request.user, request.session.session_key)
+        request.session['cart_id'] = str(cart.id)
+    return cart
+
+
+def user_cart(user, create=False):
+    """ The user's most recently changed cart, created if asked to. """
+    cart = Cart.objects.filter(user=user).order_by('-updated_at').first()
+    if cart is None and create:
+        cart = create_cart(user)
+    return cart
+
+
+def _changed(cart_id):
+    get_cart_store().touch(cart_id)
+    write_through(cart_id)
+
+
+def clean_quantity(quantity):
+    """ A quantity as given in a form, as an int of at least 1; raises ValidationError otherwise. """
+    try:
+        quantity = int(quantity)
+    except (TypeError, ValueError):
+        raise ValidationError('Enter a whole number of items.')
+    if quantity < 1:
+        raise ValidationError('Enter a quantity of at least 1.')
+    return quantity
+
+
+def add_item(cart_id, variant_id, quantity=1):
+    get_cart_store().add(cart_id, variant_id, clean_quantity(quantity))
+    _changed(cart_id)
+
+
+def set_item(cart_id, variant_id, quantity):
+    """ Change an item's quantity; returns False if the cart doesn't hold the variant. """
+    changed = get_cart_store().set(cart_id, variant_id, clean_quantity(quantity))
+    if changed:
+        _changed(cart_id)
+    return changed
+
+
+def remove_item(cart_id, variant_id):
+    """ Remove an item; returns False if the cart doesn't hold the variant. """
+    removed = get_cart_store().remove(cart_id, variant_id)
+    if removed:
+        _changed(cart_id)
+    return removed
+
+
+def apply_batch(cart_id, operations):
+    """ Apply (action, variant id, quantity) operations, in order, at once. """
+    get_cart_store().apply(cart_id, operations)
+    _changed(cart_id)
+
+
+def clear_cart(cart_id):
+    get_cart_store().clear(cart_id)
+    _changed(cart_id)
+
+
+def cart_quantities(cart_id):
+    """ {variant id: quantity} of a cart's items. """
+    return get_cart_store().quantities(cart_id)
+
+
+def cart_lines(cart_id):
+    return get_cart_store().lines(cart_id)
+
+
+def cart_totals(cart_id):
+    """ Line count, quantity and subtotal of a cart (see cart.summary). """
+    return compute_summary(cart_id)
+
+
+def merge_session_cart(request, user):
+    """
+    Make the anonymous cart of the session the user's: it simply becomes
+    theirs if they have no cart yet, otherwise its items are added to their
+    most recent cart in one statement and it is deleted.
+    """
+    cart = session_cart(request)
+    if cart is None or cart.user_id is not None:
+        return
+    target = user_cart(user)
+    if target is None:
+        Cart.objects.filter(pk=cart.pk).update(user=user, session_key=request.session.session_key)
+        return
+    get_cart_store().merge(cart.pk, target.pk)
+    Cart.objects.filter(pk=cart.pk).delete()
+    request.session['cart_id'] = str(target.pk)
+    _changed(target.pk)
+    invalidate_summaries([cart.pk])
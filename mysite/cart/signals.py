@@ -0,0 +1,19 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from catalog.signals import products_changed
+from .services import merge_session_cart
+from .summary import invalidate_for_products
+
+
+@receiver(products_changed)
+def invalidate_cart_summaries(sender, product_ids, **kwargs):
+    # Cart subtotals depend on the current variant prices.
+    invalidate_for_products(product_ids)
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    # Logins outside of a request (e.g. the test client's force_login) have no session cart.
+    if request is not None and hasattr(request, 'session'):
+        merge_session_cart(request, user)
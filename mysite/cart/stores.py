@@ -0,0 +1,451 @@
+"""
+Cart item storage, selected with the CART_STORE setting ('database' or 'redis').
+
+DatabaseCartStore keeps cart items as CartItem rows, written synchronously.
+
+RedisCartStore keeps the items of active carts in Redis hashes
+(cart:items:<cart id>, variant id -> quantity), changed atomically with
+HINCRBY/HSET/HDEL, so adding to or changing a cart never writes to the
+database. A hash is loaded from the CartItem rows the first time the cart is
+touched (marked by its LOADED_FIELD), and every changed cart id is added to
+a dirty set. flush() persists the dirty carts to CartItem rows in batches
+(write-behind, from a periodic task) and persist() does so for one cart, at
+checkout. Cart rows themselves are still created in the database, once per
+cart.
+"""
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+from catalog.models import ProductVariant
+from .models import Cart, CartItem
+
+CART_STORES = {}
+
+# Add to a cart item's quantity in one statement, by database vendor.
+UPSERT_SQL = {
+    'postgresql': (
+        'INSERT INTO {table} (cart_id, variant_id, quantity, added_at) VALUES (%s, %s, %s, %s) '
+        'ON CONFLICT (cart_id, variant_id) DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity'
+    ),
+    'sqlite': (
+        'INSERT INTO {table} (cart_id, variant_id, quantity, added_at) VALUES (%s, %s, %s, %s) '
+        'ON CONFLICT (cart_id, variant_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity'
+    ),
+    'mysql': (
+        'INSERT INTO {table} (cart_id, variant_id, quantity, added_at) VALUES (%s, %s, %s, %s) '
+        'ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)'
+    ),
+}
+
+# Add the items of one cart to another's in one statement, by database vendor.
+MERGE_SQL = {
+    'postgresql': (
+        'INSERT INTO {table} (cart_id, variant_id, quantity, added_at) '
+        'SELECT %s, variant_id, quantity, added_at FROM {table} WHERE cart_id = %s '
+        'ON CONFLICT (cart_id, variant_id) DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity'
+    ),
+    'sqlite': (
+        'INSERT INTO {table} (cart_id, variant_id, quantity, added_at) '
+        'SELECT %s, variant_id, quantity, added_at FROM {table} WHERE cart_id = %s '
+        'ON CONFLICT (cart_id, variant_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity'
+    ),
+    'mysql': (
+        'INSERT INTO {table} (cart_id, variant_id, quantity, added_at) '
+        'SELECT %s, variant_id, quantity, added_at FROM {table} AS source WHERE source.cart_id = %s '
+        'ON DUPLICATE KEY UPDATE quantity = {table}.quantity + VALUES(quantity)'
+    ),
+}
+
+# Batch operations: add to the quantity, set the quantity of an item already in
+# the cart (0 removes it; variants not in the cart are skipped), remove the item.
+ADD, UPDATE, REMOVE = 'add', 'update', 'remove'
+OPERATIONS = (ADD, UPDATE, REMOVE)
+
+
+def _execute(sql, values):
+    """ Run one of the statements above with (CartItem field name, value) parameters. """
+    opts = CartItem._meta
+    params = [opts.get_field(name).get_db_prep_save(value, connection) for name, value in values]
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(table=connection.ops.quote_name(opts.db_table)), params)
+
+
+def apply_operations(quantities, operations):
+    """ The {variant id: quantity} resulting from applying (action, variant id, quantity) operations in order. """
+    quantities = dict(quantities)
+    for action, variant_id, quantity in operations:
+        if action == ADD:
+            quantities[variant_id] = quantities.get(variant_id, 0) + quantity
+        elif action == UPDATE and quantity > 0:
+            if variant_id in quantities:
+                quantities[variant_id] = quantity
+        else:
+            quantities.pop(variant_id, None)
+    return quantities
+
+
+class DatabaseCartStore:
+    """ Cart items as CartItem rows. """
+
+    def quantities(self, cart_id):
+        """ {variant id: quantity} of a cart. """
+        return dict(CartItem.objects.filter(cart_id=cart_id).values_list('variant_id', 'quantity'))
+
+    def add(self, cart_id, variant_id, quantity):
+        """
+        Add to an item's quantity, creating the item if needed, in a single
+        upsert statement where the database has one. Elsewhere, an INSERT that
+        hits the (cart, variant) unique constraint falls back to an UPDATE.
+        """
+        sql = UPSERT_SQL.get(connection.vendor)
+        if sql is not None:
+            _execute(sql, [
+                ('cart', cart_id), ('variant', variant_id), ('quantity', quantity), ('added_at', timezone.now()),
+            ])
+            return
+        try:
+            with transaction.atomic():
+                CartItem.objects.create(cart_id=cart_id, variant_id=variant_id, quantity=quantity)
+        except IntegrityError:
+            CartItem.objects.filter(cart_id=cart_id, variant_id=variant_id).update(quantity=F('quantity') + quantity)
+
+    def set(self, cart_id, variant_id, quantity):
+        """ Change the quantity of an item; returns False if the cart doesn't hold the variant. """
+        return bool(CartItem.objects.filter(cart_id=cart_id, variant_id=variant_id).update(quantity=quantity))
+
+    def remove(self, cart_id, variant_id):
+        """ Remove an item; returns False if the cart doesn't hold the variant. """
+        deleted, _ = CartItem.objects.filter(cart_id=cart_id, variant_id=variant_id).delete()
+        return bool(deleted)
+
+    def clear(self, cart_id):
+        CartItem.objects.filter(cart_id=cart_id).delete()
+
+    def apply(self, cart_id, operations):
+        """ Apply many operations to a cart at once: one upsert and one delete. """
+        with transaction.atomic():
+            # Lock the cart so concurrent batches apply one after the other.
+            list(Cart.objects.select_for_update().filter(pk=cart_id).values_list('pk'))
+            current = self.quantities(cart_id)
+            wanted = apply_operations(current, operations)
+            removed = current.keys() - wanted.keys()
+            if removed:
+                CartItem.objects.filter(cart_id=cart_id, variant_id__in=removed).delete()
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(cart_id=cart_id, variant_id=variant_id, quantity=quantity)
+                    for variant_id, quantity in wanted.items() if current.get(variant_id) != quantity
+                ],
+                update_conflicts=True,
+                unique_fields=['cart', 'variant'],
+                update_fields=['quantity'],
+            )
+
+    def lines(self, cart_id):
+        """ The cart's items with their variants and products, for display. """
+        return list(
+            CartItem.objects.filter(cart_id=cart_id).with_subtotals()
+            .select_related('variant__product')
+            .prefetch_related('variant__product__images')
+        )
+
+    def summary(self, cart_id):
+        """ Line count, quantity and subtotal of a cart, or None if there is no such cart. """
+        row = (
+            Cart.objects.filter(pk=cart_id).with_totals()
+            .values('updated_at', 'line_count', 'items_quantity', 'items_subtotal')
+            .order_by('pk')
+            .first()
+        )
+        if row is None:
+            return None
+        return {
+            'updated_at': row['updated_at'],
+            'item_count': row['line_count'],
+            'quantity': row['items_quantity'],
+            'subtotal': row['items_subtotal'],
+        }
+
+    def merge(self, source_id, target_id):
+        """
+        Add the items of the source cart to the target cart's, summing the
+        quantities of variants both hold: one INSERT ... SELECT upsert where
+        the database has one, otherwise one UPDATE and one INSERT.
+        """
+        sql = MERGE_SQL.get(connection.vendor)
+        if sql is not None:
+            _execute(sql, [('cart', target_id), ('cart', source_id)])
+            return
+        source = CartItem.objects.filter(cart_id=source_id)
+        CartItem.objects.filter(cart_id=target_id, variant_id__in=source.values('variant_id')).update(
+            quantity=F('quantity') + Subquery(source.filter(variant_id=OuterRef('variant_id')).values('quantity')[:1])
+        )
+        missing = source.exclude(variant_id__in=CartItem.objects.filter(cart_id=target_id).values('variant_id'))
+        CartItem.objects.bulk_create([
+            CartItem(cart_id=target_id, variant_id=variant_id, quantity=quantity)
+            for variant_id, quantity in missing.values_list('variant_id', 'quantity')
+        ])
+
+    def touch(self, cart_id):
+        """ Record that a cart changed (abandoned carts are found by their updated_at). """
+        Cart.objects.filter(pk=cart_id).update(updated_at=timezone.now())
+
+    def forget(self, cart_ids):
+        """ Drop whatever the store keeps besides the rows of carts about to be deleted. """
+
+    def persist(self, cart_id):
+        pass
+
+    def flush(self, batch_size=500):
+        return 0
+
+
+class RedisCartStore(DatabaseCartStore):
+    """ Cart items as Redis hashes, persisted to CartItem rows write-behind. """
+    key_prefix = 'cart:items:'
+    dirty_key = 'cart:dirty'
+    LOADED_FIELD = '_'
+    # Hashes of carts untouched for this long expire; flushes run far more often.
+    timeout = 60 * 60 * 24 * 30
+
+    # Fill a hash from the database rows unless it was loaded already.
+    LOAD_SCRIPT = """
+    if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+        redis.call('HSET', KEYS[1], unpack(ARGV))
+    end
+    """
+    # Set a quantity only if the variant is in the cart.
+    SET_SCRIPT = """
+    if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self):
+        # Imported here so the database store works without django-redis configured.
+        from django_redis import get_redis_connection
+
+        self.redis = get_redis_connection(getattr(settings, 'CART_STORE_REDIS_ALIAS', 'default'))
+        self.load_script = self.redis.register_script(self.LOAD_SCRIPT)
+        self.set_script = self.redis.register_script(self.SET_SCRIPT)
+
+    def key(self, cart_id):
+        return f'{self.key_prefix}{cart_id}'
+
+    def load(self, cart_id):
+        """ Make sure the cart's hash holds its persisted items. """
+        key = self.key(cart_id)
+        if self.redis.hexists(key, self.LOADED_FIELD):
+            return key
+        fields = [self.LOADED_FIELD, 1]
+        for variant_id, quantity in super().quantities(cart_id).items():
+            fields.extend([variant_id, quantity])
+        self.load_script(keys=[key], args=fields)
+        self.redis.expire(key, self.timeout)
+        return key
+
+    def _changed(self, pipe, key, cart_id):
+        pipe.expire(key, self.timeout)
+        pipe.sadd(self.dirty_key, str(cart_id))
+
+    def quantities(self, cart_id):
+        values = self.redis.hgetall(self.load(cart_id))
+        return {
+            int(field): int(quantity)
+            for field, quantity in values.items()
+            if field.decode() != self.LOADED_FIELD and int(quantity) > 0
+        }
+
+    def add(self, cart_id, variant_id, quantity):
+        key = self.load(cart_id)
+        with self.redis.pipeline() as pipe:
+            pipe.hincrby(key, variant_id, quantity)
+            self._changed(pipe, key, cart_id)
+            pipe.execute()
+
+    def set(self, cart_id, variant_id, quantity):
+        key = self.load(cart_id)
+        if not self.set_script(keys=[key], args=[variant_id, quantity]):
+            return False
+        with self.redis.pipeline() as pipe:
+            self._changed(pipe, key, cart_id)
+            pipe.execute()
+        return True
+
+    def remove(self, cart_id, variant_id):
+        key = self.load(cart_id)
+        if not self.redis.hdel(key, variant_id):
+            return False
+        with self.redis.pipeline() as pipe:
+            self._changed(pipe, key, cart_id)
+            pipe.execute()
+        return True
+
+    def clear(self, cart_id):
+        key = self.key(cart_id)
+        with self.redis.pipeline() as pipe:
+            pipe.delete(key)
+            pipe.hset(key, self.LOADED_FIELD, 1)
+            self._changed(pipe, key, cart_id)
+            pipe.execute()
+
+    def apply(self, cart_id, operations):
+        """ Apply many operations to a cart at once, in one MULTI/EXEC transaction. """
+        key = self.load(cart_id)
+        with self.redis.pipeline() as pipe:
+            for action, variant_id, quantity in operations:
+                if action == ADD:
+                    pipe.hincrby(key, variant_id, quantity)
+                elif action == UPDATE and quantity > 0:
+                    self.set_script(keys=[key], args=[variant_id, quantity], client=pipe)
+                else:
+                    pipe.hdel(key, variant_id)
+            self._changed(pipe, key, cart_id)
+            pipe.execute()
+
+    def lines(self, cart_id):
+        quantities = self.quantities(cart_id)
+        variants = ProductVariant.objects.select_related('product').prefetch_related('product__images')
+        variants = variants.in_bulk(quantities)
+        return [
+            CartItem(cart_id=cart_id, variant=variants[variant_id], quantity=quantity)
+            for variant_id, quantity in quantities.items()
+            if variant_id in variants
+        ]
+
+    def summary(self, cart_id):
+        if not Cart.objects.filter(pk=cart_id).exists():
+            return None
+        quantities = self.quantities(cart_id)
+        prices = dict(ProductVariant.objects.filter(pk__in=quantities).values_list('pk', 'price'))
+        return {
+            'updated_at': None,
+            'item_count': sum(1 for variant_id in quantities if variant_id in prices),
+            'quantity': sum(q for variant_id, q in quantities.items() if variant_id in prices),
+            'subtotal': sum((prices[v] * q for v, q in quantities.items() if v in prices), 0),
+        }
+
+    def write(self, cart_ids):
+        """ Make the CartItem rows of the given carts match their hashes. """
+        carts = {}
+        for cart_id in cart_ids:
+            values = self.redis.hgetall(self.key(cart_id))
+            if values:
+                carts[cart_id] = self.quantities(cart_id)
+        if not carts:
+            return 0
+        existing_carts = {str(pk) for pk in Cart.objects.filter(pk__in=carts).values_list('pk', flat=True)}
+        variant_ids = {variant_id for quantities in carts.values() for variant_id in quantities}
+        existing_variants = set(ProductVariant.objects.filter(pk__in=variant_ids).values_list('pk', flat=True))
+        wanted = {
+            (cart_id, variant_id): quantity
+            for cart_id, quantities in carts.items() if cart_id in existing_carts
+            for variant_id, quantity in quantities.items() if variant_id in existing_variants
+        }
+        vanished = variant_ids - existing_variants
+        if vanished:
+            with self.redis.pipeline() as pipe:
+                for cart_id in carts:
+                    pipe.hdel(self.key(cart_id), *vanished)
+                pipe.execute()
+        with transaction.atomic():
+            stale = [
+                pk for pk, cart_id, variant_id in CartItem.objects.filter(cart_id__in=existing_carts)
+                .values_list('pk', 'cart_id', 'variant_id')
+                if (str(cart_id), variant_id) not in wanted
+            ]
+            if stale:
+                CartItem.objects.filter(pk__in=stale).delete()
+            CartItem.objects.bulk_create(
+                [CartItem(cart_id=c, variant_id=v, quantity=q) for (c, v), q in wanted.items()],
+                update_conflicts=True,
+                unique_fields=['cart', 'variant'],
+                update_fields=['quantity'],
+            )
+            Cart.objects.filter(pk__in=existing_carts).update(updated_at=timezone.now())
+        return len(existing_carts)
+
+    def merge(self, source_id, target_id):
+        # Merge the persisted items, then reload the target's hash from them.
+        self.persist(source_id)
+        self.persist(target_id)
+        super().merge(source_id, target_id)
+        self.forget([source_id, target_id])
+
+    def touch(self, cart_id):
+        # Flushes record the change, rather than a write per change.
+        pass
+
+    def forget(self, cart_ids):
+        cart_ids = [str(cart_id) for cart_id in cart_ids]
+        if cart_ids:
+            with self.redis.pipeline() as pipe:
+                pipe.delete(*[self.key(cart_id) for cart_id in cart_ids])
+                pipe.srem(self.dirty_key, *cart_ids)
+                pipe.execute()
+
+    def persist(self, cart_id):
+        cart_id = str(cart_id)
+        self.redis.srem(self.dirty_key, cart_id)
+        try:
+            self.write([cart_id])
+        except Exception:
+            self.redis.sadd(self.dirty_key, cart_id)
+            raise
+
+    def flush(self, batch_size=500):
+        """ Persist every dirty cart, batch_size carts at a time; returns the number persisted. """
+        flushed = 0
+        while True:
+            cart_ids = [cart_id.decode() for cart_id in self.redis.spop(self.dirty_key, batch_size) or []]
+            if not cart_ids:
+                return flushed
+            try:
+                flushed += self.write(cart_ids)
+            except Exception:
+                self.redis.sadd(self.dirty_key, *cart_ids)
+                raise
+
+    def cart_ids(self):
+        """ Ids of every cart held in Redis. """
+        for key in self.redis.scan_iter(match=f'{self.key_prefix}*', count=1000):
+            yield key.decode()[len(self.key_prefix):]
+
+    def inconsistent(self, cart_ids):
+        """
+        Ids of the given carts whose hash differs from their CartItem rows
+        although no flush is pending for them. Carts deleted from the database
+        since are left out, the next flush drops their hashes' items anyway.
+        """
+        with self.redis.pipeline() as pipe:
+            for cart_id in cart_ids:
+                pipe.sismember(self.dirty_key, cart_id)
+            pending = {cart_id for cart_id, dirty in zip(cart_ids, pipe.execute()) if dirty}
+        existing = Cart.objects.filter(pk__in=cart_ids).values_list('pk', flat=True)
+        persisted = {str(pk): {} for pk in existing}
+        rows = CartItem.objects.filter(cart_id__in=persisted).values_list('cart_id', 'variant_id', 'quantity')
+        for cart_id, variant_id, quantity in rows:
+            persisted[str(cart_id)][variant_id] = quantity
+        return [
+            cart_id for cart_id in cart_ids
+            if cart_id in persisted and cart_id not in pending
+            and self.quantities(cart_id) != persisted[cart_id]
+        ]
+
+
+BACKENDS = {
+    'database': DatabaseCartStore,
+    'redis': RedisCartStore,
+}
+
+
+def get_cart_store():
+    """ The configured cart store (one instance per process). """
+    name = getattr(settings, 'CART_STORE', 'database')
+    if name not in CART_STORES:
+        CART_STORES[name] = BACKENDS[name]()
+    return CART_STORES[name]
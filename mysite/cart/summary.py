@@ -0,0 +1,84 @@
+"""
+Cached cart summaries.
+
+Every page shows the mini cart, so a cart's summary (line count, quantity,
+subtotal and when it last changed) is cached per cart id. Cart mutations
+write the fresh summary through as they commit, and price changes of the
+variants in a cart drop it, so reading it for a page costs no query at all.
+Pages resolve it lazily, at most once per request.
+"""
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CartItem
+from .stores import get_cart_store
+
+CART_SUMMARY_CACHE_KEY = 'cart:summary:{cart_id}'
+CART_SUMMARY_TIMEOUT = 60 * 60 * 24
+EMPTY_SUMMARY = {'cart_id': None, 'item_count': 0, 'quantity': 0, 'subtotal': 0, 'modified': None}
+
+
+def compute_summary(cart_id):
+    """ The summary of a cart from its store, or None if there is no such cart. """
+    try:
+        row = get_cart_store().summary(cart_id)
+    except ValidationError:
+        return None
+    if row is None:
+        return None
+    return {
+        'cart_id': str(cart_id),
+        'item_count': row['item_count'],
+        'quantity': row['quantity'],
+        'subtotal': row['subtotal'],
+        'modified': row['updated_at'],
+    }
+
+
+def get_summary(cart_id):
+    """ The cached summary of a cart, or None if there is no such cart. """
+    key = CART_SUMMARY_CACHE_KEY.format(cart_id=cart_id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = compute_summary(cart_id)
+        if summary is not None:
+            cache.set(key, summary, timeout=CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+def write_through(cart_id):
+    """ Store the cart's fresh summary once the current transaction commits. """
+    def store():
+        summary = compute_summary(cart_id)
+        key = CART_SUMMARY_CACHE_KEY.format(cart_id=cart_id)
+        if summary is None:
+            cache.delete(key)
+        else:
+            summary['modified'] = timezone.now()
+            cache.set(key, summary, timeout=CART_SUMMARY_TIMEOUT)
+
+    transaction.on_commit(store)
+
+
+def invalidate_summaries(cart_ids):
+    cache.delete_many([CART_SUMMARY_CACHE_KEY.format(cart_id=cart_id) for cart_id in cart_ids])
+
+
+def invalidate_for_products(product_ids):
+    """ Drop the summaries of carts holding variants of the given products. """
+    cart_ids = CartItem.objects.filter(variant__product_id__in=product_ids).values_list('cart_id', flat=True)
+    invalidate_summaries(set(cart_ids))
+
+
+def request_cart_summary(request):
+    """ The summary of the session's cart, resolved at most once per request. """
+    if not hasattr(request, '_cart_summary'):
+        cart_id = request.session.get('cart_id')
+        summary = get_summary(cart_id) if cart_id else None
+        if cart_id and summary is None:
+            # The session points at a cart that no longer exists.
+            request.session.pop('cart_id', None)
+        request._cart_summary = summary or EMPTY_SUMMARY
+    return request._cart_summary
@@ -0,0 +1,18 @@
+from celery import shared_task
+from . import cleanup
+from .stores import get_cart_store
+
+
+@shared_task
+def flush_carts():
+    """
+    Periodically persists the carts changed in Redis since the last flush
+    (a no-op with the database cart store).
+    """
+    return get_cart_store().flush()
+
+
+@shared_task
+def delete_abandoned_carts():
+    """ Deletes the anonymous carts left unchanged for CART_ABANDONED_DAYS days. """
+    return cleanup.delete_abandoned_carts()
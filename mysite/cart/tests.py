@@ -1,3 +1,33 @@
+from django.core.exceptions import ValidationError
 from django.test import TestCase
 
-# Create your tests here.
+from catalog.models import Product, ProductVariant
+from . import services
+from .models import Cart, CartItem
+
+
+class QuantityValidationTests(TestCase):
+
+    def setUp(self):
+        product = Product.objects.create(name='Submariner', slug='submariner')
+        self.variant = ProductVariant.objects.create(product=product, sku='RLX-126610', name='Black', price=10)
+
+    def test_invalid_quantities_are_rejected(self):
+        for quantity in ('two', '', '0', '-3'):
+            with self.subTest(quantity=quantity):
+                response = self.client.post('/cart/add/', {'variant_id': self.variant.pk, 'quantity': quantity})
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_product_page_rejects_invalid_quantity(self):
+        response = self.client.post('/products/submariner/', {'variant_id': self.variant.pk, 'quantity': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_services_reject_negative_quantities(self):
+        cart = Cart.objects.create()
+        with self.assertRaises(ValidationError):
+            services.add_item(cart.id, self.variant.pk, -1)
+        services.add_item(cart.id, self.variant.pk, '2')
+        with self.assertRaises(ValidationError):
+            services.set_item(cart.id, self.variant.pk, 0)
+        self.assertEqual(services.cart_quantities(cart.id), {self.variant.pk: 2})
@@ -1,5 +1,9 @@
 
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import redirect
+from django.urls import path
+from .homepage import refresh_homepage
 from .models import Product, Category, ProductVariant, ProductImage
 
 
@@ -23,6 +27,27 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ('name', 'description')
     prepopulated_fields = {'slug': ('name',)}
     inlines = [ProductVariantInline, ProductImageInline]
+    change_list_template = 'admin/catalog/product/change_list.html'
+
+    def get_urls(self):
+        urls = [
+            path(
+                'refresh-homepage/',
+                self.admin_site.admin_view(self.refresh_homepage_view),
+                name='catalog_product_refresh_homepage',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def refresh_homepage_view(self, request):
+        """Rebuild the cached home page sections right away."""
+        if request.method != 'POST':
+            return redirect('admin:catalog_product_changelist')
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        refresh_homepage()
+        self.message_user(request, 'The home page has been refreshed.', messages.SUCCESS)
+        return redirect('admin:catalog_product_changelist')
 
 @admin.register(ProductVariant)
 class ProductVariantAdmin(admin.ModelAdmin):
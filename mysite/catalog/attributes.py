@@ -0,0 +1,93 @@
+"""
+Variant attribute index.
+
+Every scalar in a variant's `attributes` and `dimensions` JSON is stored in
+ProductAttributeValue as a normalized (attribute, value) pair, kept in sync
+whenever a variant is saved. Attribute filters such as "strap color = black
+and case size = 40mm" are resolved through the (attribute, value, variant)
+index, intersecting the variants matching each constraint, so a product
+matches when one of its variants satisfies all of them.
+"""
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import ProductAttributeValue
+
+MAX_ATTRIBUTE_LENGTH = 64
+MAX_VALUE_LENGTH = 255
+# Upper bound on the number of constraints in one filter, to keep the SQL bounded.
+MAX_CONSTRAINTS = 8
+
+
+def normalize(text, length=MAX_VALUE_LENGTH):
+    """ Collapse whitespace and case so 'Black ' and 'black' index the same. """
+    return ' '.join(str(text).split()).casefold()[:length]
+
+
+def build_pairs(variant):
+    """ Return the set of normalized (attribute, value) pairs of a variant. """
+    pairs = set()
+    # Explicit attributes win over dimensions that happen to share a name.
+    for data in (variant.dimensions, variant.attributes):
+        if not isinstance(data, dict):
+            continue
+        for name, value in data.items():
+            attribute = normalize(name, MAX_ATTRIBUTE_LENGTH)
+            values = value if isinstance(value, list) else [value]
+            scalars = [v for v in values if v is not None and not isinstance(v, (dict, list))]
+            if attribute and scalars:
+                pairs = {pair for pair in pairs if pair[0] != attribute}
+                pairs.update((attribute, normalize(v)) for v in scalars)
+    return pairs
+
+
+def index_variants(variants):
+    """ Rebuild the index entries of the given variants; returns the number of entries. """
+    variants = list(variants)
+    if not variants:
+        return 0
+    entries = [
+        ProductAttributeValue(product_id=variant.product_id, variant=variant, attribute=attribute, value=value)
+        for variant in variants
+        for attribute, value in build_pairs(variant)
+    ]
+    with transaction.atomic():
+        ProductAttributeValue.objects.filter(variant__in=[v.pk for v in variants]).delete()
+        ProductAttributeValue.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+def parse_constraints(values):
+    """
+    Turn 'name:value[,value...]' strings into a {attribute: [values]} dict.
+    Several values for one attribute are alternatives; different attributes
+    must all match.
+    """
+    constraints = {}
+    for raw in values:
+        name, separator, options = raw.partition(':')
+        attribute = normalize(name, MAX_ATTRIBUTE_LENGTH)
+        options = [normalize(option) for option in options.split(',') if option.strip()]
+        if not separator or not attribute or not options:
+            raise ValidationError(f'Invalid attribute filter "{raw}", expected "name:value".')
+        constraints.setdefault(attribute, [])
+        constraints[attribute].extend(option for option in options if option not in constraints[attribute])
+    if len(constraints) > MAX_CONSTRAINTS:
+        raise ValidationError(f'At most {MAX_CONSTRAINTS} attribute filters can be combined.')
+    return constraints
+
+
+def matching_product_ids(constraints):
+    """
+    Subquery of the ids of products having a variant that satisfies every
+    {attribute: [values]} constraint.
+    """
+    variants = None
+    entries = ProductAttributeValue.objects.none()
+    for attribute, values in constraints.items():
+        entries = ProductAttributeValue.objects.filter(attribute=attribute, value__in=values)
+        if variants is not None:
+            entries = entries.filter(variant_id__in=variants)
+        variants = entries.values('variant_id')
+    return entries.values('product_id')
+
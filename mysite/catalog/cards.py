@@ -0,0 +1,101 @@
+"""
+Maintenance of the ProductCard read model.
+
+Cards are recomputed from Product, ProductVariant, ProductImage and approved
+reviews whenever products_changed fires (only their in_stock flag when
+stock_changed fires), and can be rebuilt from scratch with the
+rebuild_product_cards command.
+"""
+from django.db import transaction
+from django.db.models import Avg, Count, Exists, OuterRef, Q
+from django.db.models.functions import Now
+from django.utils.text import Truncator
+
+from .models import Product, ProductCard, ProductVariant
+
+SUMMARY_LENGTH = 255
+
+# Everything but the primary key is rewritten when a card is refreshed.
+CARD_UPDATE_FIELDS = [
+    field.name for field in ProductCard._meta.concrete_fields if not field.primary_key
+]
+
+
+def primary_image(product):
+    """ The image shown on a product's card: the primary one, else the first by order. """
+    images = list(product.images.all())
+    for image in images:
+        if image.is_primary:
+            return image
+    return images[0] if images else None
+
+
+def build_card(product):
+    """
+    Build an unsaved ProductCard for a product loaded by refresh_product_cards.
+    """
+    prices = [variant.price for variant in product.variants.all()]
+    image = primary_image(product)
+    card = ProductCard(
+        product=product,
+        name=product.name,
+        slug=product.slug,
+        summary=Truncator(product.description).chars(SUMMARY_LENGTH),
+        brand=product.brand,
+        brand_name=product.brand.name if product.brand else '',
+        brand_slug=product.brand.slug if product.brand else '',
+        category_ids=sorted(category.pk for category in product.category.all()),
+        min_price=min(prices) if prices else None,
+        max_price=max(prices) if prices else None,
+        in_stock=any(variant.stock > 0 for variant in product.variants.all()),
+        rating_average=(
+            round(product.rating_average, 2) if product.rating_average is not None else None
+        ),
+        rating_count=product.rating_count,
+        created_at=product.created_at,
+    )
+    if image is not None:
+        card.image_alt = image.alt_text or product.name
+        card.thumbnail_url = image.thumbnail_url
+        card.medium_url = image.medium_url
+        card.large_url = image.large_url
+    return card
+
+
+def refresh_product_cards(product_ids):
+    """
+    Recompute the cards of the given products.
+    Cards of products that are now inactive or deleted are removed.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return 0
+    approved = Q(reviews__approved=True)
+    products = (
+        Product.objects.filter(pk__in=product_ids, is_active=True)
+        .select_related('brand')
+        .prefetch_related('category', 'variants', 'images')
+        .annotate(
+            rating_average=Avg('reviews__rating', filter=approved),
+            rating_count=Count('reviews', filter=approved),
+        )
+    )
+    cards = [build_card(product) for product in products]
+    with transaction.atomic():
+        ProductCard.objects.filter(product_id__in=product_ids).exclude(
+            product_id__in=[card.product_id for card in cards]
+        ).delete()
+        ProductCard.objects.bulk_create(
+            cards,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=CARD_UPDATE_FIELDS,
+        )
+    return len(cards)
+
+
+def refresh_stock(product_ids):
+    """ Recompute just the in_stock flag of the given products' cards, in one statement. """
+    in_stock = Exists(ProductVariant.objects.filter(product_id=OuterRef('product_id'), stock__gt=0))
+    return ProductCard.objects.filter(product_id__in=list(product_ids)).update(in_stock=in_stock, updated_at=Now())
@@ -0,0 +1,19 @@
+from django.utils.functional import SimpleLazyObject
+
+from .tree import get_tree
+from .wishlists import request_wishlist_ids
+
+def categories(request):
+    """
+    A context processor to make the top-level categories available to the
+    navigation menu, read from the cached category tree.
+    """
+    return {'menu_categories': get_tree().children()}
+
+
+def wishlist(request):
+    """
+    The ids of the products on the user's wishlist, for marking wishlisted
+    products in listings. Loaded lazily, at most once per request.
+    """
+    return {'wishlist_ids': SimpleLazyObject(lambda: request_wishlist_ids(request))}
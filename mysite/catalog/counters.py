@@ -0,0 +1,120 @@
+"""
+Maintained active-product counts on Brand and Category.
+
+Brand.product_count is the number of active products of the brand and
+Category.product_count the number of distinct active products filed in the
+category or anywhere below it. Signal receivers keep both up to date with
+F() expression updates as products are activated, deactivated, re-branded,
+deleted or re-categorized; changes to the category tree itself (moves and
+deletions) recount the categories once the transaction commits.
+reconcile_counts() recomputes everything from scratch.
+"""
+import threading
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Brand, Category, Product
+from .utils import bump_catalog_version, chunked
+
+_pending = threading.local()
+
+
+def category_closure(product_ids=None, active_only=True):
+    """
+    Return {product_id: category ids} for the given active products (or all of
+    them), where the ids include every ancestor of the categories each product
+    is filed in.
+    """
+    memberships = Product.category.through.objects.all()
+    if active_only:
+        memberships = memberships.filter(product__is_active=True)
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return {}
+        memberships = memberships.filter(product_id__in=product_ids)
+    parents = dict(Category.objects.values_list('pk', 'parent_id'))
+    closure = defaultdict(set)
+    for product_id, category_id in memberships.values_list('product_id', 'category_id').iterator():
+        ids = closure[product_id]
+        while category_id is not None and category_id not in ids:
+            ids.add(category_id)
+            category_id = parents.get(category_id)
+    return dict(closure)
+
+
+def _apply(model, deltas):
+    """ Add each delta in {pk: delta} to the counters, one UPDATE per distinct delta. """
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        model.objects.filter(pk__in=pks).update(product_count=F('product_count') + delta)
+
+
+def apply_category_changes(before, after):
+    """ Update category counters from two category_closure() results. """
+    deltas = Counter()
+    for product_id in set(before) | set(after):
+        old = before.get(product_id, set())
+        new = after.get(product_id, set())
+        deltas.update(dict.fromkeys(new - old, 1))
+        deltas.subtract(dict.fromkeys(old - new, 1))
+    _apply(Category, deltas)
+
+
+def adjust_brand(brand_id, delta):
+    if brand_id is not None:
+        _apply(Brand, {brand_id: delta})
+
+
+def schedule_category_recount():
+    """ Recount all categories once the current transaction commits. """
+    _pending.recount = True
+    transaction.on_commit(_recount_if_pending)
+
+
+def _recount_if_pending():
+    if getattr(_pending, 'recount', False):
+        _pending.recount = False
+        recount_categories()
+        bump_catalog_version()
+
+
+def _update_changed(model, counts, batch_size):
+    """ Write the given {pk: count} values, skipping rows that already match. """
+    changed = [
+        model(pk=pk, product_count=counts.get(pk, 0))
+        for pk, current in model.objects.values_list('pk', 'product_count')
+        if current != counts.get(pk, 0)
+    ]
+    for batch in chunked(changed, batch_size):
+        model.objects.bulk_update(batch, ['product_count'])
+    return len(changed)
+
+
+def recount_categories(batch_size=500):
+    """ Recompute every Category.product_count; returns the number of rows fixed. """
+    closure = category_closure()
+    counts = Counter(category_id for ids in closure.values() for category_id in ids)
+    return _update_changed(Category, counts, batch_size)
+
+
+def recount_brands(batch_size=500):
+    """ Recompute every Brand.product_count; returns the number of rows fixed. """
+    counts = dict(
+        Product.objects.filter(is_active=True, brand__isnull=False)
+        .values_list('brand')
+        .annotate(n=Count('pk'))
+        .order_by()
+    )
+    return _update_changed(Brand, counts, batch_size)
+
+
+def reconcile_counts(batch_size=500):
+    """ Recompute all counters; returns (brands fixed, categories fixed). """
+    with transaction.atomic():
+        return recount_brands(batch_size), recount_categories(batch_size)
@@ -0,0 +1,209 @@
+"""
+Streaming export of the catalog as CSV, JSON Lines or a Google Merchant feed.
+
+Variants are read with .iterator(chunk_size=...) and, chunk by chunk, the
+categories and images of their products are fetched in one query each, so an
+export of any size runs in constant memory and can be streamed straight into
+a StreamingHttpResponse or a file. CSV and JSON Lines rows use the record
+format of catalog.importer, so an export can be imported elsewhere as is.
+
+An incremental export (since=...) only contains variants whose variant or
+product row changed at or after the given time, including deactivated ones,
+so consumers can take them down. Every change to a product's catalog data
+stamps its updated_at (see catalog.signals). Variants deleted since then are
+listed after them, as records holding just their sku and product_slug with
+`deleted` set; CSV and JSON Lines exports get that extra column, and the
+importer deletes such variants. The merchant feed has no way to express a
+deletion, so it leaves them out.
+"""
+import csv
+import json
+from itertools import chain
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Q
+
+from .importer import LIST_SEPARATOR, PATH_SEPARATOR
+from .models import DeletedVariant, Product, ProductImage, ProductVariant
+from .tree import get_tree
+from .utils import chunked
+
+EXPORT_FIELDS = [
+    'sku', 'variant_name', 'price', 'compare_price', 'stock', 'weight', 'attributes', 'dimensions',
+    'product_slug', 'product_name', 'description', 'is_active', 'brand', 'brand_slug',
+    'categories', 'images', 'image_alt',
+]
+FEED_FORMATS = ('csv', 'jsonl', 'xml')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+    'xml': 'application/xml; charset=utf-8',
+}
+
+
+def exported_variants(since=None):
+    """ The variants to export: all active ones, or everything changed since a time. """
+    variants = ProductVariant.objects.select_related('product__brand').order_by('pk')
+    if since is None:
+        return variants.filter(product__is_active=True)
+    return variants.filter(Q(updated_at__gte=since) | Q(product__updated_at__gte=since))
+
+
+def deleted_variants(since):
+    """ The variants deleted since a time whose sku isn't in use again. """
+    return (
+        DeletedVariant.objects.filter(deleted_at__gte=since)
+        .exclude(sku__in=ProductVariant.objects.values('sku'))
+        .order_by('pk')
+    )
+
+
+def export_rows(since=None, chunk_size=500):
+    """
+    Yield one dict per variant with the EXPORT_FIELDS keys, plus 'url',
+    'image_urls' and 'category_names' for feeds, and 'deleted'. An incremental
+    export then yields {'sku', 'product_slug', 'deleted'} dicts for the
+    variants deleted since.
+    """
+    tree = get_tree()
+    through = Product.category.through
+    variants = exported_variants(since).iterator(chunk_size=chunk_size)
+    for chunk in chunked(variants, chunk_size):
+        product_ids = {variant.product_id for variant in chunk}
+        categories = {}
+        for product_id, category_id in through.objects.filter(product_id__in=product_ids).values_list(
+            'product_id', 'category_id'
+        ).order_by('pk'):
+            categories.setdefault(product_id, []).append(category_id)
+        images = {}
+        for image in ProductImage.objects.filter(product_id__in=product_ids).order_by('-is_primary', 'order', 'pk'):
+            images.setdefault(image.product_id, []).append(image)
+
+        for variant in chunk:
+            product = variant.product
+            paths = [tree.breadcrumbs(pk) for pk in categories.get(product.pk, []) if tree.get(pk)]
+            product_images = images.get(product.pk, [])
+            yield {
+                'sku': variant.sku,
+                'variant_name': variant.name,
+                'price': variant.price,
+                'compare_price': variant.compare_price,
+                'stock': variant.stock,
+                'weight': variant.weight,
+                'attributes': variant.attributes,
+                'dimensions': variant.dimensions,
+                'product_slug': product.slug,
+                'product_name': product.name,
+                'description': product.description,
+                'is_active': product.is_active,
+                'brand': product.brand.name if product.brand else '',
+                'brand_slug': product.brand.slug if product.brand else '',
+                'categories': [PATH_SEPARATOR.join(node['slug'] for node in path) for path in paths],
+                'images': [image.image.name for image in product_images],
+                'image_alt': product_images[0].alt_text if product_images else '',
+                'url': product.get_absolute_url(),
+                'image_urls': [image.large_url for image in product_images],
+                'category_names': [' > '.join(node['name'] for node in path) for path in paths],
+                'deleted': False,
+            }
+
+    if since is not None:
+        deleted = deleted_variants(since).values_list('sku', 'product_slug').iterator(chunk_size=chunk_size)
+        for sku, product_slug in deleted:
+            yield {'sku': sku, 'product_slug': product_slug, 'deleted': True}
+
+
+class Echo:
+    """ A file-like object whose write() returns the value, for streaming csv.writer output. """
+
+    def write(self, value):
+        return value
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, dict):
+        return json.dumps(value, sort_keys=True)
+    if isinstance(value, list):
+        return LIST_SEPARATOR.join(value)
+    return str(value)
+
+
+def csv_lines(rows, fields=EXPORT_FIELDS):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([_text(row.get(field)) for field in fields])
+
+
+def jsonl_lines(rows, fields=EXPORT_FIELDS):
+    for row in rows:
+        record = {field: row[field] for field in fields if field in row}
+        yield json.dumps(record, default=str) + '\n'
+
+
+def _tag(name, value):
+    return f'<{name}>{escape(str(value))}</{name}>'
+
+
+def merchant_feed(rows, base_url, currency=None, title='Catalog'):
+    """
+    Google Merchant Center RSS 2.0 feed: one item per variant, grouped by product.
+    base_url is prepended to the product and image URLs (e.g. 'https://shop.example').
+    """
+    currency = currency or settings.CATALOG_FEED_CURRENCY
+    base_url = base_url.rstrip('/')
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0">\n<channel>\n'
+        f'{_tag("title", title)}\n{_tag("link", base_url + "/")}\n'
+    )
+    for row in rows:
+        if row['deleted']:
+            continue
+        available = row['is_active'] and row['stock'] > 0
+        sale = row['compare_price'] is not None and row['compare_price'] > row['price']
+        parts = [
+            _tag('g:id', row['sku']),
+            _tag('g:item_group_id', row['product_slug']),
+            _tag('title', f"{row['product_name']} - {row['variant_name']}"),
+            _tag('description', row['description'] or row['product_name']),
+            _tag('link', base_url + row['url']),
+            _tag('g:availability', 'in_stock' if available else 'out_of_stock'),
+            _tag('g:price', f"{row['compare_price'] if sale else row['price']} {currency}"),
+        ]
+        if sale:
+            parts.append(_tag('g:sale_price', f"{row['price']} {currency}"))
+        if row['brand']:
+            parts.append(_tag('g:brand', row['brand']))
+        image_urls = [url if '://' in url else base_url + url for url in row['image_urls']]
+        if image_urls:
+            parts.append(_tag('g:image_link', image_urls[0]))
+            parts.extend(_tag('g:additional_image_link', url) for url in image_urls[1:11])
+        if row['category_names']:
+            parts.append(_tag('g:product_type', row['category_names'][0]))
+        yield '<item>' + ''.join(parts) + '</item>\n'
+    yield '</channel>\n</rss>\n'
+
+
+def export_lines(feed, since=None, base_url='', chunk_size=500):
+    """
+    Text chunks of the export in one of FEED_FORMATS. The first row is built
+    right away, so errors are raised before a response starts streaming.
+    """
+    rows = export_rows(since=since, chunk_size=chunk_size)
+    first = next(rows, None)
+    if first is not None:
+        rows = chain([first], rows)
+    fields = EXPORT_FIELDS if since is None else [*EXPORT_FIELDS, 'deleted']
+    if feed == 'csv':
+        return csv_lines(rows, fields)
+    if feed == 'jsonl':
+        return jsonl_lines(rows, fields)
+    if feed == 'xml':
+        return merchant_feed(rows, base_url)
+    raise ValueError(f'Unsupported feed "{feed}", expected one of {", ".join(FEED_FORMATS)}.')
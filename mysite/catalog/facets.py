@@ -0,0 +1,418 @@
+"""
+Facet counts for product listings.
+
+The facet index lives in Redis as one set of product ids per facet value: per
+brand, per category (rolled up to all MPTT ancestors, so a product counts in
+every category above its own), per price bucket and per variant attribute
+value. Each set is keyed by a member name ('b:<brand id>', 'c:<category id>',
+'p:<bucket index>', 'a:<JSON [name, value]>'), registered in a `values` set.
+Every product also has a set of the members it belongs to, so its entries can
+be moved when it changes.
+
+Counting a result set stores its product ids in a short-lived Redis set (shared
+by every request for the same filter state until the index changes) and asks
+Redis for the size of its intersection with each value set (SINTERCARD, in one
+pipeline). Only the counts travel back to the worker.
+
+When products change, their memberships are recomputed and moved by a Lua
+script, atomically per product, so concurrent updates never overwrite each
+other. When brands or categories change, a complete index is built under a new
+generation in the background (rebuild_facet_index task), then switched to;
+the previous generation keeps serving until then and expires shortly after.
+Products changing while a rebuild runs are queued in a pending set and
+reapplied to the new generation once it is switched to.
+"""
+import hashlib
+import json
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+
+from .models import Brand, Category, Product, ProductVariant
+from .utils import chunked
+
+FACET_INDEX_PREFIX = 'catalog:facets:'
+FACET_INDEX_GENERATION_KEY = 'catalog:facets:generation'
+FACET_INDEX_PENDING_KEY = 'catalog:facets:pending'
+FACET_INDEX_LOCK_KEY = 'catalog:facets:lock'
+FACET_INDEX_SCHEDULED_KEY = 'catalog:facets:scheduled'
+LOCK_TIMEOUT = 120
+LOCK_WAIT = 5.0
+LOCK_POLL_INTERVAL = 0.05
+# How long stored result sets and a replaced generation's keys are kept.
+RESULT_TIMEOUT = 60
+BATCH_SIZE = 1000
+
+# (min, max) price ranges used for the price facet; a max of None is open-ended.
+PRICE_BUCKETS = (
+    (0, 250),
+    (250, 500),
+    (500, 1000),
+    (1000, 2500),
+    (2500, 5000),
+    (5000, 10000),
+    (10000, None),
+)
+
+# Move one product between value sets.
+# KEYS: its member set, the product set, the value registry, the change counter.
+# ARGV: the value set key prefix, the product id, then its members (none once
+# it is inactive or deleted).
+UPDATE_SCRIPT = """
+for _, member in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    redis.call('SREM', ARGV[1] .. member, ARGV[2])
+end
+redis.call('DEL', KEYS[1])
+if #ARGV > 2 then
+    for i = 3, #ARGV do
+        redis.call('SADD', ARGV[1] .. ARGV[i], ARGV[2])
+    end
+    redis.call('SADD', KEYS[1], unpack(ARGV, 3))
+    redis.call('SADD', KEYS[3], unpack(ARGV, 3))
+    redis.call('SADD', KEYS[2], ARGV[2])
+else
+    redis.call('SREM', KEYS[2], ARGV[2])
+end
+return redis.call('INCR', KEYS[4])
+"""
+
+
+def get_connection():
+    # Imported here so the rest of the catalog works without django-redis configured.
+    from django_redis import get_redis_connection
+
+    return get_redis_connection(getattr(settings, 'CATALOG_FACETS_REDIS_ALIAS', 'default'))
+
+
+def price_bucket(price):
+    """ Return the index of the PRICE_BUCKETS entry that contains price. """
+    for index, (low, high) in enumerate(PRICE_BUCKETS):
+        if price >= low and (high is None or price < high):
+            return index
+    return None
+
+
+def product_memberships(products, categories):
+    """
+    Facet memberships of the active products of a queryset,
+    {product_id: (brand_id, category_ids, bucket_indexes, attribute_pairs)},
+    with categories rolled up through the parent ids of `categories`.
+    """
+    parents = {c['id']: c['parent_id'] for c in categories}
+
+    def with_ancestors(category_id):
+        ids = []
+        while category_id is not None and category_id not in ids:
+            ids.append(category_id)
+            category_id = parents.get(category_id)
+        return ids
+
+    products = products.filter(is_active=True)
+    memberships = {pk: [brand_id, set(), set(), set()] for pk, brand_id in products.values_list('pk', 'brand_id')}
+    through = Product.category.through.objects.filter(product__in=products)
+    for product_id, category_id in through.values_list('product_id', 'category_id').iterator():
+        memberships[product_id][1].update(with_ancestors(category_id))
+
+    variants = ProductVariant.objects.filter(product__in=products)
+    for product_id, price, attributes in variants.values_list('product_id', 'price', 'attributes').iterator():
+        entry = memberships[product_id]
+        bucket = price_bucket(price)
+        if bucket is not None:
+            entry[2].add(bucket)
+        if isinstance(attributes, dict):
+            entry[3].update((str(name), str(value)) for name, value in attributes.items())
+
+    return {
+        pk: (brand_id, tuple(cats), tuple(buckets), tuple(attrs))
+        for pk, (brand_id, cats, buckets, attrs) in memberships.items()
+    }
+
+
+def facet_members(membership):
+    """ The names of the value sets a product_memberships() entry belongs to. """
+    brand_id, category_ids, bucket_indexes, attribute_pairs = membership
+    members = [] if brand_id is None else [f'b:{brand_id}']
+    members.extend(f'c:{category_id}' for category_id in category_ids)
+    members.extend(f'p:{bucket}' for bucket in bucket_indexes)
+    members.extend('a:' + json.dumps(pair) for pair in attribute_pairs)
+    return members
+
+
+def build_labels():
+    """ The brand and category labels used when rendering counts. """
+    return {
+        'brands': {b['id']: b for b in Brand.objects.values('id', 'name', 'slug')},
+        # In tree order, so they can be rendered as an indented list.
+        'categories': list(
+            Category.objects.order_by('tree_id', 'lft').values('id', 'name', 'slug', 'parent_id', 'level')
+        ),
+    }
+
+
+def _prefix(generation):
+    return f'{FACET_INDEX_PREFIX}{generation}:'
+
+
+def _labels_key(generation):
+    return f'{_prefix(generation)}labels'
+
+
+def _labels(generation):
+    labels = cache.get(_labels_key(generation))
+    if labels is None:
+        labels = build_labels()
+        cache.set(_labels_key(generation), labels, timeout=None)
+    return labels
+
+
+def _acquire_lock(wait=0.0):
+    """ Take the index lock, waiting up to `wait` seconds; returns its token, or None. """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    while not cache.add(FACET_INDEX_LOCK_KEY, token, timeout=LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(LOCK_POLL_INTERVAL)
+    return token
+
+
+def _release_lock(token):
+    # Only release the lock if it is still ours, not taken over after expiring.
+    if cache.get(FACET_INDEX_LOCK_KEY) == token:
+        cache.delete(FACET_INDEX_LOCK_KEY)
+
+
+def _store(redis, prefix, memberships):
+    """ Fill an empty generation with the given memberships. """
+    values = defaultdict(list)
+    with redis.pipeline(transaction=False) as pipe:
+        for batch in chunked(memberships.items(), BATCH_SIZE):
+            for pk, membership in batch:
+                members = facet_members(membership)
+                for member in members:
+                    values[member].append(pk)
+                if members:
+                    pipe.sadd(f'{prefix}p:{pk}', *members)
+            pipe.sadd(f'{prefix}all', *(pk for pk, membership in batch))
+            pipe.execute()
+        for member, product_ids in values.items():
+            for batch in chunked(product_ids, BATCH_SIZE):
+                pipe.sadd(f'{prefix}v:{member}', *batch)
+            pipe.execute()
+        for batch in chunked(values, BATCH_SIZE):
+            pipe.sadd(f'{prefix}values', *batch)
+        pipe.execute()
+
+
+def _apply(redis, generation, product_ids):
+    """ Recompute the memberships of the given products in a generation. """
+    prefix = _prefix(generation)
+    script = redis.register_script(UPDATE_SCRIPT)
+    categories = _labels(generation)['categories']
+    with redis.pipeline(transaction=False) as pipe:
+        for batch in chunked(product_ids, BATCH_SIZE):
+            memberships = product_memberships(Product.objects.filter(pk__in=batch), categories)
+            for pk in batch:
+                members = facet_members(memberships[pk]) if pk in memberships else []
+                script(
+                    keys=[f'{prefix}p:{pk}', f'{prefix}all', f'{prefix}values', f'{prefix}changes'],
+                    args=[f'{prefix}v:', pk, *members],
+                    client=pipe,
+                )
+            pipe.execute()
+
+
+def rebuild_facet_index(wait=0.0):
+    """
+    Build a new generation of the index from the database and switch to it.
+    Returns the new generation, or None if another rebuild holds the lock
+    for longer than `wait` seconds.
+    """
+    token = _acquire_lock(wait=wait)
+    if token is None:
+        return None
+    try:
+        redis = get_connection()
+        # Changes from here on are in the database read below, or queued.
+        cache.delete(FACET_INDEX_SCHEDULED_KEY)
+        redis.delete(FACET_INDEX_PENDING_KEY)
+        generation = uuid.uuid4().hex
+        labels = build_labels()
+        cache.set(_labels_key(generation), labels, timeout=None)
+        _store(redis, _prefix(generation), product_memberships(Product.objects.all(), labels['categories']))
+
+        previous = redis.getset(FACET_INDEX_GENERATION_KEY, generation)
+        while True:
+            product_ids = [int(pk) for pk in redis.spop(FACET_INDEX_PENDING_KEY, BATCH_SIZE)]
+            if not product_ids:
+                break
+            _apply(redis, generation, product_ids)
+
+        if previous is not None:
+            # Counts already under way may still read the previous generation.
+            with redis.pipeline(transaction=False) as pipe:
+                for key in redis.scan_iter(match=f'{_prefix(previous.decode())}*', count=BATCH_SIZE):
+                    pipe.expire(key, RESULT_TIMEOUT)
+                pipe.execute()
+            cache.delete(_labels_key(previous.decode()))
+        return generation
+    finally:
+        _release_lock(token)
+
+
+def get_generation(redis):
+    """
+    Return the current generation of the index. If there is none yet, one
+    worker builds it while the others wait for it, up to LOCK_WAIT seconds;
+    returns None if it isn't there by then.
+    """
+    generation = redis.get(FACET_INDEX_GENERATION_KEY)
+    if generation is not None:
+        return generation.decode()
+    generation = rebuild_facet_index()
+    if generation is not None:
+        return generation
+
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        generation = redis.get(FACET_INDEX_GENERATION_KEY)
+        if generation is not None:
+            return generation.decode()
+    return None
+
+
+def update_facet_index(product_ids):
+    """
+    Recompute the memberships of the given products, dropping those of
+    deleted or deactivated products. Nothing is done before the index
+    is first built.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    redis = get_connection()
+    # Queued before reading the generation, so a rebuild either reapplies them
+    # after switching, or has already switched and they go to the new one.
+    if cache.get(FACET_INDEX_LOCK_KEY) is not None:
+        redis.sadd(FACET_INDEX_PENDING_KEY, *product_ids)
+    generation = redis.get(FACET_INDEX_GENERATION_KEY)
+    if generation is not None:
+        _apply(redis, generation.decode(), product_ids)
+
+
+def invalidate_facet_index():
+    """ Schedule a rebuild of the index, which keeps serving until it is replaced. """
+    # Imported here as the tasks module depends on this one.
+    from .tasks import rebuild_facet_index as rebuild_task
+
+    # A rebuild that is scheduled but hasn't started will see the change too.
+    if cache.add(FACET_INDEX_SCHEDULED_KEY, True, timeout=LOCK_TIMEOUT):
+        rebuild_task.delay()
+
+
+def empty_facets():
+    return {'brand': [], 'category': [], 'price': [], 'attributes': {}}
+
+
+def _result_key(redis, prefix, queryset):
+    """
+    Store the product ids of a queryset as a Redis set, unless the same query
+    was stored since the index last changed; returns its key, or None if the
+    queryset is empty.
+    """
+    product_ids = queryset.order_by().values_list('pk', flat=True)
+    try:
+        sql = str(product_ids.query)
+    except EmptyResultSet:
+        return None
+    changes = int(redis.get(f'{prefix}changes') or 0)
+    digest = hashlib.sha1(sql.encode()).hexdigest()
+    key = f'{prefix}r:{changes}:{digest}'
+    if redis.expire(key, RESULT_TIMEOUT):
+        return key
+
+    # Filled under a key of its own and renamed, so it's never seen half-filled.
+    partial = f'{key}:{uuid.uuid4().hex}'
+    stored = False
+    with redis.pipeline(transaction=False) as pipe:
+        for batch in chunked(product_ids.iterator(chunk_size=BATCH_SIZE), BATCH_SIZE):
+            pipe.sadd(partial, *batch)
+            pipe.expire(partial, RESULT_TIMEOUT)
+            pipe.execute()
+            stored = True
+    if not stored:
+        return None
+    redis.rename(partial, key)
+    return key
+
+
+def count_facets(redis, generation, result_key):
+    """
+    Count the product ids of a stored result set per facet value, in Redis.
+
+    Returns a JSON-serializable dict with 'brand', 'category', 'price' and
+    'attributes' entries; values with no matching product are left out.
+    """
+    prefix = _prefix(generation)
+    members = [member.decode() for member in redis.smembers(f'{prefix}values')]
+    with redis.pipeline(transaction=False) as pipe:
+        for member in members:
+            pipe.sintercard(2, [result_key, f'{prefix}v:{member}'])
+        counts = pipe.execute()
+
+    brands, categories, buckets = {}, {}, {}
+    attributes = defaultdict(dict)
+    for member, count in zip(members, counts):
+        if not count:
+            continue
+        kind, value = member.split(':', 1)
+        if kind == 'b':
+            brands[int(value)] = count
+        elif kind == 'c':
+            categories[int(value)] = count
+        elif kind == 'p':
+            buckets[int(value)] = count
+        else:
+            name, value = json.loads(value)
+            attributes[name][value] = count
+
+    labels = _labels(generation)
+    brand_labels = labels['brands']
+    return {
+        'brand': sorted(
+            (
+                {**brand_labels[brand_id], 'count': count}
+                for brand_id, count in brands.items() if brand_id in brand_labels
+            ),
+            key=lambda b: b['name'],
+        ),
+        'category': [
+            {**category, 'count': categories[category['id']]}
+            for category in labels['categories'] if category['id'] in categories
+        ],
+        'price': [
+            {'min': low, 'max': high, 'count': buckets[i]}
+            for i, (low, high) in enumerate(PRICE_BUCKETS) if i in buckets
+        ],
+        'attributes': {
+            name: [{'value': value, 'count': count} for value, count in sorted(values.items())]
+            for name, values in sorted(attributes.items())
+        },
+    }
+
+
+def facet_counts(queryset):
+    """ Facet counts for the products of an (already filtered) queryset. """
+    redis = get_connection()
+    generation = get_generation(redis)
+    if generation is None:
+        return empty_facets()
+    result_key = _result_key(redis, _prefix(generation), queryset)
+    if result_key is None:
+        return empty_facets()
+    return count_facets(redis, generation, result_key)
@@ -1,15 +1,46 @@
 
 import django_filters
-from .models import Product, Brand, Category
+from .models import ProductCard, Brand, Category
+from .attributes import matching_product_ids, parse_constraints
+from .search import search_products
+from .tree import get_tree
 from django import forms
-from django.db.models import Q
+
+class AttributeConstraintField(forms.Field):
+    """ Repeated 'name:value[,value...]' parameters, cleaned to {attribute: [values]}. """
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        if not value:
+            return {}
+        if isinstance(value, str):
+            value = [value]
+        return parse_constraints(value)
+
+
+class AttributeFilter(django_filters.Filter):
+    """
+    Keeps products with a variant matching every attribute constraint, e.g.
+    `?attribute=strap color:black&attribute=case size:40mm,42mm`.
+    """
+    field_class = AttributeConstraintField
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        return qs.filter(pk__in=matching_product_ids(value))
+
+
+def category_choices():
+    return [(node['id'], '\u2014 ' * node['level'] + node['name']) for node in get_tree().walk()]
+
 
 class ProductFilter(django_filters.FilterSet):
-    # A custom text search filter. It searches across product name and description.
+    # A custom text search filter, backed by the product search index.
     search = django_filters.CharFilter(method='search_filter', label="", widget=forms.TextInput(attrs={'placeholder': 'Search products...'}))
 
-    # Filter for price range. The 'variants__price' assumes a related ProductVariant model.
-    price = django_filters.RangeFilter(field_name='variants__price', label='Price Range')
+    # Filter for price range, matched against the card's min/max variant prices.
+    price = django_filters.RangeFilter(method='price_filter', label='Price Range')
 
     # Filter by brand using a dropdown
     brand = django_filters.ModelChoiceFilter(
@@ -18,42 +49,63 @@ class ProductFilter(django_filters.FilterSet):
         label='Brand'
     )
     
-    # Filter by category using a dropdown
-    category = django_filters.ModelChoiceFilter(
-        queryset=Category.objects.all(),
+    # Filter by category (including its subcategories) using a dropdown,
+    # whose options come from the cached category tree.
+    category = django_filters.TypedChoiceFilter(
+        method='category_filter',
+        choices=category_choices,
+        coerce=int,
         widget=forms.Select,
         label='Category'
     )
 
+    # Variant attribute constraints, resolved through the attribute index
+    attribute = AttributeFilter(label='Attributes')
+
     # A choice filter for sorting
     ordering = django_filters.OrderingFilter(
         label='Sort By',
         fields=(
-            ('created_at', 'newest'),
-            ('-created_at', 'oldest'),
-            ('variants__price', 'price_asc'),
-            ('-variants__price', 'price_desc'),
+            ('-created_at', 'newest'),
+            ('created_at', 'oldest'),
+            ('min_price', 'price_asc'),
+            ('-min_price', 'price_desc'),
         ),
         field_labels={
-            'created_at': 'Newest first',
-            '-created_at': 'Oldest first',
-            'variants__price': 'Price: Low to High',
-            '-variants__price': 'Price: High to Low',
+            '-created_at': 'Newest first',
+            'created_at': 'Oldest first',
+            'min_price': 'Price: Low to High',
+            '-min_price': 'Price: High to Low',
         }
     )
 
     class Meta:
-        model = Product
-        fields = ['search', 'price', 'brand', 'category']
+        model = ProductCard
+        fields = ['search', 'price', 'brand', 'category', 'attribute']
 
     def search_filter(self, queryset, name, value):
-        """ Custom filter method to search in name and description. """
+        """ Custom filter method that resolves the search through the search index. """
         if not value:
             return queryset
-        # Use Q objects to create an OR query
+        return search_products(value, queryset)
+
+    def category_filter(self, queryset, name, value):
+        """ Keep products filed anywhere under the selected category. """
+        category = get_tree().get(value)
+        if category is None:
+            return queryset
         return queryset.filter(
-            Q(name__icontains=value) | Q(description__icontains=value)
-        ).distinct()
+            pk__in=Category.products_in_range(category['tree_id'], category['lft'], category['rght'])
+        )
+
+    def price_filter(self, queryset, name, value):
+        """ Keep products whose variant price range overlaps the requested range. """
+        if value:
+            if value.start is not None:
+                queryset = queryset.filter(max_price__gte=value.start)
+            if value.stop is not None:
+                queryset = queryset.filter(min_price__lte=value.stop)
+        return queryset
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
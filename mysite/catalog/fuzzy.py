@@ -0,0 +1,136 @@
+"""
+Typo-tolerant product search.
+
+Query tokens that do not occur in the search index are matched against the
+vocabulary of product names, brand names and SKUs through a trigram index,
+the same similarity measure as PostgreSQL's pg_trgm: the share of distinct
+three-letter sequences two words have in common. Close words are looked up
+through the trigram postings, so a query only ever compares itself against
+words that share at least one trigram with it.
+
+Each worker keeps its TrigramIndex in memory as a WorkerLocalIndex, rebuilt
+when the catalog version is bumped.
+"""
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.db.models import Q
+
+from .models import Brand, Product, ProductSearchTerm, ProductVariant
+from .search import MAX_QUERY_TERMS, match_terms, tokenize
+from .utils import WorkerLocalIndex
+
+# Minimum similarity for a word to count as a near match (pg_trgm's default).
+SIMILARITY_THRESHOLD = 0.3
+# How many near matches of a misspelt token are searched for.
+MAX_ALTERNATIVES = 3
+
+
+def trigrams(word):
+    """ The set of trigrams of a word, padded the way pg_trgm does. """
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """ Near-match lookup over a {word: frequency} vocabulary. """
+
+    def __init__(self, vocabulary):
+        self.words = sorted(vocabulary)
+        self.frequency = [vocabulary[word] for word in self.words]
+        self.sizes = []
+        self.postings = defaultdict(list)
+        for position, word in enumerate(self.words):
+            grams = trigrams(word)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(position)
+
+    def __contains__(self, word):
+        position = bisect_left(self.words, word)
+        return position < len(self.words) and self.words[position] == word
+
+    def has_prefix(self, prefix):
+        position = bisect_left(self.words, prefix)
+        return position < len(self.words) and self.words[position].startswith(prefix)
+
+    def similar(self, word, limit=MAX_ALTERNATIVES, threshold=SIMILARITY_THRESHOLD):
+        """ Return up to `limit` (word, similarity) pairs, best first. """
+        grams = trigrams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        matches = []
+        for position, common in shared.items():
+            similarity = common / (len(grams) + self.sizes[position] - common)
+            if similarity >= threshold:
+                matches.append((similarity, self.frequency[position], self.words[position]))
+        matches.sort(reverse=True)
+        return [(match, similarity) for similarity, _, match in matches[:limit]]
+
+
+def build_vocabulary():
+    """ Return a {word: frequency} mapping of active product names, brands and SKUs. """
+    vocabulary = Counter()
+    products = Product.objects.filter(is_active=True)
+    for name in products.values_list('name', flat=True).iterator():
+        vocabulary.update(tokenize(name))
+    for name in Brand.objects.filter(products__in=products).distinct().values_list('name', flat=True):
+        vocabulary.update(tokenize(name))
+    for sku in ProductVariant.objects.filter(product__in=products).values_list('sku', flat=True).iterator():
+        tokens = tokenize(sku)
+        vocabulary.update(tokens)
+        if len(tokens) > 1:
+            vocabulary[''.join(tokens)] += 1
+    return dict(vocabulary)
+
+
+trigram_index = WorkerLocalIndex('catalog:fuzzy-vocabulary:{version}', build_vocabulary, TrigramIndex)
+
+
+def fuzzy_search(query, queryset=None):
+    """
+    Like search.search_products, but tolerant of misspelt tokens.
+
+    Tokens found in the search index are matched as usual; every other token
+    matches any of its closest vocabulary words, and tokens with no close word
+    at all are ignored. Returns (queryset, suggestion) where suggestion is the
+    corrected query ("did you mean"), or None if nothing was corrected.
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+    tokens = tokenize(query)[:MAX_QUERY_TERMS]
+    if not tokens:
+        return queryset.none(), None
+
+    index = trigram_index.get()
+    known = set(ProductSearchTerm.objects.filter(term__in=tokens).values_list('term', flat=True).distinct())
+    conditions = []
+    corrected = []
+    position = 0
+    while position < len(tokens):
+        token = tokens[position]
+        position += 1
+        last = position == len(tokens)
+        if token in known:
+            conditions.append(Q(term=token))
+            corrected.append(token)
+        elif not last and token + tokens[position] in index:
+            # A SKU typed with a separator in it, e.g. "srpd 55" for SRPD55.
+            token += tokens[position]
+            position += 1
+            conditions.append(Q(term=token))
+            corrected.append(token)
+        elif last and index.has_prefix(token):
+            conditions.append(Q(term__startswith=token))
+            corrected.append(token)
+        else:
+            matches = index.similar(token)
+            if matches:
+                conditions.append(Q(term__in=[word for word, _ in matches]))
+                corrected.append(matches[0][0])
+
+    if not conditions:
+        return queryset.none(), None
+    suggestion = ' '.join(corrected) if corrected != tokens else None
+    return match_terms(queryset, conditions), suggestion
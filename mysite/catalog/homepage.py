@@ -0,0 +1,135 @@
+"""
+Home page composition, served stale-while-revalidate.
+
+The home page sections (latest arrivals, best sellers and featured brands)
+are built by a Celery task into one plain payload stored in the cache without
+expiry. Requests only ever read that payload: once it is older than
+SOFT_TTL, the first request to notice schedules a rebuild (at most one at a
+time) and carries on with the stale payload. Before the first build, the
+sections are empty. Staff can rebuild it on demand from the product admin.
+
+The lock is held from scheduling until the task that was queued with its
+token finishes; only that task releases it, and it is released at once if
+the task can't be queued (e.g. the broker is down).
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from kombu.exceptions import OperationalError
+
+from orders.models import Order, OrderItem
+from .models import Brand, ProductCard
+
+HOMEPAGE_CACHE_KEY = 'catalog:homepage'
+REFRESH_LOCK_CACHE_KEY = 'catalog:homepage:refreshing'
+SOFT_TTL = 60 * 5
+REFRESH_LOCK_TIMEOUT = 60 * 2
+SECTION_SIZE = 8
+FEATURED_BRANDS = 6
+BEST_SELLER_DAYS = 30
+
+CARD_FIELDS = ('product_id', 'name', 'slug', 'brand_name', 'min_price', 'medium_url', 'image_alt')
+
+logger = logging.getLogger(__name__)
+
+
+def _cards(queryset):
+    cards = []
+    for card in queryset:
+        cards.append(dict({field: getattr(card, field) for field in CARD_FIELDS}, url=card.get_absolute_url()))
+    return cards
+
+
+def latest_arrivals():
+    return _cards(ProductCard.objects.order_by('-created_at')[:SECTION_SIZE])
+
+
+def best_sellers():
+    """ Cards of the products with the most units sold over the last BEST_SELLER_DAYS days. """
+    since = timezone.now() - timedelta(days=BEST_SELLER_DAYS)
+    sales = (
+        OrderItem.objects.filter(order__placed_at__gte=since, variant__isnull=False)
+        .exclude(order__status=Order.OrderStatus.CANCELLED)
+        .values('variant__product_id')
+        .annotate(units=Sum('quantity'))
+        .order_by('-units')
+    )
+    ranked = [row['variant__product_id'] for row in sales[:SECTION_SIZE * 2]]
+    # Ranked products may be inactive since, i.e. have no card; the top ones that do are kept.
+    cards = ProductCard.objects.in_bulk(ranked)
+    return _cards([cards[pk] for pk in ranked if pk in cards][:SECTION_SIZE])
+
+
+def featured_brands():
+    brands = Brand.objects.filter(product_count__gt=0).order_by('-product_count', 'name')[:FEATURED_BRANDS]
+    return [
+        {
+            'name': brand.name,
+            'slug': brand.slug,
+            'url': brand.get_absolute_url(),
+            'logo_url': brand.logo.url if brand.logo else '',
+            'product_count': brand.product_count,
+        }
+        for brand in brands
+    ]
+
+
+def build_homepage():
+    return {
+        'built_at': timezone.now(),
+        'latest_arrivals': latest_arrivals(),
+        'best_sellers': best_sellers(),
+        'featured_brands': featured_brands(),
+    }
+
+
+def _release_lock(token):
+    # The lock may have expired and been taken by another refresh meanwhile.
+    if cache.get(REFRESH_LOCK_CACHE_KEY) == token:
+        cache.delete(REFRESH_LOCK_CACHE_KEY)
+
+
+def refresh_homepage(lock_token=None):
+    """
+    Rebuild and store the payload; returns it. lock_token is given by the
+    task schedule_refresh() queued, which then releases the refresh lock.
+    """
+    try:
+        payload = build_homepage()
+        cache.set(HOMEPAGE_CACHE_KEY, payload, timeout=None)
+    finally:
+        if lock_token is not None:
+            _release_lock(lock_token)
+    return payload
+
+
+def schedule_refresh():
+    """ Queue a rebuild unless one is already queued or running. """
+    token = uuid.uuid4().hex
+    if not cache.add(REFRESH_LOCK_CACHE_KEY, token, timeout=REFRESH_LOCK_TIMEOUT):
+        return
+    # Imported here as the tasks module imports this one.
+    from .tasks import refresh_homepage as refresh_homepage_task
+
+    def enqueue():
+        try:
+            refresh_homepage_task.delay(token)
+        except OperationalError:
+            # Keep serving the stale page; the next request tries again.
+            logger.exception('Could not queue the home page refresh')
+            _release_lock(token)
+
+    transaction.on_commit(enqueue)
+
+
+def get_homepage():
+    """ The current payload, possibly stale, without ever building it in the request. """
+    payload = cache.get(HOMEPAGE_CACHE_KEY)
+    if payload is None or payload['built_at'] < timezone.now() - timedelta(seconds=SOFT_TTL):
+        schedule_refresh()
+    return payload or {'built_at': None, 'latest_arrivals': [], 'best_sellers': [], 'featured_brands': []}
@@ -0,0 +1,98 @@
+"""
+Eager rendering of ProductImage derivatives.
+
+ImageKit renders a spec the first time its URL is requested, which puts Pillow
+resizes on the request path. Instead, every image is rendered ahead of time by
+a Celery task (see catalog.tasks) once it is saved: the thumbnail, medium and
+large specs plus a set of width-bound AVIF and WebP files for `srcset`. The
+resulting storage names are recorded on the image together with a readiness
+flag, and URLs are built from those names alone.
+
+render_derivatives() needs no database access, so batches can be spread over a
+process pool (see the generate_image_derivatives command).
+"""
+import logging
+
+from imagekit.cachefiles import ImageCacheFile
+from imagekit.processors import ResizeToFit
+from imagekit.specs import ImageSpec
+from PIL import features
+
+from .models import ProductImage
+
+logger = logging.getLogger(__name__)
+
+FIXED_SPECS = ('thumbnail', 'medium', 'large')
+# Widths rendered for `srcset`, skipping those wider than the source.
+SRCSET_WIDTHS = (320, 640, 960, 1280)
+# srcset key -> (Pillow format, save options); formats Pillow can't encode are skipped.
+SRCSET_FORMATS = {
+    'avif': ('AVIF', {'quality': 60}),
+    'webp': ('WEBP', {'quality': 80}),
+}
+
+
+class ResponsiveSpec(ImageSpec):
+    """ A derivative scaled down to fit a width, for use in `srcset`. """
+
+    def __init__(self, source, width, image_format, options):
+        self.processors = [ResizeToFit(width=width, upscale=False)]
+        self.format = image_format
+        self.options = options
+        super().__init__(source)
+
+
+def srcset_formats():
+    return {key: value for key, value in SRCSET_FORMATS.items() if features.check(key)}
+
+
+def render_derivatives(source_name):
+    """
+    Render every derivative of the source image stored under source_name.
+
+    Returns the `derivatives` dict to record on the image, or None if the
+    source could not be read.
+    """
+    image = ProductImage(image=source_name)
+    try:
+        derivatives = {'source': source_name}
+        for spec in FIXED_SPECS:
+            cachefile = getattr(image, spec)
+            cachefile.generate()
+            derivatives[spec] = cachefile.name
+
+        widths = [width for width in SRCSET_WIDTHS if width <= image.image.width] or [image.image.width]
+        derivatives['srcset'] = {}
+        for key, (image_format, options) in srcset_formats().items():
+            entries = []
+            for width in widths:
+                cachefile = ImageCacheFile(ResponsiveSpec(image.image, width, image_format, options))
+                cachefile.generate()
+                entries.append([width, cachefile.name])
+            derivatives['srcset'][key] = entries
+        return derivatives
+    except (OSError, ValueError):
+        logger.exception('Could not render derivatives of %s', source_name)
+        return None
+
+
+def process_images(image_ids, map_func=map):
+    """
+    Render and record the derivatives of the given images.
+
+    map_func distributes render_derivatives over the source names, e.g. a
+    process pool's map. Returns the ids of the products whose images became
+    ready. Images replaced in the meantime are left for their own run.
+    """
+    rows = list(ProductImage.objects.filter(pk__in=image_ids).values_list('pk', 'product_id', 'image'))
+    rows = [row for row in rows if row[2]]
+    product_ids = set()
+    for (pk, product_id, source_name), derivatives in zip(rows, map_func(render_derivatives, [row[2] for row in rows])):
+        if derivatives is None:
+            continue
+        updated = ProductImage.objects.filter(pk=pk, image=source_name).update(
+            derivatives=derivatives, derivatives_ready=True
+        )
+        if updated:
+            product_ids.add(product_id)
+    return product_ids
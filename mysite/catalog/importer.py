@@ -0,0 +1,556 @@
+"""
+Streaming bulk import of catalog data.
+
+Input is a stream of flat records, one per variant, read from CSV or JSON
+Lines. The recognised keys are:
+
+    sku (required), variant_name, price (required), compare_price, stock,
+    weight, attributes, dimensions (JSON objects; JSON-encoded text in CSV),
+    product_slug (required), product_name (required), description, is_active,
+    brand, brand_slug, categories, images, image_alt, deleted
+
+`categories` holds '|'-separated category paths of names or slugs separated
+by '/' (e.g. "Men's Watches/Divers|sale") and `images` '|'-separated file names
+relative to the images directory. A record with `deleted` set (as listed by
+incremental exports) deletes the variant with its sku instead.
+
+Only the columns a record gives are written: a missing key (or null) leaves
+the stored value alone, so a feed of prices and stock doesn't touch
+descriptions. A blank value clears the column, except for variant_name,
+stock and is_active, which have no blank value and count as missing. A brand
+given by brand_slug alone must exist already.
+
+Records are processed in batches, each in its own transaction: brands and
+products are upserted with bulk_create(update_conflicts=True) keyed by slug,
+variants keyed by sku, and category memberships and images are added in bulk.
+A product's categories are those listed by all its rows in the file: they are
+gathered over the whole run (including records skipped when resuming) and the
+memberships no row lists are removed once, at the end.
+Brands and categories are resolved through in-memory maps loaded once, and
+image files are read and hashed by a thread pool. Derived data (search index,
+cards, facets, attribute index, counters and image derivatives) is refreshed
+once per batch or once at the end rather than through per-row signals.
+"""
+import csv
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import attributes, counters, media
+from .models import Brand, Category, Product, ProductImage, ProductVariant
+from .signals import mark_products_changed
+from .tasks import generate_image_derivatives
+from .utils import chunked
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+LIST_SEPARATOR = '|'
+PATH_SEPARATOR = '/'
+NOT_BLANK = {'variant_name', 'stock', 'is_active'}
+BRAND_COLUMNS = {'brand', 'brand_slug'}
+PRODUCT_COLUMNS = {'description': 'description', 'is_active': 'is_active'}
+VARIANT_COLUMNS = {
+    'variant_name': 'name',
+    'compare_price': 'compare_price',
+    'stock': 'stock',
+    'weight': 'weight',
+    'attributes': 'attributes',
+    'dimensions': 'dimensions',
+}
+
+
+class RecordError(ValueError):
+    pass
+
+
+def read_records(stream, file_format):
+    """
+    Yield (line number, record dict) pairs from a text stream in 'csv' or
+    'jsonl' format.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, RecordError(f'Invalid JSON: {e}')
+                continue
+            yield line_number, record
+    else:
+        raise ValueError(f'Unsupported format "{file_format}", expected "csv" or "jsonl".')
+
+
+def guess_format(filename):
+    return 'jsonl' if os.path.splitext(filename)[1].lower() in ('.jsonl', '.ndjson', '.json') else 'csv'
+
+
+def _text(record, key, default=''):
+    value = record.get(key)
+    if value is None:
+        return default
+    return str(value).strip()
+
+
+def _decimal(record, key, required=False):
+    value = _text(record, key)
+    if not value:
+        if required:
+            raise RecordError(f'Missing {key}.')
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise RecordError(f'Invalid {key} "{value}".')
+
+
+def _json(record, key):
+    value = record.get(key)
+    if value in (None, ''):
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise RecordError(f'Invalid JSON in {key}.')
+    if not isinstance(value, dict):
+        raise RecordError(f'{key} must be a JSON object.')
+    return value
+
+
+def _list(record, key):
+    value = record.get(key)
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in _text(record, key).split(LIST_SEPARATOR) if item.strip()]
+
+
+def _given(record):
+    """ The columns a record gives a value for (see the module docstring). """
+    return {
+        key for key, value in record.items()
+        if value is not None and (key not in NOT_BLANK or str(value).strip())
+    }
+
+
+def _columns(row, columns):
+    """ {field: value} for the columns given by a parsed row. """
+    return {field: row[column] for column, field in columns.items() if column in row['columns']}
+
+
+def _upsert(model, unique_field, objects):
+    """
+    Upsert (instance, update fields) pairs keyed by unique_field, with one
+    bulk_create per distinct set of update fields so that every row only
+    overwrites the columns it was given.
+    """
+    groups = {}
+    for obj, fields in objects:
+        groups.setdefault(tuple(sorted(fields)), []).append(obj)
+    for fields, objs in groups.items():
+        model.objects.bulk_create(
+            objs, update_conflicts=True, unique_fields=[unique_field], update_fields=list(fields)
+        )
+
+
+def parse_record(record):
+    """ Validate and type a raw record, raising RecordError. """
+    if isinstance(record, RecordError):
+        raise record
+    sku = _text(record, 'sku')
+    product_slug = _text(record, 'product_slug')
+    product_name = _text(record, 'product_name')
+    if not sku:
+        raise RecordError('Missing sku.')
+    if not product_slug or not product_name:
+        raise RecordError('Missing product_slug or product_name.')
+    stock = _text(record, 'stock') or '0'
+    if not stock.isdigit():
+        raise RecordError(f'Invalid stock "{stock}".')
+    brand = _text(record, 'brand')
+    is_active = _text(record, 'is_active')
+    return {
+        'sku': sku,
+        'variant_name': _text(record, 'variant_name') or sku,
+        'price': _decimal(record, 'price', required=True),
+        'compare_price': _decimal(record, 'compare_price'),
+        'stock': int(stock),
+        'weight': _decimal(record, 'weight'),
+        'attributes': _json(record, 'attributes'),
+        'dimensions': _json(record, 'dimensions'),
+        'product_slug': product_slug,
+        'product_name': product_name,
+        'description': _text(record, 'description'),
+        'is_active': is_active.lower() in TRUE_VALUES if is_active else True,
+        'brand': brand,
+        'brand_slug': _text(record, 'brand_slug') or slugify(brand),
+        'categories': [
+            [name.strip() for name in path.split(PATH_SEPARATOR) if name.strip()]
+            for path in _list(record, 'categories')
+        ],
+        'images': _list(record, 'images'),
+        'image_alt': _text(record, 'image_alt'),
+        'columns': _given(record),
+    }
+
+
+class ImportReport:
+    """ Running totals of an import, with throughput. """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.records = 0
+        self.skipped = 0
+        self.brands = 0
+        self.categories = 0
+        self.products = 0
+        self.variants = 0
+        self.deleted = 0
+        self.images = 0
+        self.errors = []
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.records / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'records': self.records,
+            'skipped': self.skipped,
+            'brands': self.brands,
+            'categories': self.categories,
+            'products': self.products,
+            'variants': self.variants,
+            'deleted': self.deleted,
+            'images': self.images,
+            'errors': self.errors,
+            'seconds': round(self.elapsed, 2),
+            'records_per_second': round(self.rate, 1),
+        }
+
+
+class CatalogImporter:
+    """
+    Imports parsed records in batches. With dry_run, every batch runs in a
+    transaction that is rolled back and no image files are written.
+    """
+    max_errors = 1000
+
+    def __init__(self, batch_size=500, images_dir=None, image_workers=8, dry_run=False):
+        self.batch_size = batch_size
+        self.images_dir = images_dir
+        self.image_workers = image_workers
+        self.dry_run = dry_run
+        self.report = ImportReport()
+        self.product_slugs = set()
+        self.product_categories = {}
+        self.image_field = ProductImage._meta.get_field('image')
+        self.brand_ids = dict(Brand.objects.values_list('slug', 'pk'))
+        self.category_ids = {}
+        self.category_slugs = set()
+        for pk, parent_id, name, slug in Category.objects.values_list('pk', 'parent_id', 'name', 'slug'):
+            self.add_category(pk, parent_id, name, slug)
+
+    def run(self, records, skip=0, on_batch=None):
+        """
+        Import (line number, raw record) pairs, skipping the first `skip`
+        records. on_batch(records_done) is called after each committed batch.
+        """
+        done = 0
+        for batch in chunked(records, self.batch_size):
+            if done + len(batch) <= skip:
+                done += len(batch)
+                self.report.skipped += len(batch)
+                self.gather_categories(batch)
+                continue
+            if done < skip:
+                self.report.skipped += skip - done
+                self.gather_categories(batch[:skip - done])
+                batch = batch[skip - done:]
+                done = skip
+            self.import_batch(batch)
+            done += len(batch)
+            if on_batch is not None:
+                on_batch(done)
+        if not self.dry_run:
+            self.prune_categories()
+            counters.reconcile_counts()
+        return self.report
+
+    def import_batch(self, batch):
+        rows = []
+        deleted = set()
+        for line_number, raw in batch:
+            if isinstance(raw, dict) and _text(raw, 'deleted').lower() in TRUE_VALUES:
+                if _text(raw, 'sku'):
+                    deleted.add(_text(raw, 'sku'))
+                else:
+                    self.error(line_number, 'Missing sku.')
+                continue
+            try:
+                rows.append(parse_record(raw))
+            except RecordError as e:
+                self.error(line_number, e)
+        self.report.records += len(batch)
+        if not rows and not deleted:
+            return
+
+        images = self.read_images(rows)
+        with transaction.atomic():
+            product_ids = self.save_rows(rows, images) if rows else set()
+            if deleted:
+                # post_delete still fires per variant, marking products changed and recording the deletion.
+                self.report.deleted += ProductVariant.objects.filter(sku__in=deleted).delete()[1].get(
+                    ProductVariant._meta.label, 0
+                )
+            if self.dry_run:
+                transaction.set_rollback(True)
+            else:
+                mark_products_changed(product_ids)
+
+    def error(self, line_number, error):
+        if len(self.report.errors) < self.max_errors:
+            self.report.errors.append({'line': line_number, 'error': str(error)})
+
+    def read_images(self, rows):
+        """
+        Read, hash and store the batch's image files using a thread pool.
+        Returns {file name: stored name}; unreadable files are reported.
+
+        Files are stored before the batch's transaction, so they are queued
+        for the media sweep right away: if the batch rolls back or fails, the
+        sweep deletes them once the grace period is over. With dry_run nothing
+        is written.
+        """
+        filenames = sorted({filename for row in rows for filename in row['images']})
+        if not filenames:
+            return {}
+        if not self.images_dir:
+            self.error(None, 'Image files given but no images directory configured.')
+            return {}
+
+        def store(filename):
+            path = os.path.join(self.images_dir, filename)
+            try:
+                with open(path, 'rb') as f:
+                    content = ContentFile(f.read(), name=filename)
+            except OSError as e:
+                return filename, None, e
+            name = self.image_field.generate_filename(None, media.content_name(content, filename))
+            if not self.dry_run:
+                name = media.store(self.image_field.storage, name, content)
+            return filename, name, None
+
+        stored = {}
+        with ThreadPoolExecutor(max_workers=self.image_workers) as pool:
+            for filename, name, error in pool.map(store, filenames):
+                if error is not None:
+                    self.error(None, f'Could not read image {filename}: {error}')
+                else:
+                    stored[filename] = name
+        if not self.dry_run:
+            media.release_stored(stored.values())
+        return stored
+
+    def save_rows(self, rows, images):
+        """ Upsert one batch of parsed rows; returns the ids of the products touched. """
+        now = timezone.now()
+        self.save_brands(rows)
+
+        # Rows of the same product or variant are merged, later columns winning.
+        products = {}
+        for row in rows:
+            fields = products.setdefault(row['product_slug'], {})
+            fields['name'] = row['product_name']
+            fields.update(_columns(row, PRODUCT_COLUMNS))
+            if row['columns'] & BRAND_COLUMNS:
+                if not row['brand_slug']:
+                    fields['brand_id'] = None
+                elif row['brand_slug'] in self.brand_ids:
+                    fields['brand_id'] = self.brand_ids[row['brand_slug']]
+        _upsert(Product, 'slug', [
+            (Product(slug=slug, updated_at=now, **fields), [*fields, 'updated_at'])
+            for slug, fields in products.items()
+        ])
+        product_ids = dict(Product.objects.filter(slug__in=products).values_list('slug', 'pk'))
+        self.product_slugs.update(products)
+        self.report.products = len(self.product_slugs)
+
+        variants = {}
+        for row in rows:
+            fields = variants.setdefault(row['sku'], {})
+            fields['product_id'] = product_ids[row['product_slug']]
+            fields['price'] = row['price']
+            fields.update(_columns(row, VARIANT_COLUMNS))
+        _upsert(ProductVariant, 'sku', [
+            # A new variant without a name is named after its sku.
+            (ProductVariant(sku=sku, updated_at=now, **{'name': sku, **fields}), [*fields, 'updated_at'])
+            for sku, fields in variants.items()
+        ])
+        attributes.index_variants(ProductVariant.objects.filter(sku__in=variants))
+        self.report.variants += len(variants)
+
+        self.save_categories(rows, product_ids)
+        self.save_images(rows, images, product_ids)
+        return set(product_ids.values())
+
+    def save_brands(self, rows):
+        """ Upsert the brands named in the batch; a brand is never given an empty name. """
+        brands = {
+            row['brand_slug']: Brand(slug=row['brand_slug'], name=row['brand'])
+            for row in rows if row['brand_slug'] and row['brand']
+        }
+        unknown = {row['brand_slug'] for row in rows if row['brand_slug']} - brands.keys() - self.brand_ids.keys()
+        for slug in sorted(unknown):
+            self.error(None, f'Unknown brand "{slug}" given without a name; products kept their brand.')
+        if not brands:
+            return
+        Brand.objects.bulk_create(
+            brands.values(), update_conflicts=True, unique_fields=['slug'], update_fields=['name']
+        )
+        new = [slug for slug in brands if slug not in self.brand_ids]
+        self.brand_ids.update(Brand.objects.filter(slug__in=new).values_list('slug', 'pk'))
+        self.report.brands += len(new)
+
+    def add_category(self, pk, parent_id, name, slug):
+        self.category_ids[parent_id, name.casefold()] = pk
+        self.category_ids.setdefault((parent_id, slug), pk)
+        self.category_slugs.add(slug)
+
+    def category_id(self, path):
+        """ Resolve a category path of names or slugs, creating missing categories. """
+        parent_id = None
+        for name in path:
+            pk = self.category_ids.get((parent_id, name.casefold()))
+            if pk is None:
+                pk = self.category_ids.get((parent_id, slugify(name)))
+            if pk is None:
+                # Categories are few and MPTT needs per-node inserts, so they're created one by one.
+                slug = base = slugify(name) or 'category'
+                suffix = 1
+                while slug in self.category_slugs:
+                    suffix += 1
+                    slug = f'{base}-{suffix}'
+                pk = Category.objects.create(name=name, slug=slug, parent_id=parent_id).pk
+                self.add_category(pk, parent_id, name, slug)
+                self.report.categories += 1
+            parent_id = pk
+        return parent_id
+
+    def gather_categories(self, batch):
+        """ Note the categories of records skipped when resuming, for prune_categories(). """
+        if self.dry_run:
+            return
+        for _, raw in batch:
+            try:
+                row = parse_record(raw)
+            except RecordError:
+                continue
+            self.wanted_categories(row)
+
+    def wanted_categories(self, row):
+        """ Add a row's categories to those of its product over the run; returns their ids. """
+        ids = {self.category_id(path) for path in row['categories']}
+        if ids:
+            self.product_categories.setdefault(row['product_slug'], set()).update(ids)
+        return ids
+
+    def save_categories(self, rows, product_ids):
+        """
+        Add the categories the batch's rows list to their products. Memberships
+        are only removed by prune_categories(), once every row has been seen.
+        """
+        through = Product.category.through
+        through.objects.bulk_create(
+            [
+                through(product_id=product_ids[row['product_slug']], category_id=category_id)
+                for row in rows for category_id in self.wanted_categories(row)
+            ],
+            ignore_conflicts=True,
+        )
+
+    def prune_categories(self):
+        """ Remove the category memberships no row of the import listed for their product. """
+        through = Product.category.through
+        changed = set()
+        with transaction.atomic():
+            for slugs in chunked(self.product_categories, self.batch_size):
+                product_ids = dict(Product.objects.filter(slug__in=slugs).values_list('pk', 'slug'))
+                stale = [
+                    (pk, product_id)
+                    for pk, product_id, category_id in through.objects.filter(product_id__in=product_ids)
+                    .values_list('pk', 'product_id', 'category_id')
+                    if category_id not in self.product_categories[product_ids[product_id]]
+                ]
+                if stale:
+                    through.objects.filter(pk__in=[pk for pk, _ in stale]).delete()
+                    changed.update(product_id for _, product_id in stale)
+            mark_products_changed(changed)
+
+    def save_images(self, rows, images, product_ids):
+        """ Attach the images not yet attached to their product. """
+        wanted = {}
+        for row in rows:
+            product_id = product_ids[row['product_slug']]
+            for filename in row['images']:
+                if filename in images:
+                    wanted.setdefault((product_id, images[filename]), row['image_alt'])
+        if not wanted:
+            return
+        existing = ProductImage.objects.filter(product_id__in={p for p, _ in wanted})
+        attached = set(existing.values_list('product_id', 'image'))
+        with_primary = set(existing.filter(is_primary=True).values_list('product_id', flat=True))
+        rendered = dict(
+            ProductImage.objects.filter(image__in={name for _, name in wanted}, derivatives_ready=True)
+            .values_list('image', 'derivatives')
+        )
+
+        new_images = []
+        positions = {}
+        for (product_id, name), alt_text in wanted.items():
+            if (product_id, name) in attached:
+                continue
+            positions[product_id] = positions.get(product_id, -1) + 1
+            new_images.append(ProductImage(
+                product_id=product_id,
+                image=name,
+                alt_text=alt_text,
+                is_primary=product_id not in with_primary and positions[product_id] == 0,
+                order=positions[product_id],
+                derivatives=rendered.get(name, {}),
+                derivatives_ready=name in rendered,
+            ))
+        ProductImage.objects.bulk_create(new_images)
+        self.report.images += len(new_images)
+
+        if not self.dry_run:
+            pending = list(
+                ProductImage.objects.filter(
+                    product_id__in={image.product_id for image in new_images},
+                    image__in={image.image.name for image in new_images},
+                    derivatives_ready=False,
+                ).values_list('pk', flat=True)
+            )
+            if pending:
+                transaction.on_commit(lambda: generate_image_derivatives.delay(pending))
+
+
+def open_text(uploaded):
+    """ Wrap an uploaded (binary) file as a UTF-8 text stream. """
+    return io.TextIOWrapper(uploaded, encoding='utf-8-sig', newline='')
@@ -0,0 +1,2 @@
+
+# No-op file to make the directory a package
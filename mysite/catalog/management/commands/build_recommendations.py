@@ -0,0 +1,44 @@
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from catalog.recommendations import rebuild_bought_together, update_bought_together
+
+
+class Command(BaseCommand):
+    help = 'Computes the "frequently bought together" recommendations from order history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows inserted (and products recomputed) per batch.'
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Only recompute products ordered since the last run.'
+        )
+        parser.add_argument(
+            '--since',
+            help='With --incremental, recompute products ordered since this ISO 8601 time instead.'
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since time \"{options['since']}\".")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        if options['incremental'] or since:
+            changed = update_bought_together(since, batch_size=options['batch_size'])
+        else:
+            changed = rebuild_bought_together(batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully computed recommendations ({changed} products changed).'
+        ))
@@ -0,0 +1,100 @@
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from catalog import media
+from catalog.models import Brand, ProductImage
+from catalog.signals import mark_products_changed
+from catalog.tasks import generate_image_derivatives
+from catalog.utils import chunked
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves product images and brand logos to content-addressed storage, '
+        'so identical files are stored (and resized) only once, then deletes '
+        'the released files whose grace period is over.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of stored files read from the database per batch.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be deduplicated.'
+        )
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.stats = {'files': 0, 'moved': 0, 'duplicates': 0, 'missing': 0, 'freed': 0}
+        self.to_render = set()
+        # Content-addressed names already seen, for accurate dry-run counts.
+        self.targets = set()
+
+        for model, field in ((ProductImage, 'image'), (Brand, 'logo')):
+            names = (
+                model.objects.exclude(**{field: ''}).order_by(field)
+                .values_list(field, flat=True).distinct()
+            )
+            for batch in chunked(names.iterator(chunk_size=options['batch_size']), options['batch_size']):
+                for name in batch:
+                    if not media.is_content_addressed(name):
+                        self.dedupe(model, field, name)
+                self.stdout.write(f'Checked {self.stats["files"]} files...')
+
+        if self.to_render and not self.dry_run:
+            for batch in chunked(sorted(self.to_render), 100):
+                generate_image_derivatives.delay(batch)
+        swept = 0 if self.dry_run else media.sweep_released_files(batch_size=options['batch_size'])
+
+        prefix = 'Would deduplicate' if self.dry_run else 'Successfully deduplicated'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix} {self.stats["files"]} files: {self.stats["moved"]} moved to content-addressed names, '
+            f'{self.stats["duplicates"]} merged into existing copies, {self.stats["missing"]} missing, '
+            f'{self.stats["freed"]} bytes freed once their grace period is over; '
+            f'{swept} released files deleted.'
+        ))
+
+    def dedupe(self, model, field, name):
+        storage = model._meta.get_field(field).storage
+        self.stats['files'] += 1
+        if not storage.exists(name):
+            self.stats['missing'] += 1
+            return
+
+        size = storage.size(name)
+        with storage.open(name) as content:
+            target = model._meta.get_field(field).generate_filename(None, media.content_name(content, name))
+            exists = target in self.targets or storage.exists(target)
+            self.targets.add(target)
+            self.stats['duplicates' if exists else 'moved'] += 1
+            if exists:
+                self.stats['freed'] += size
+            if self.dry_run:
+                return
+            target = media.store(storage, target, content)
+
+        rows = model.objects.filter(**{field: name})
+        with transaction.atomic():
+            if model is ProductImage:
+                old_derivatives = [media.derivative_names(d) for d in rows.values_list('derivatives', flat=True)]
+                product_ids = list(rows.values_list('product_id', flat=True).distinct())
+                image_ids = list(rows.values_list('pk', flat=True))
+                rendered = (
+                    ProductImage.objects.filter(image=target, derivatives_ready=True)
+                    .values_list('derivatives', flat=True).first()
+                )
+                rows.update(image=target, derivatives=rendered or {}, derivatives_ready=rendered is not None)
+                if rendered is None:
+                    self.to_render.update(image_ids)
+                mark_products_changed(product_ids)
+                derivative_names = {n for names in old_derivatives for n in names}
+            else:
+                rows.update(logo=target)
+                derivative_names = ()
+            # The old file is deleted by the periodic sweep once its grace period is over.
+            media.release(name, derivative_names)
@@ -0,0 +1,70 @@
+
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from catalog.exporter import FEED_FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = 'Streams the catalog as CSV, JSON Lines or a Google Merchant XML feed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FEED_FORMATS, default='csv', help='Output format.')
+        parser.add_argument('--output', help='File to write (standard output by default).')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of variants read per database round trip.'
+        )
+        parser.add_argument(
+            '--base-url',
+            default='',
+            help='Site URL prepended to product and image links in the XML feed.'
+        )
+        parser.add_argument(
+            '--since',
+            help='Only export variants changed at or after this ISO 8601 time.'
+        )
+        parser.add_argument(
+            '--state',
+            help='File remembering when the last export started; only changes since then are exported.'
+        )
+
+    def handle(self, *args, **options):
+        started = timezone.now()
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since time \"{options['since']}\".")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        elif options['state'] and os.path.exists(options['state']):
+            with open(options['state']) as f:
+                since = parse_datetime(json.load(f)['started'])
+
+        lines = export_lines(
+            options['format'], since=since, base_url=options['base_url'], chunk_size=options['batch_size']
+        )
+        output = options['output']
+        # Write into a temporary file first so consumers never see a partial export.
+        target = open(f'{output}.tmp', 'w', encoding='utf-8', newline='') if output else sys.stdout
+        try:
+            target.writelines(lines)
+        finally:
+            if output:
+                target.close()
+        if output:
+            os.replace(f'{output}.tmp', output)
+        if options['state']:
+            with open(options['state'], 'w') as f:
+                json.dump({'started': started.isoformat()}, f)
+
+        if output:
+            scope = f'changes since {since.isoformat()}' if since else 'full catalog'
+            self.stdout.write(self.style.SUCCESS(f'Successfully exported the {scope} to {output}.'))
@@ -0,0 +1,54 @@
+
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from catalog.images import process_images
+from catalog.models import ProductImage
+from catalog.signals import mark_products_changed
+from catalog.utils import chunked
+
+
+class Command(BaseCommand):
+    help = 'Renders the derivatives (thumbnails and srcset sets) of product images ahead of time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of images rendered per batch.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Number of rendering processes (defaults to the number of CPUs).'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Re-render images whose derivatives are already recorded.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        images = ProductImage.objects.order_by('pk')
+        if not options['all']:
+            images = images.filter(derivatives_ready=False)
+        image_ids = list(images.values_list('pk', flat=True))
+
+        # Rendering processes are forked and only use storage, never the database.
+        connections.close_all()
+        processed = ready = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for batch in chunked(image_ids, batch_size):
+                product_ids = process_images(batch, map_func=pool.map)
+                mark_products_changed(product_ids)
+                processed += len(batch)
+                ready += ProductImage.objects.filter(pk__in=batch, derivatives_ready=True).count()
+                self.stdout.write(f'Processed {processed} of {len(image_ids)} images...')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully rendered derivatives for {ready} of {processed} images.'
+        ))
@@ -0,0 +1,88 @@
+
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from catalog.importer import CatalogImporter, guess_format, read_records
+
+
+class Command(BaseCommand):
+    help = 'Imports brands, categories, products, variants and images from a CSV or JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSON Lines file with one record per variant.')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            help='Input format (guessed from the file extension by default).'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of records upserted per batch and transaction.'
+        )
+        parser.add_argument(
+            '--images-dir',
+            help='Directory the file names in the images column are relative to.'
+        )
+        parser.add_argument(
+            '--image-workers',
+            type=int,
+            default=8,
+            help='Number of threads reading image files.'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='File recording progress after each batch; an interrupted import resumes from it.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Validate and import every batch, then roll it back.'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'File "{path}" does not exist.')
+        file_format = options['format'] or guess_format(path)
+        checkpoint = options['checkpoint']
+        dry_run = options['dry_run']
+
+        skip = 0
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+            if state.get('source') == os.path.abspath(path):
+                skip = state['records']
+                self.stdout.write(f'Resuming after {skip} records.')
+
+        importer = CatalogImporter(
+            batch_size=options['batch_size'],
+            images_dir=options['images_dir'],
+            image_workers=options['image_workers'],
+            dry_run=dry_run,
+        )
+
+        def on_batch(done):
+            report = importer.report
+            self.stdout.write(f'Imported {done} records ({report.rate:.0f} records/s)...')
+            if checkpoint and not dry_run:
+                with open(checkpoint, 'w') as f:
+                    json.dump({'source': os.path.abspath(path), 'records': done}, f)
+
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            report = importer.run(read_records(stream, file_format), skip=skip, on_batch=on_batch)
+
+        for error in report.errors:
+            self.stderr.write(f"Line {error['line']}: {error['error']}" if error['line'] else error['error'])
+        if checkpoint and not dry_run and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully {'validated' if dry_run else 'imported'} {report.records} records "
+            f"in {report.elapsed:.1f}s ({report.rate:.0f} records/s): {report.products} products, "
+            f"{report.variants} variants, {report.deleted} deleted variants, {report.images} images, "
+            f"{report.brands} new brands, {report.categories} new categories, {len(report.errors)} errors."
+        ))
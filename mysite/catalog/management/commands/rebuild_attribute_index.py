@@ -0,0 +1,32 @@
+
+from django.core.management.base import BaseCommand
+from catalog.attributes import index_variants
+from catalog.models import ProductAttributeValue, ProductVariant
+from catalog.utils import chunked
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the variant attribute index used by attribute filters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of variants indexed per batch.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        variants = ProductVariant.objects.order_by('pk').only('pk', 'product_id', 'attributes', 'dimensions')
+
+        processed = entries = 0
+        for batch in chunked(variants.iterator(chunk_size=batch_size), batch_size):
+            entries += index_variants(batch)
+            processed += len(batch)
+            self.stdout.write(f'Indexed {processed} variants...')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully indexed {entries} attribute values from {processed} variants '
+            f'({ProductAttributeValue.objects.count()} entries in total).'
+        ))
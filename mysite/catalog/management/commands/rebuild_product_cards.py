@@ -0,0 +1,32 @@
+
+from django.core.management.base import BaseCommand
+from catalog.cards import refresh_product_cards
+from catalog.models import Product, ProductCard
+from catalog.utils import chunked
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalized product cards used by listing pages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of products refreshed per batch.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        product_ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+
+        processed = cards = 0
+        for batch in chunked(product_ids.iterator(chunk_size=batch_size), batch_size):
+            cards += refresh_product_cards(batch)
+            processed += len(batch)
+            self.stdout.write(f'Processed {processed} products...')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully rebuilt {cards} product cards from {processed} products '
+            f'({ProductCard.objects.count()} cards in total).'
+        ))
@@ -0,0 +1,31 @@
+
+from django.core.management.base import BaseCommand
+from catalog.models import Product
+from catalog.search import index_products
+from catalog.utils import chunked
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product search index, streaming products in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of products indexed per batch.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        product_ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+
+        indexed = terms = 0
+        for batch in chunked(product_ids.iterator(chunk_size=batch_size), batch_size):
+            terms += index_products(batch)
+            indexed += len(batch)
+            self.stdout.write(f'Indexed {indexed} products...')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully indexed {indexed} products ({terms} terms).'
+        ))
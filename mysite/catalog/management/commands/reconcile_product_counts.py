@@ -0,0 +1,21 @@
+
+from django.core.management.base import BaseCommand
+from catalog.counters import reconcile_counts
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the maintained active-product counts on brands and categories.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of corrected rows written per UPDATE batch.'
+        )
+
+    def handle(self, *args, **options):
+        brands, categories = reconcile_counts(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully reconciled product counts ({brands} brands and {categories} categories corrected).'
+        ))
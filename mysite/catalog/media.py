@@ -0,0 +1,221 @@
+"""
+Content-addressed storage for product images and brand logos.
+
+Files are stored under the SHA-256 of their bytes (e.g. products/ab/ab12...ef.jpg),
+so uploading the same photo again reuses the stored file instead of writing a
+copy, and since ImageKit derives cache file names from the source name, its
+derivatives are shared too. Several rows may therefore point at one file: a
+file (and its recorded derivatives) is only deleted once no ProductImage or
+Brand references it anymore, which is counted through the indexed file columns.
+
+Files are not deleted when a row lets go of them, as an upload of the same
+content may be reusing the file at that very moment. release() queues them
+as ReleasedFile rows and sweep_released_files(), run periodically, deletes
+those unreferenced for longer than CATALOG_MEDIA_GRACE_HOURS. An upload that
+reuses a stored file marks its name as in use for an hour, under a per-name
+lock the sweep also takes, so the sweep can't delete the file between the
+upload finding it and the new reference being committed.
+"""
+import hashlib
+import os
+import re
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.fields.files import ImageField, ImageFieldFile
+from django.utils import timezone
+from PIL import Image
+
+HASH_CHUNK_SIZE = 64 * 1024
+CONTENT_NAME_RE = re.compile(r'(?:^|/)([0-9a-f]{2})/\1[0-9a-f]{62}(\.\w+)?$')
+FILE_LOCK_CACHE_KEY = 'catalog:media-lock:{name}'
+FILE_IN_USE_CACHE_KEY = 'catalog:media-in-use:{name}'
+FILE_LOCK_TIMEOUT = 60
+# Longer than any transaction that saves a reference to a stored file.
+FILE_IN_USE_TIMEOUT = 60 * 60
+FILE_LOCK_WAIT = 5.0
+FILE_LOCK_POLL_INTERVAL = 0.05
+
+
+def content_digest(content):
+    """ SHA-256 hex digest of a file's bytes, read in chunks. """
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in iter(lambda: content.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def content_extension(content, filename):
+    """ File extension for the image format of content, else the one of filename. """
+    try:
+        image_format = Image.open(content).format
+    except (OSError, ValueError):
+        image_format = None
+    finally:
+        content.seek(0)
+    if image_format:
+        return '.jpg' if image_format == 'JPEG' else f'.{image_format.lower()}'
+    return os.path.splitext(filename)[1].lower()
+
+
+def content_name(content, filename):
+    """ The content-addressed file name for content uploaded as filename. """
+    digest = content_digest(content)
+    return f'{digest[:2]}/{digest}{content_extension(content, filename)}'
+
+
+def is_content_addressed(name):
+    return bool(CONTENT_NAME_RE.search(name or ''))
+
+
+def grace_period():
+    return timedelta(hours=settings.CATALOG_MEDIA_GRACE_HOURS)
+
+
+def _lock(name, wait=0.0):
+    """ Take the lock of a stored file name, waiting up to `wait` seconds; returns its token, or None. """
+    key = FILE_LOCK_CACHE_KEY.format(name=name)
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    while not cache.add(key, token, timeout=FILE_LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(FILE_LOCK_POLL_INTERVAL)
+    return token
+
+
+def _unlock(name, token):
+    key = FILE_LOCK_CACHE_KEY.format(name=name)
+    if token is not None and cache.get(key) == token:
+        cache.delete(key)
+
+
+def store(storage, name, content, max_length=None):
+    """
+    Save content under its content-addressed name, or reuse the file stored
+    under it, marking the name as in use so the sweep leaves it alone until
+    the new reference is committed. Returns the stored name.
+    """
+    token = _lock(name, wait=FILE_LOCK_WAIT)
+    try:
+        cache.set(FILE_IN_USE_CACHE_KEY.format(name=name), True, timeout=FILE_IN_USE_TIMEOUT)
+        stored = name if storage.exists(name) else storage.save(name, content, max_length=max_length)
+    finally:
+        _unlock(name, token)
+    return stored
+
+
+class ContentAddressedFieldFile(ImageFieldFile):
+
+    def save(self, name, content, save=True):
+        name = self.field.generate_filename(self.instance, content_name(content, name))
+        self.name = store(self.storage, name, content, max_length=self.field.max_length)
+        setattr(self.instance, self.field.attname, self.name)
+        self._committed = True
+
+        if save:
+            self.instance.save()
+
+    save.alters_data = True
+
+
+class ContentAddressedImageField(ImageField):
+    """
+    An ImageField whose files are named after their content; upload_to
+    receives that name (e.g. 'ab/ab12...ef.jpg') and only adds a prefix.
+    """
+    attr_class = ContentAddressedFieldFile
+
+
+def references(name):
+    """ Number of product images and brand logos using the stored file name. """
+    # Imported here as the models module uses the field defined above.
+    from .models import Brand, ProductImage
+
+    if not name:
+        return 0
+    return ProductImage.objects.filter(image=name).count() + Brand.objects.filter(logo=name).count()
+
+
+def release(name, derivative_names=()):
+    """
+    Queue a stored file that lost a reference, and its derivatives, for
+    sweep_released_files(). Releasing it again restarts its grace period.
+    """
+    # Imported here as the models module uses the field defined above.
+    from .models import ReleasedFile
+
+    if name:
+        ReleasedFile.objects.update_or_create(
+            name=name, defaults={'derivatives': list(derivative_names), 'released_at': timezone.now()}
+        )
+
+
+def release_stored(names):
+    """
+    Queue files stored ahead of the rows that will reference them (bulk
+    imports), so they are collected if those rows never commit; files that
+    are referenced by the time of the sweep are just forgotten.
+    """
+    from .models import ReleasedFile
+
+    now = timezone.now()
+    ReleasedFile.objects.bulk_create(
+        [ReleasedFile(name=name, released_at=now) for name in set(names) if name],
+        update_conflicts=True,
+        unique_fields=['name'],
+        update_fields=['released_at'],
+    )
+
+
+def sweep_released_files(grace=None, batch_size=500):
+    """
+    Delete the released files (and their derivatives) left unreferenced for
+    longer than the grace period; returns the number of files deleted.
+    Released files that are in use again are just forgotten.
+    """
+    from .models import ProductImage, ReleasedFile
+
+    # Product images and brand logos share the default storage.
+    storage = ProductImage._meta.get_field('image').storage
+    cutoff = timezone.now() - (grace_period() if grace is None else grace)
+    released = ReleasedFile.objects.filter(released_at__lt=cutoff).order_by('pk')
+    deleted = 0
+    last_pk = 0
+    while True:
+        batch = list(released.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return deleted
+        last_pk = batch[-1].pk
+        for released_file in batch:
+            name = released_file.name
+            token = _lock(name)
+            if token is None:
+                # Being uploaded right now; it will be in use or released again.
+                continue
+            try:
+                if cache.get(FILE_IN_USE_CACHE_KEY.format(name=name)):
+                    continue
+                if not references(name):
+                    for stored in [name, *released_file.derivatives]:
+                        if stored and storage.exists(stored):
+                            storage.delete(stored)
+                    deleted += 1
+                released_file.delete()
+            finally:
+                _unlock(name, token)
+
+
+def derivative_names(derivatives):
+    """ Every storage name recorded in a ProductImage.derivatives dict. """
+    names = [derivatives.get(spec) for spec in ('thumbnail', 'medium', 'large')]
+    for entries in (derivatives.get('srcset') or {}).values():
+        names.extend(name for _, name in entries)
+    return [name for name in names if name]
@@ -1,36 +1,28 @@
 
 from django.db import models
 from django.db.models import JSONField
-import uuid
 import os
 from mptt.models import MPTTModel, TreeForeignKey
 from imagekit.models import ImageSpecField
 from imagekit.processors import ResizeToFill
 from django.urls import reverse
 from django.contrib.auth.models import User
+from .media import ContentAddressedImageField
 
 def product_image_path(instance, filename):
     """
-    Generate file path for new product images.
-    e.g., products/123/abc-123-def-456.jpg
+    Generate file path for product images, named after a hash of their content
+    so identical uploads share one file.
+    e.g., products/ab/ab12...ef.jpg
     """
-    ext = os.path.splitext(filename)[1]
-    # get filename
-    if instance.product.pk:
-        filename = f'{uuid.uuid4()}{ext}'
-        return os.path.join('products', str(instance.product.pk), filename)
-    # else, this is a new product, so use a temporary path
-    # we'll rename it later in a signal
-    return os.path.join('products', 'temp', f'{uuid.uuid4()}{ext}')
+    return os.path.join('products', filename)
 
 def brand_logo_path(instance, filename):
     """
-    Generate file path for new brand logos.
-    e.g., brands/bikers/abc-123.png
+    Generate file path for brand logos, named after a hash of their content.
+    e.g., brands/cd/cd34...01.png
     """
-    ext = os.path.splitext(filename)[1]
-    filename = f'{uuid.uuid4()}{ext}'
-    return os.path.join('brands', instance.slug, filename)
+    return os.path.join('brands', filename)
 
 
 class Category(MPTTModel):
@@ -38,6 +30,8 @@ class Category(MPTTModel):
     slug = models.SlugField(max_length=255, unique=True)
     description = models.TextField(blank=True)
     parent = TreeForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    # Active products in this category or below it, kept up to date by catalog.counters.
+    product_count = models.IntegerField(default=0, db_index=True, editable=False)
 
     class MPTTMeta:
         order_insertion_by = ['name']
@@ -48,11 +42,30 @@ class Category(MPTTModel):
     def __str__(self):
         return self.name
 
+    def subtree_product_ids(self):
+        """
+        Subquery of the ids of products in this category or any category below
+        it, resolved in one join against the MPTT tree_id/lft/rght range rather
+        than by fetching the descendants first.
+        """
+        return Category.products_in_range(self.tree_id, self.lft, self.rght)
+
+    @staticmethod
+    def products_in_range(tree_id, lft, rght):
+        """ subtree_product_ids() for a category known only by its MPTT range. """
+        return Category.products.through.objects.filter(
+            category__tree_id=tree_id,
+            category__lft__gte=lft,
+            category__lft__lte=rght,
+        ).values('product_id')
+
 
 class Brand(models.Model):
     name = models.CharField(max_length=255, db_index=True)
     slug = models.SlugField(max_length=255, unique=True)
-    logo = models.ImageField(upload_to=brand_logo_path, blank=True)
+    logo = ContentAddressedImageField(upload_to=brand_logo_path, blank=True, db_index=True)
+    # Active products of this brand, kept up to date by catalog.counters.
+    product_count = models.IntegerField(default=0, db_index=True, editable=False)
 
     def __str__(self):
         return self.name
@@ -77,6 +90,9 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    def get_absolute_url(self):
+        return reverse('catalog:product_detail', kwargs={'slug': self.slug})
+
 
 class ProductVariant(models.Model):
     product = models.ForeignKey(Product, related_name='variants', on_delete=models.CASCADE)
@@ -100,7 +116,7 @@ class ProductVariant(models.Model):
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to=product_image_path)
+    image = ContentAddressedImageField(upload_to=product_image_path, db_index=True)
     alt_text = models.CharField(max_length=255, blank=True)
     is_primary = models.BooleanField(default=False)
     order = models.PositiveIntegerField(default=0)
@@ -121,6 +137,10 @@ class ProductImage(models.Model):
                             format='WEBP',
                             options={'quality': 85})
 
+    # Storage names of the pre-rendered derivatives (see catalog.images), so
+    # URLs can be built without touching the source file.
+    derivatives = JSONField(default=dict, blank=True, editable=False)
+    derivatives_ready = models.BooleanField(default=False, editable=False)
 
     class Meta:
         ordering = ['order']
@@ -134,6 +154,40 @@ class ProductImage(models.Model):
     def __str__(self):
         return self.alt_text or f"Image for {self.product.name}"
 
+    def derivative_url(self, kind):
+        """ URL of a rendered derivative, or of the original image while it is pending. """
+        name = self.derivatives.get(kind) if self.derivatives_ready else None
+        if name:
+            return self.image.storage.url(name)
+        return self.image.url if self.image else ''
+
+    @property
+    def thumbnail_url(self):
+        return self.derivative_url('thumbnail')
+
+    @property
+    def medium_url(self):
+        return self.derivative_url('medium')
+
+    @property
+    def large_url(self):
+        return self.derivative_url('large')
+
+    def srcset(self, image_format):
+        """ A `srcset` attribute value for one of the rendered responsive formats. """
+        if not self.derivatives_ready:
+            return ''
+        entries = self.derivatives.get('srcset', {}).get(image_format, [])
+        return ', '.join(f'{self.image.storage.url(name)} {width}w' for width, name in entries)
+
+    @property
+    def avif_srcset(self):
+        return self.srcset('avif')
+
+    @property
+    def webp_srcset(self):
+        return self.srcset('webp')
+
 class Wishlist(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wishlist')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='wishlist_items')
@@ -145,3 +199,140 @@ class Wishlist(models.Model):
 
     def __str__(self):
         return f'{self.user.username}\'s wishlist: {self.product.name}'
+
+
+class ProductCard(models.Model):
+    """
+    Denormalized listing row for an active product, holding everything a product
+    card needs so that a page of cards is a single indexed query.
+    Maintained by catalog.cards; inactive products have no card.
+    """
+    product = models.OneToOneField(Product, primary_key=True, related_name='card', on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    slug = models.SlugField(max_length=255)
+    summary = models.CharField(max_length=255, blank=True)
+    brand = models.ForeignKey(Brand, related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    brand_name = models.CharField(max_length=255, blank=True)
+    brand_slug = models.SlugField(max_length=255, blank=True)
+    category_ids = JSONField(default=list, blank=True)
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    in_stock = models.BooleanField(default=False)
+    image_alt = models.CharField(max_length=255, blank=True)
+    thumbnail_url = models.CharField(max_length=500, blank=True)
+    medium_url = models.CharField(max_length=500, blank=True)
+    large_url = models.CharField(max_length=500, blank=True)
+    rating_average = models.DecimalField(max_digits=3, decimal_places=2, null=True, blank=True)
+    rating_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['min_price']),
+            models.Index(fields=['name']),
+            models.Index(fields=['brand', '-created_at']),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    def get_absolute_url(self):
+        return reverse('catalog:product_detail', kwargs={'slug': self.slug})
+
+
+class ProductAttributeValue(models.Model):
+    """
+    One entry of the variant attribute index: a normalized attribute name and
+    value taken from a variant's `attributes` or `dimensions`, so attribute
+    filters are resolved through an index instead of parsing JSON per row.
+    Maintained by catalog.attributes.
+    """
+    product = models.ForeignKey(Product, related_name='attribute_values', on_delete=models.CASCADE)
+    variant = models.ForeignKey(ProductVariant, related_name='attribute_values', on_delete=models.CASCADE)
+    attribute = models.CharField(max_length=64)
+    value = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ('variant', 'attribute', 'value')
+        indexes = [
+            models.Index(fields=['attribute', 'value', 'variant', 'product']),
+        ]
+
+    def __str__(self):
+        return f'{self.attribute}={self.value} -> {self.variant_id}'
+
+
+class ProductSearchTerm(models.Model):
+    """
+    One entry of the product search inverted index: a normalized token and the
+    accumulated weight it carries for a product. Maintained by catalog.search.
+    """
+    product = models.ForeignKey(Product, related_name='search_terms', on_delete=models.CASCADE)
+    term = models.CharField(max_length=64, db_index=True)
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('product', 'term')
+
+    def __str__(self):
+        return f'{self.term} -> {self.product_id} ({self.weight})'
+
+
+class BoughtTogether(models.Model):
+    """
+    One of the top neighbours of a product in the "frequently bought together"
+    ranking: `related` appeared in `orders` orders together with `product`.
+    Maintained offline by catalog.recommendations.
+    """
+    product = models.ForeignKey(Product, related_name='bought_together', on_delete=models.CASCADE)
+    related = models.ForeignKey(Product, related_name='bought_with', on_delete=models.CASCADE)
+    orders = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ('product', 'rank')
+        unique_together = ('product', 'rank')
+
+    def __str__(self):
+        return f'{self.product_id} -> {self.related_id} ({self.orders})'
+
+
+class BoughtTogetherRun(models.Model):
+    """
+    When the last rebuild or update of BoughtTogether started (a single row),
+    where the next update of catalog.recommendations picks up.
+    """
+    started_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.started_at.isoformat()
+
+
+class ReleasedFile(models.Model):
+    """
+    A stored product image or brand logo that lost a reference, with the
+    derivatives rendered from it. Deleted by catalog.media.sweep_released_files()
+    once the grace period is over, if nothing references the file by then.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    derivatives = JSONField(default=list, blank=True)
+    released_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.name
+
+
+class DeletedVariant(models.Model):
+    """
+    A deleted variant, so that incremental exports (see catalog.exporter) can
+    tell consumers to take it down. A sku that is used again is no longer
+    reported as deleted.
+    """
+    sku = models.CharField(max_length=100, unique=True)
+    product_slug = models.SlugField(max_length=255)
+    deleted_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.sku
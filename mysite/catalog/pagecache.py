@@ -0,0 +1,127 @@
+"""
+Cached renderings of product pages.
+
+Each product has a version. It starts out as a digest of the product's
+updated_at and of the state of its variants, images and approved reviews,
+and every products_changed (or stock_changed) signal for the product
+replaces it with a fresh random token, so edits the digest cannot see (an
+image's alt text, say) still produce a new version. Renderings (the whole page for anonymous visitors,
+the product fragment for signed-in users) are stored under one key per
+product together with the version they were rendered for, so a version change
+makes them stale without touching them.
+
+On a miss only one worker renders: the others serve the stale rendering if
+there is one, or wait briefly for the new one, rather than all rendering the
+same page at once.
+
+Renderings must not depend on the visitor, so they are rendered without the
+request (no context processor runs). The CSRF token is the exception: they are
+rendered with CSRF_PLACEHOLDER and each response gets the visitor's own token
+substituted in. Visitors with anything of their own to show (signed in, a cart,
+pending messages) get the page rendered around the cached fragment instead
+(see is_personalized).
+"""
+import hashlib
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+from django.contrib.messages import get_messages
+from django.middleware.csrf import get_token
+
+from .models import Product, ProductImage, ProductVariant
+
+PRODUCT_VERSION_CACHE_KEY = 'catalog:product-version:{id}'
+PRODUCT_RENDERING_CACHE_KEY = 'catalog:product-{kind}:{id}'
+CACHE_TIMEOUT = 60 * 60 * 24
+RENDER_LOCK_TIMEOUT = 30
+RENDER_WAIT = 2.0
+RENDER_POLL_INTERVAL = 0.05
+CSRF_PLACEHOLDER = 'csrf-token-placeholder-8c1f0e'
+
+
+def compute_product_version(product_id):
+    """ A digest of the product's row and of its variants, images and reviews. """
+    approved = Q(reviews__approved=True)
+    state = [
+        Product.objects.filter(pk=product_id).values_list('updated_at', 'is_active').first(),
+        ProductVariant.objects.filter(product_id=product_id).aggregate(
+            count=Count('pk'), updated=Max('updated_at')
+        ),
+        ProductImage.objects.filter(product_id=product_id).aggregate(
+            count=Count('pk'), last=Max('pk'), ready=Count('pk', filter=Q(derivatives_ready=True))
+        ),
+        Product.objects.filter(pk=product_id).aggregate(
+            count=Count('reviews', filter=approved), last=Max('reviews__pk', filter=approved)
+        ),
+    ]
+    return hashlib.md5(repr(state).encode()).hexdigest()
+
+
+def product_version(product_id):
+    key = PRODUCT_VERSION_CACHE_KEY.format(id=product_id)
+    version = cache.get(key)
+    if version is None:
+        version = compute_product_version(product_id)
+        # add() rather than set(), so a token from a concurrent invalidation wins.
+        if not cache.add(key, version, timeout=CACHE_TIMEOUT):
+            version = cache.get(key, version)
+    return version
+
+
+def invalidate_products(product_ids):
+    """ Give the products new versions, making their renderings stale. """
+    cache.set_many(
+        {PRODUCT_VERSION_CACHE_KEY.format(id=pk): uuid.uuid4().hex for pk in product_ids},
+        timeout=CACHE_TIMEOUT,
+    )
+
+
+def cached_rendering(kind, product_id, render):
+    """
+    Return the `kind` rendering of a product for its current version, calling
+    render() to produce it if it is missing or stale.
+    """
+    version = product_version(product_id)
+    key = PRODUCT_RENDERING_CACHE_KEY.format(kind=kind, id=product_id)
+    entry = cache.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    lock_key = f'{key}:lock:{version}'
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, timeout=RENDER_LOCK_TIMEOUT):
+        try:
+            content = render()
+            cache.set(key, (version, content), timeout=CACHE_TIMEOUT)
+        finally:
+            # Only release the lock if it is still ours, not taken over after expiring.
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+        return content
+
+    # Another worker is rendering this version.
+    if entry is not None:
+        return entry[1]
+    deadline = time.monotonic() + RENDER_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(RENDER_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+    return render()
+
+
+def is_personalized(request):
+    """ Whether the visitor has something of their own on pages: an account, a cart or messages. """
+    return bool(
+        request.user.is_authenticated
+        or request.session.get('cart_id')
+        or len(get_messages(request))
+    )
+
+
+def with_csrf_token(content, request):
+    """ Substitute the visitor's CSRF token into a cached rendering. """
+    return content.replace(CSRF_PLACEHOLDER, get_token(request))
@@ -0,0 +1,237 @@
+"""
+Pagination for large listings.
+
+KeysetPaginator seeks directly to the rows after (or before) an opaque cursor
+holding the sort key of the last row seen, instead of counting and OFFSETting
+through everything in front of it. The sort key is whatever ordering the
+queryset already has, with the primary key appended as a tie-breaker.
+
+EstimatedCountPaginator is a drop-in Django Paginator that never counts more
+than `max_count` rows, falling back to the planner's estimate on PostgreSQL.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _json_default(value):
+    # Datetimes keep their full (microsecond) precision, unlike DjangoJSONEncoder.
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(values, backwards=False):
+    payload = json.dumps({'v': values, 'b': backwards}, default=_json_default)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """ Return (values, backwards) from a cursor created by encode_cursor. """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return list(payload['v']), bool(payload['b'])
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor('Invalid cursor.') from e
+
+
+class KeysetPage:
+    """ A page of results from KeysetPaginator, exposing cursors instead of page numbers. """
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @cached_property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return encode_cursor(self.paginator.position(self.object_list[-1]))
+
+    @cached_property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return encode_cursor(self.paginator.position(self.object_list[0]), backwards=True)
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination over a queryset, keyed on its current ordering plus pk.
+
+    Orderings may reference concrete model fields or annotations (such as
+    search_rank). NULLs sort last whichever the direction, so results are
+    consistent across database backends.
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        self.keys = []
+        for name in ordering:
+            if not isinstance(name, str):
+                raise ValueError('Keyset pagination requires orderings given as field names.')
+            descending = name.startswith('-')
+            self.keys.append((self._resolve(name.lstrip('-')), descending))
+        if not any(name in ('pk', queryset.model._meta.pk.name) for (name, _, _), _ in self.keys):
+            self.keys.append((self._resolve('pk'), self.keys[-1][1] if self.keys else False))
+
+    def _resolve(self, name):
+        """ Return (name, attname, field) for an ordering field or annotation. """
+        annotation = self.queryset.query.annotations.get(name)
+        if annotation is not None:
+            return name, name, annotation.output_field
+        opts = self.queryset.model._meta
+        field = opts.pk if name == 'pk' else opts.get_field(name)
+        return name, field.attname, field
+
+    def position(self, obj):
+        """ The sort key of an object, as stored in cursors. """
+        return [getattr(obj, attname) for (_, attname, _), _ in self.keys]
+
+    def _seek(self, values, backwards):
+        """ Q selecting the rows strictly after (or before) the given sort key. """
+        condition = Q()
+        equal = Q()
+        for ((name, _, field), descending), raw in zip(self.keys, values):
+            value = field.to_python(raw) if raw is not None else None
+            if value is None:
+                # NULLs sort last: nothing comes after them, everything non-null before.
+                strict = Q(**{f'{name}__isnull': False}) if backwards else None
+                same = Q(**{f'{name}__isnull': True})
+            else:
+                lookup = 'lt' if descending != backwards else 'gt'
+                strict = Q(**{f'{name}__{lookup}': value})
+                if not backwards:
+                    strict |= Q(**{f'{name}__isnull': True})
+                same = Q(**{name: value})
+            if strict is not None:
+                condition |= equal & strict
+            equal &= same
+        return condition
+
+    def _order_by(self, backwards):
+        nulls = {'nulls_first': True} if backwards else {'nulls_last': True}
+        order = []
+        for (name, _, _), descending in self.keys:
+            if descending != backwards:
+                order.append(F(name).desc(**nulls))
+            else:
+                order.append(F(name).asc(**nulls))
+        return order
+
+    def page(self, cursor=None):
+        """ Return the KeysetPage following (or preceding) the given cursor. """
+        values, backwards = decode_cursor(cursor) if cursor else ([], False)
+        if values and len(values) != len(self.keys):
+            raise InvalidCursor('Cursor does not match the current ordering.')
+
+        queryset = self.queryset
+        if values:
+            try:
+                queryset = queryset.filter(self._seek(values, backwards))
+            except ValidationError as e:
+                raise InvalidCursor('Invalid cursor.') from e
+        rows = list(queryset.order_by(*self._order_by(backwards))[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            return KeysetPage(rows, self, has_next=True, has_previous=has_more)
+        return KeysetPage(rows, self, has_next=has_more, has_previous=bool(values))
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that stops counting at max_count rows.
+
+    Past that point the count comes from the query planner's row estimate on
+    PostgreSQL, or is capped at max_count elsewhere; `count_is_estimate` tells
+    which happened. Deep pages are better served by KeysetPaginator.
+    """
+    max_count = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            self.count_is_estimate = False
+            return len(queryset)
+        count = queryset[:self.max_count + 1].count()
+        self.count_is_estimate = count > self.max_count
+        if self.count_is_estimate:
+            count = max(self._planner_estimate(queryset) or 0, self.max_count)
+        return count
+
+    def _planner_estimate(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CatalogPaginationMixin:
+    """
+    ListView mixin for catalog listings.
+
+    Classic page-number pagination uses EstimatedCountPaginator and adds an
+    elided `page_range` to the context. Requests carrying a `cursor` parameter
+    (empty for the first page) opt into keyset pagination instead, in which case
+    `cursor_mode` is set and `page_obj` exposes next/previous cursors.
+    """
+    paginator_class = EstimatedCountPaginator
+    cursor_param = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.cursor_param not in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_param) or None)
+        except InvalidCursor:
+            raise Http404('Invalid cursor.')
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = context.get('page_obj')
+        if isinstance(page, KeysetPage):
+            context['cursor_mode'] = True
+        elif page is not None:
+            context['page_range'] = page.paginator.get_elided_page_range(page.number)
+        return context
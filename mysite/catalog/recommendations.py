@@ -0,0 +1,161 @@
+"""
+"Frequently bought together" recommendations.
+
+Two products are bought together when they appear in the same (non-cancelled)
+order. The co-occurrence counts are computed offline by streaming the order
+items once, grouped by order, into a sparse {product: {other product: orders}}
+mapping, and only the TOP_K neighbours of each product are kept, in the
+BoughtTogether table. Serving a product's neighbours is then a single query
+on the (product, rank) index joined to the product cards.
+
+The table is rebuilt from scratch by rebuild_bought_together() and kept up to
+date in between by update_bought_together(since), which recomputes just the
+products appearing in orders placed since the last run. The time a run
+started is kept in the database (BoughtTogetherRun), and the next update
+looks back OVERLAP further, to catch orders whose transaction was still open
+when that run started; recomputing a product twice is harmless.
+
+Product pages embed the cards of their neighbours, so a change to a product
+also makes the pages listing it stale (see products_showing()).
+"""
+import heapq
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import combinations
+
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import Order, OrderItem
+from . import pagecache
+from .models import BoughtTogether, BoughtTogetherRun, ProductCard
+from .utils import chunked
+
+TOP_K = 10
+# Orders larger than this are skipped, as bulk purchases say little about affinity.
+MAX_ORDER_PRODUCTS = 50
+# Longer than any checkout transaction, so no order placed before a run commits after the next one looked.
+OVERLAP = timedelta(minutes=10)
+
+
+def order_baskets(orders=None, chunk_size=2000):
+    """ Yield the set of product ids of each order (of the given queryset, or all of them). """
+    items = OrderItem.objects.exclude(order__status=Order.OrderStatus.CANCELLED).filter(variant__isnull=False)
+    if orders is not None:
+        items = items.filter(order__in=orders)
+    rows = items.order_by('order_id').values_list('order_id', 'variant__product_id').iterator(chunk_size=chunk_size)
+    order_id, basket = None, set()
+    for row_order_id, product_id in rows:
+        if row_order_id != order_id:
+            if len(basket) > 1:
+                yield basket
+            order_id, basket = row_order_id, set()
+        basket.add(product_id)
+    if len(basket) > 1:
+        yield basket
+
+
+def co_occurrences(baskets, products=None):
+    """
+    Count, for each product (or each of `products`), the baskets it shares
+    with every other product: {product: Counter({other: baskets})}.
+    """
+    counts = defaultdict(Counter)
+    for basket in baskets:
+        if len(basket) > MAX_ORDER_PRODUCTS:
+            continue
+        for a, b in combinations(sorted(basket), 2):
+            if products is None or a in products:
+                counts[a][b] += 1
+            if products is None or b in products:
+                counts[b][a] += 1
+    return counts
+
+
+def top_neighbours(counts, k=TOP_K):
+    """ BoughtTogether rows for the k most co-purchased products of each product. """
+    rows = []
+    for product_id, neighbours in counts.items():
+        # Most shared orders first, then the lower id for a stable order.
+        best = heapq.nsmallest(k, neighbours.items(), key=lambda item: (-item[1], item[0]))
+        rows.extend(
+            BoughtTogether(product_id=product_id, related_id=related_id, orders=orders, rank=rank)
+            for rank, (related_id, orders) in enumerate(best)
+        )
+    return rows
+
+
+def _store(rows, product_ids=None, batch_size=1000):
+    """ Replace the rows of the given products (or all rows); returns the products changed. """
+    with transaction.atomic():
+        existing = BoughtTogether.objects.all()
+        if product_ids is not None:
+            existing = existing.filter(product_id__in=product_ids)
+        before = set(existing.values_list('product_id', 'related_id', 'rank'))
+        existing.delete()
+        for batch in chunked(rows, batch_size):
+            BoughtTogether.objects.bulk_create(batch)
+    after = {(row.product_id, row.related_id, row.rank) for row in rows}
+    changed = {product_id for product_id, _, _ in before ^ after}
+    pagecache.invalidate_products(changed)
+    return changed
+
+
+def rebuild_bought_together(batch_size=1000):
+    """ Recompute every product's neighbours; returns the number of products changed. """
+    started = timezone.now()
+    rows = top_neighbours(co_occurrences(order_baskets()))
+    changed = _store(rows, batch_size=batch_size)
+    _record_run(started)
+    return len(changed)
+
+
+def _record_run(started):
+    BoughtTogetherRun.objects.update_or_create(pk=1, defaults={'started_at': started})
+
+
+def last_run():
+    """ When the last rebuild or update started, or None. """
+    return BoughtTogetherRun.objects.filter(pk=1).values_list('started_at', flat=True).first()
+
+
+def update_bought_together(since=None, batch_size=1000):
+    """
+    Recompute the neighbours of the products ordered since the given time
+    (by default, since OVERLAP before the last run started). Without any
+    previous run this is a full rebuild. Returns the number of products changed.
+    """
+    if since is None:
+        since = last_run()
+        if since is None:
+            return rebuild_bought_together(batch_size)
+        since -= OVERLAP
+    started = timezone.now()
+    new_orders = Order.objects.filter(placed_at__gte=since)
+    affected = set(
+        OrderItem.objects.filter(order__in=new_orders, variant__isnull=False)
+        .values_list('variant__product_id', flat=True)
+        .distinct()
+    )
+    changed = set()
+    for products in chunked(sorted(affected), batch_size):
+        products = set(products)
+        orders = Order.objects.filter(items__variant__product_id__in=products).values('pk')
+        rows = top_neighbours(co_occurrences(order_baskets(orders), products))
+        changed |= _store(rows, products, batch_size)
+    _record_run(started)
+    return len(changed)
+
+
+def products_showing(product_ids):
+    """ The ids of the products listing any of the given products as bought together. """
+    # Without the default ordering, which would make DISTINCT apply to (product, rank).
+    showing = BoughtTogether.objects.filter(related_id__in=product_ids).order_by()
+    return set(showing.values_list('product_id', flat=True).distinct())
+
+
+def bought_together(product_id, limit=TOP_K):
+    """ Cards of the products most often bought with a product, best first. """
+    return ProductCard.objects.filter(product__bought_with__product_id=product_id).order_by(
+        'product__bought_with__rank'
+    )[:limit]
@@ -0,0 +1,132 @@
+"""
+Inverted-index product search.
+
+Every product is broken down into normalized tokens (from its name, description,
+brand, category names and variant SKUs) that are stored in ProductSearchTerm
+together with a relevance weight. Queries are resolved through the indexed
+`term` column instead of scanning Product with icontains.
+"""
+import re
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import IntegerField, OuterRef, Q, Subquery, Sum
+
+from .models import Product, ProductSearchTerm
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+MAX_TERM_LENGTH = 64
+# Upper bound on the number of tokens taken from a query, to keep the SQL bounded.
+MAX_QUERY_TERMS = 8
+
+# How much a single occurrence of a token is worth, depending on where it was found.
+FIELD_WEIGHTS = {
+    'name': 10,
+    'brand': 8,
+    'sku': 8,
+    'category': 5,
+    'description': 1,
+}
+
+
+def tokenize(text):
+    """ Split text into lowercase alphanumeric tokens. """
+    if not text:
+        return []
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text.casefold())]
+
+
+def build_terms(product):
+    """
+    Return a {term: weight} mapping for a product.
+    Expects brand, category and variants to be loaded (see index_products).
+    """
+    terms = {}
+
+    def add(text, field):
+        for token in tokenize(text):
+            terms[token] = terms.get(token, 0) + FIELD_WEIGHTS[field]
+
+    add(product.name, 'name')
+    add(product.description, 'description')
+    if product.brand:
+        add(product.brand.name, 'brand')
+    for category in product.category.all():
+        add(category.name, 'category')
+    for variant in product.variants.all():
+        add(variant.sku, 'sku')
+        # Also index the SKU without separators so "skx007" finds "SKX-007".
+        compact = ''.join(tokenize(variant.sku))[:MAX_TERM_LENGTH]
+        if compact:
+            terms[compact] = terms.get(compact, 0) + FIELD_WEIGHTS['sku']
+    return terms
+
+
+def index_products(product_ids):
+    """
+    Rebuild the index entries of the given products.
+    Ids of deleted products simply have their entries removed.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return 0
+    products = (
+        Product.objects.filter(pk__in=product_ids)
+        .select_related('brand')
+        .prefetch_related('category', 'variants')
+    )
+    entries = [
+        ProductSearchTerm(product=product, term=term, weight=weight)
+        for product in products
+        for term, weight in build_terms(product).items()
+    ]
+    with transaction.atomic():
+        ProductSearchTerm.objects.filter(product_id__in=product_ids).delete()
+        ProductSearchTerm.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+def search_products(query, queryset=None):
+    """
+    Narrow queryset to the products matching every token of query.
+
+    queryset may be over Product or over ProductCard, whose primary key is the
+    product id.
+
+    The last token is matched as a prefix so results keep up with a user who is
+    still typing. Results are annotated with `search_rank` (the summed weight of
+    the matched terms) and ordered by it, falling back to the queryset's own
+    ordering for ties.
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+    terms = tokenize(query)[:MAX_QUERY_TERMS]
+    if not terms:
+        return queryset.none()
+
+    conditions = [Q(term=term) for term in terms[:-1]]
+    conditions.append(Q(term__startswith=terms[-1]))
+    return match_terms(queryset, conditions)
+
+
+def match_terms(queryset, conditions):
+    """
+    Narrow queryset to the products having, for every condition, at least one
+    index term matching it, annotated with `search_rank` and ordered by it.
+    """
+    for condition in conditions:
+        queryset = queryset.filter(
+            pk__in=ProductSearchTerm.objects.filter(condition).values('product_id')
+        )
+
+    rank = (
+        ProductSearchTerm.objects.filter(reduce(or_, conditions), product=OuterRef('pk'))
+        .values('product')
+        .annotate(rank=Sum('weight'))
+        .values('rank')
+    )
+    ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+    return queryset.annotate(
+        search_rank=Subquery(rank, output_field=IntegerField())
+    ).order_by('-search_rank', *ordering)
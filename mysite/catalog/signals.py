@@ -0,0 +1,294 @@
+import threading
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+from mptt.signals import node_moved
+
+from . import attributes, cards, counters, facets, media, pagecache, recommendations, search
+from .models import Brand, Category, DeletedVariant, Product, ProductImage, ProductVariant
+from .utils import bump_catalog_version, chunked
+
+# Sent after the surrounding transaction commits, with `product_ids` holding the
+# ids of every product whose catalog data (the product row, its variants, images,
+# categories, brand or reviews) was created, changed or deleted in that transaction.
+# Derived structures (search index, caches, read models) hook into this.
+products_changed = Signal()
+
+# Sent after commit with the `product_ids` of products whose variants' stock alone
+# changed (checkout). Only what shows stock hooks into this: the catalog version,
+# search terms, facets and cart totals don't depend on it.
+stock_changed = Signal()
+
+_pending = threading.local()
+
+
+def mark_products_changed(product_ids):
+    """
+    Queue product ids for a single products_changed dispatch on commit.
+    Outside of a transaction the signal is sent immediately.
+    """
+    ids = getattr(_pending, 'ids', None)
+    if ids is None:
+        ids = _pending.ids = set()
+    ids.update(pk for pk in product_ids if pk is not None)
+    transaction.on_commit(_send_products_changed)
+
+
+def _send_products_changed():
+    ids = getattr(_pending, 'ids', None)
+    if not ids:
+        return
+    _pending.ids = set()
+    _stamp_products(ids)
+    products_changed.send(sender=Product, product_ids=ids)
+
+
+def mark_stock_changed(product_ids):
+    """ Queue product ids for a single stock_changed dispatch on commit. """
+    ids = getattr(_pending, 'stock_ids', None)
+    if ids is None:
+        ids = _pending.stock_ids = set()
+    ids.update(pk for pk in product_ids if pk is not None)
+    transaction.on_commit(_send_stock_changed)
+
+
+def _send_stock_changed():
+    ids = getattr(_pending, 'stock_ids', None)
+    if not ids:
+        return
+    _pending.stock_ids = set()
+    _stamp_products(ids)
+    stock_changed.send(sender=Product, product_ids=ids)
+
+
+def _stamp_products(ids):
+    # Stamp the products, so incremental exports see changes to their variants,
+    # images, categories, brand or reviews too. Done after the commit, so the
+    # stamp is never older than the moment the change became visible.
+    now = timezone.now()
+    for batch in chunked(ids, 500):
+        Product.objects.filter(pk__in=batch).update(updated_at=now)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_saved_or_deleted(sender, instance, **kwargs):
+    mark_products_changed([instance.pk])
+
+
+@receiver(pre_save, sender=Product)
+def remember_counted_state(sender, instance, **kwargs):
+    # The stored activation and brand, to adjust the counters from in post_save.
+    instance._counted_state = None
+    if not instance._state.adding:
+        instance._counted_state = (
+            Product.objects.filter(pk=instance.pk).values_list('is_active', 'brand_id').first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def update_counts_on_save(sender, instance, created, **kwargs):
+    was_active, old_brand_id = getattr(instance, '_counted_state', None) or (False, None)
+    counted_brand = old_brand_id if was_active else None
+    brand = instance.brand_id if instance.is_active else None
+    if counted_brand != brand:
+        counters.adjust_brand(counted_brand, -1)
+        counters.adjust_brand(brand, 1)
+    if not created and was_active != instance.is_active:
+        closure = counters.category_closure([instance.pk], active_only=False)
+        if instance.is_active:
+            counters.apply_category_changes({}, closure)
+        else:
+            counters.apply_category_changes(closure, {})
+
+
+@receiver(pre_delete, sender=Product)
+def remember_counted_categories(sender, instance, **kwargs):
+    # Category memberships are gone by post_delete.
+    instance._counted_categories = counters.category_closure([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def update_counts_on_delete(sender, instance, **kwargs):
+    if instance.is_active:
+        counters.adjust_brand(instance.brand_id, -1)
+    counters.apply_category_changes(getattr(instance, '_counted_categories', {}), {})
+
+
+@receiver(post_save, sender=ProductVariant)
+def index_variant_attributes(sender, instance, **kwargs):
+    # Entries of deleted variants go with them (on_delete=CASCADE).
+    attributes.index_variants([instance])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def variant_or_image_saved_or_deleted(sender, instance, **kwargs):
+    mark_products_changed([instance.product_id])
+
+
+@receiver(post_delete, sender=ProductVariant)
+def remember_deleted_variant(sender, instance, **kwargs):
+    DeletedVariant.objects.update_or_create(
+        sku=instance.sku,
+        defaults={
+            'product_slug': Product.objects.filter(pk=instance.product_id).values_list('slug', flat=True).first() or '',
+            'deleted_at': timezone.now(),
+        },
+    )
+
+
+@receiver(post_save, sender=ProductImage)
+def render_image_derivatives(sender, instance, **kwargs):
+    # Imported here as the tasks module depends on this one.
+    from .tasks import generate_image_derivatives
+
+    if not instance.image or instance.derivatives.get('source') == instance.image.name:
+        return
+    # Identical content is stored once, so its derivatives may already exist.
+    rendered = (
+        ProductImage.objects.filter(image=instance.image.name, derivatives_ready=True)
+        .exclude(pk=instance.pk).values_list('derivatives', flat=True).first()
+    )
+    instance.derivatives, instance.derivatives_ready = rendered or {}, rendered is not None
+    ProductImage.objects.filter(pk=instance.pk).update(
+        derivatives=instance.derivatives, derivatives_ready=instance.derivatives_ready
+    )
+    if rendered is None:
+        transaction.on_commit(lambda: generate_image_derivatives.delay([instance.pk]))
+
+
+@receiver(pre_save, sender=ProductImage)
+@receiver(pre_save, sender=Brand)
+def remember_stored_file(sender, instance, **kwargs):
+    # The file this row pointed at before, to release it if it gets replaced.
+    instance._stored_file = None
+    if not instance._state.adding:
+        field = 'image' if sender is ProductImage else 'logo'
+        extra = ('derivatives',) if sender is ProductImage else ()
+        instance._stored_file = sender.objects.filter(pk=instance.pk).values_list(field, *extra).first()
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Brand)
+def release_replaced_file(sender, instance, **kwargs):
+    stored = getattr(instance, '_stored_file', None)
+    current = instance.image if sender is ProductImage else instance.logo
+    if stored and stored[0] and stored[0] != current.name:
+        derivatives = stored[1] if len(stored) > 1 else {}
+        media.release(stored[0], media.derivative_names(derivatives))
+
+
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_delete, sender=Brand)
+def release_deleted_file(sender, instance, **kwargs):
+    if sender is ProductImage:
+        media.release(instance.image.name, media.derivative_names(instance.derivatives))
+    else:
+        media.release(instance.logo.name)
+
+
+@receiver(m2m_changed, sender=Product.category.through)
+def update_counts_on_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action.startswith('pre_'):
+        if not reverse:
+            product_ids = [instance.pk]
+        elif pk_set is not None:
+            product_ids = list(pk_set)
+        else:
+            product_ids = list(instance.products.values_list('pk', flat=True))
+        instance._counted_categories = (product_ids, counters.category_closure(product_ids))
+    else:
+        product_ids, before = getattr(instance, '_counted_categories', ([], {}))
+        counters.apply_category_changes(before, counters.category_closure(product_ids))
+
+
+@receiver(m2m_changed, sender=Product.category.through)
+def product_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            mark_products_changed([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        mark_products_changed(pk_set)
+    elif action == 'pre_clear':
+        # pk_set is not provided on clear, so collect the products beforehand.
+        mark_products_changed(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Brand)
+def brand_saved(sender, instance, created, **kwargs):
+    if not created:
+        mark_products_changed(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Category)
+@receiver(node_moved, sender=Category)
+def category_saved(sender, instance, created=False, **kwargs):
+    # The category paths of every product below it include this category.
+    if not created:
+        mark_products_changed(instance.subtree_product_ids().values_list('product_id', flat=True).distinct())
+
+
+@receiver(pre_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    # Memberships are deleted along with the category, without m2m_changed.
+    mark_products_changed(list(instance.subtree_product_ids().values_list('product_id', flat=True).distinct()))
+
+
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+def category_tree_changed(sender, **kwargs):
+    # Moves and deletions change which products roll up into which ancestors.
+    counters.schedule_category_recount()
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+def brand_or_category_changed(sender, **kwargs):
+    # Labels and the category tree are part of the facet index and in-process
+    # indexes (suggestions, the category tree).
+    transaction.on_commit(facets.invalidate_facet_index)
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(products_changed)
+def refresh_search_index(sender, product_ids, **kwargs):
+    search.index_products(product_ids)
+
+
+@receiver(products_changed)
+def update_facets(sender, product_ids, **kwargs):
+    facets.update_facet_index(product_ids)
+
+
+@receiver(products_changed)
+def refresh_cards(sender, product_ids, **kwargs):
+    cards.refresh_product_cards(product_ids)
+
+
+@receiver(products_changed)
+def invalidate_product_pages(sender, product_ids, **kwargs):
+    # Pages also show the cards of the products bought together with theirs.
+    pagecache.invalidate_products(set(product_ids) | recommendations.products_showing(product_ids))
+
+
+@receiver(stock_changed)
+def refresh_card_stock(sender, product_ids, **kwargs):
+    cards.refresh_stock(product_ids)
+
+
+@receiver(stock_changed)
+def invalidate_stocked_pages(sender, product_ids, **kwargs):
+    pagecache.invalidate_products(product_ids)
+
+
+@receiver(products_changed)
+def bump_version(sender, product_ids, **kwargs):
+    bump_catalog_version()
@@ -0,0 +1,107 @@
+"""
+Typeahead suggestions served from an in-process prefix index.
+
+Each worker keeps a SuggestionIndex (a sorted array of normalized keys searched
+with bisect) built from product names, brand names, category names and SKUs,
+weighted by popularity. The index is a WorkerLocalIndex, so it is swapped out
+whenever the catalog version is bumped and its entries are loaded from the
+database only by the first worker to see a new version.
+"""
+import heapq
+from bisect import bisect_left
+
+from django.db.models import Count, Q, Sum
+from django.urls import reverse
+
+from .models import Brand, Category, Product, ProductVariant
+from .search import tokenize
+from .utils import WorkerLocalIndex
+
+# Prefixes up to this length have their results precomputed, as they match the most keys.
+SHORT_PREFIX_LENGTH = 2
+MAX_SUGGESTIONS = 10
+
+
+def normalize(text):
+    return ' '.join(tokenize(text))
+
+
+class SuggestionIndex:
+    """
+    Prefix index over suggestion entries.
+
+    Every entry is a (kind, label, url, weight) tuple, reachable from the start
+    of its normalized label and from the start of each later word in it.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        keyed = []
+        for position, (kind, label, url, weight) in enumerate(entries):
+            words = normalize(label).split(' ')
+            for i in range(len(words)):
+                keyed.append((' '.join(words[i:]), position))
+        keyed.sort()
+        self.keys = [key for key, _ in keyed]
+        self.positions = [position for _, position in keyed]
+        self.short = {}
+        for key in set(k[:n] for k in self.keys for n in range(1, SHORT_PREFIX_LENGTH + 1)):
+            self.short[key] = self._scan(key, MAX_SUGGESTIONS)
+
+    def _scan(self, prefix, limit):
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + '\uffff', lo=start)
+        candidates = set(self.positions[start:end])
+        best = heapq.nlargest(limit, candidates, key=lambda p: (self.entries[p][3], -p))
+        return [self.entries[p] for p in best]
+
+    def lookup(self, query, limit=MAX_SUGGESTIONS):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        if len(prefix) <= SHORT_PREFIX_LENGTH:
+            return self.short.get(prefix, [])[:limit]
+        return self._scan(prefix, limit)
+
+
+def build_entries():
+    """ Load (kind, label, url, weight) suggestion entries from the database. """
+    sold = Sum('variants__order_items__quantity')
+    products = (
+        Product.objects.filter(is_active=True)
+        .annotate(sold=sold)
+        .values_list('pk', 'name', 'slug', 'sold')
+    )
+    entries = []
+    popularity = {}
+    for pk, name, slug, units in products.iterator():
+        popularity[pk] = (units or 0) + 1
+        url = reverse('catalog:product_detail', kwargs={'slug': slug})
+        entries.append(('product', name, url, popularity[pk]))
+
+    variants = ProductVariant.objects.filter(product__is_active=True).values_list(
+        'sku', 'product_id', 'product__name', 'product__slug'
+    )
+    for sku, product_id, name, slug in variants.iterator():
+        url = reverse('catalog:product_detail', kwargs={'slug': slug})
+        entries.append(('sku', f'{sku} - {name}', url, popularity.get(product_id, 1)))
+
+    active = Q(products__is_active=True)
+    for name, slug, count in Brand.objects.annotate(n=Count('products', filter=active)).values_list('name', 'slug', 'n'):
+        if count:
+            entries.append(('brand', name, reverse('catalog:brand_detail', kwargs={'slug': slug}), count))
+    for name, slug, count in Category.objects.annotate(n=Count('products', filter=active)).values_list('name', 'slug', 'n'):
+        if count:
+            entries.append(('category', name, reverse('catalog:category_detail', kwargs={'slug': slug}), count))
+    return entries
+
+
+suggestion_index = WorkerLocalIndex('catalog:suggest-entries:{version}', build_entries, SuggestionIndex)
+
+
+def suggest(query, limit=MAX_SUGGESTIONS):
+    """ Return up to `limit` suggestion dicts for a typed prefix. """
+    return [
+        {'type': kind, 'label': label, 'url': url}
+        for kind, label, url, _ in suggestion_index.get().lookup(query, limit)
+    ]
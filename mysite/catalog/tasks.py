@@ -0,0 +1,51 @@
+from celery import shared_task
+from . import facets, homepage, media, recommendations
+from .images import process_images
+from .signals import mark_products_changed
+
+
+@shared_task
+def generate_image_derivatives(image_ids):
+    """
+    Asynchronously renders the derivatives of the given product images, then
+    refreshes the products' cards so they pick up the new URLs.
+    """
+    product_ids = process_images(image_ids)
+    mark_products_changed(product_ids)
+    return len(product_ids)
+
+
+@shared_task
+def sweep_released_files():
+    """
+    Periodically deletes the stored images and logos left unreferenced for
+    longer than CATALOG_MEDIA_GRACE_HOURS.
+    """
+    return media.sweep_released_files()
+
+
+@shared_task
+def update_bought_together():
+    """
+    Periodically folds orders placed since the last run into the
+    "frequently bought together" table.
+    """
+    return recommendations.update_bought_together()
+
+
+@shared_task
+def rebuild_bought_together():
+    """ Recomputes the whole "frequently bought together" table. """
+    return recommendations.rebuild_bought_together()
+
+
+@shared_task
+def refresh_homepage(lock_token=None):
+    """ Rebuilds the cached home page sections. """
+    homepage.refresh_homepage(lock_token)
+
+
+@shared_task
+def rebuild_facet_index():
+    """ Rebuilds the facet index after brands or categories changed. """
+    facets.rebuild_facet_index(wait=facets.LOCK_TIMEOUT)
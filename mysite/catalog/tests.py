@@ -1,3 +1,95 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from . import cards, homepage, pagecache
+from .importer import CatalogImporter
+from .models import Brand, Product, ProductImage, ProductVariant, ReleasedFile
+
+
+class HomePageTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        brand = Brand.objects.create(name='Rolex', slug='rolex')
+        product = Product.objects.create(name='Submariner', slug='submariner', brand=brand)
+        ProductVariant.objects.create(product=product, sku='RLX-126610', name='Black', price=10)
+        cards.refresh_product_cards([product.pk])
+
+    def test_home_page_shows_sections(self):
+        homepage.refresh_homepage()
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'href="/products/submariner/"')
+        self.assertContains(response, 'href="/brands/rolex/"')
+
+
+class ProductPageCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name='Submariner', slug='submariner')
+        ProductVariant.objects.create(product=self.product, sku='RLX-126610', name='Black', price=10)
+        self.page_key = pagecache.PRODUCT_RENDERING_CACHE_KEY.format(kind='page', id=self.product.pk)
+
+    def test_anonymous_page_is_shared(self):
+        response = self.client.get('/products/submariner/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(cache.get(self.page_key))
+
+    def test_visitor_with_cart_is_not_served_the_shared_page(self):
+        session = self.client.session
+        session['cart_id'] = 'c0ffee'
+        session.save()
+        response = self.client.get('/products/submariner/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(cache.get(self.page_key))
+
+    def test_lock_taken_over_is_not_released(self):
+        lock_key = f'{self.page_key}:lock:{pagecache.product_version(self.product.pk)}'
+
+        def render():
+            # The lock expired during a slow render and another worker took it.
+            cache.set(lock_key, 'theirs')
+            return 'page'
+
+        self.assertEqual(pagecache.cached_rendering('page', self.product.pk, render), 'page')
+        self.assertEqual(cache.get(lock_key), 'theirs')
+
+
+class ImporterImageTests(TestCase):
+
+    def setUp(self):
+        self.images_dir = tempfile.mkdtemp()
+        self.media_root = tempfile.mkdtemp()
+        buffer = io.BytesIO()
+        Image.new('RGB', (4, 4), 'red').save(buffer, 'PNG')
+        with open(os.path.join(self.images_dir, 'front.png'), 'wb') as f:
+            f.write(buffer.getvalue())
+        self.records = [(1, {
+            'sku': 'RLX-126610', 'price': '10', 'product_slug': 'submariner',
+            'product_name': 'Submariner', 'images': 'front.png',
+        })]
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.media_root) for name in names]
+
+    def test_dry_run_writes_no_files(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            CatalogImporter(images_dir=self.images_dir, dry_run=True).run(self.records)
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(ReleasedFile.objects.exists())
+
+    def test_files_of_failed_batch_are_released(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            with mock.patch.object(CatalogImporter, 'save_rows', side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    CatalogImporter(images_dir=self.images_dir).run(self.records)
+        self.assertEqual(len(self.stored_files()), 1)
+        self.assertFalse(ProductImage.objects.exists())
+        self.assertEqual(ReleasedFile.objects.count(), 1)
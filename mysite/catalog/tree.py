@@ -0,0 +1,104 @@
+"""
+In-memory copy of the category hierarchy.
+
+The whole tree is read once (in MPTT order, with the maintained subtree
+product counts) and held by each worker as a CategoryTree, a WorkerLocalIndex
+that is rebuilt when the catalog version is bumped, i.e. whenever a category
+is saved, moved or deleted or product memberships change. Menus, listings,
+breadcrumbs and the category API read from it instead of querying Category.
+
+Nodes are plain dicts with the keys: id, name, slug, description, parent,
+level, tree_id, lft, rght, product_count (active products in the subtree)
+and children (child ids, in tree order).
+"""
+import hashlib
+import json
+
+from .models import Category
+from .utils import WorkerLocalIndex
+
+
+def build_tree_data():
+    """ Return the list of category nodes in tree order, with children unset. """
+    return list(
+        Category.objects.order_by('tree_id', 'lft').values(
+            'id', 'name', 'slug', 'description', 'parent', 'level', 'tree_id', 'lft', 'rght', 'product_count'
+        )
+    )
+
+
+class CategoryTree:
+    """ Lookups over the category nodes produced by build_tree_data(). """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.by_id = {}
+        self.ids_by_slug = {}
+        self.roots = []
+        for node in nodes:
+            node = dict(node, children=[])
+            self.by_id[node['id']] = node
+            self.ids_by_slug[node['slug']] = node['id']
+            if node['parent'] is None:
+                self.roots.append(node['id'])
+            else:
+                self.by_id[node['parent']]['children'].append(node['id'])
+        self.etag = hashlib.md5(json.dumps(self.nested(), sort_keys=True).encode()).hexdigest()
+
+    def get(self, pk):
+        return self.by_id.get(pk)
+
+    def get_by_slug(self, slug):
+        return self.by_id.get(self.ids_by_slug.get(slug))
+
+    def ancestors(self, pk, include_self=False):
+        """ Ancestor nodes, from the root down. """
+        node = self.by_id[pk]
+        chain = [node] if include_self else []
+        while node['parent'] is not None:
+            node = self.by_id[node['parent']]
+            chain.append(node)
+        chain.reverse()
+        return chain
+
+    def breadcrumbs(self, pk):
+        return self.ancestors(pk, include_self=True)
+
+    def descendants(self, pk, include_self=False):
+        """ Descendant nodes, in tree order. """
+        found = [self.by_id[pk]] if include_self else []
+        pending = list(reversed(self.by_id[pk]['children']))
+        while pending:
+            node = self.by_id[pending.pop()]
+            found.append(node)
+            pending.extend(reversed(node['children']))
+        return found
+
+    def walk(self):
+        """ Every node, in tree order. """
+        return [node for root in self.roots for node in self.descendants(root, include_self=True)]
+
+    def children(self, pk=None):
+        """ Child nodes of a category, or the root nodes if pk is None. """
+        ids = self.roots if pk is None else self.by_id[pk]['children']
+        return [self.by_id[child] for child in ids]
+
+    def nested(self, pk=None):
+        """ The tree (or a category's subtree) as nested dicts, for serialization. """
+        return [
+            {
+                'id': node['id'],
+                'name': node['name'],
+                'slug': node['slug'],
+                'product_count': node['product_count'],
+                'children': self.nested(node['id']),
+            }
+            for node in self.children(pk)
+        ]
+
+
+category_tree = WorkerLocalIndex('catalog:category-tree:{version}', build_tree_data, CategoryTree)
+
+
+def get_tree():
+    return category_tree.get()
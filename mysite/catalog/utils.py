@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+import uuid
+from itertools import islice
+
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever catalog data changes; in-process indexes rebuild when it moves.
+CATALOG_VERSION_CACHE_KEY = 'catalog:version'
+
+
+def chunked(iterable, size):
+    """ Yield successive lists of at most `size` items from iterable. """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def catalog_version():
+    return cache.get(CATALOG_VERSION_CACHE_KEY, 0)
+
+
+def bump_catalog_version():
+    """ Invalidate every worker's in-process catalog indexes. """
+    try:
+        cache.incr(CATALOG_VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_CACHE_KEY, 1, timeout=None)
+
+
+class WorkerLocalIndex:
+    """
+    An in-process structure derived from catalog data, kept per worker.
+
+    `load()` reads the raw data from the database and `build(data)` turns it
+    into the structure that is queried. The raw data is shared between workers
+    through the cache under `data_key` (formatted with the catalog version),
+    and a cross-worker lock lets only one worker load a version while the
+    others wait for the data it stores. The version key itself is re-read at
+    most every `check_interval` seconds.
+
+    Only the first get() of a worker waits for the index. Once it has one, a
+    new version is picked up by a background thread, one at a time, and the
+    previous index is served until the new one is built.
+    """
+
+    def __init__(
+        self, data_key, load, build, check_interval=1.0, timeout=60 * 60 * 24, lock_timeout=60, lock_wait=10.0
+    ):
+        self.data_key = data_key
+        self.load = load
+        self.build = build
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.lock_wait = lock_wait
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+        self._checked_at = 0.0
+        self._refreshing = False
+
+    def get(self):
+        now = time.monotonic()
+        if self._index is not None and now - self._checked_at < self.check_interval:
+            return self._index
+
+        version = catalog_version()
+        with self._lock:
+            self._checked_at = now
+            if self._index is None:
+                self._index = self.build(self.fetch(version))
+                self._version = version
+            elif self._version != version and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh, daemon=True).start()
+            return self._index
+
+    def _refresh(self):
+        try:
+            # Read the version only now, so bumps queued meanwhile are picked up at once.
+            version = catalog_version()
+            index = self.build(self.fetch(version))
+            with self._lock:
+                self._index = index
+                self._version = version
+        except Exception:
+            logger.exception('Could not refresh %s', self.data_key)
+        finally:
+            self._refreshing = False
+            connections.close_all()
+
+    def fetch(self, version):
+        """ The raw data of a version, from the cache or loaded by one worker at a time. """
+        key = self.data_key.format(version=version)
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+        lock_key = f'{key}:lock'
+        token = uuid.uuid4().hex
+        if cache.add(lock_key, token, timeout=self.lock_timeout):
+            try:
+                data = self.load()
+                cache.set(key, data, timeout=self.timeout)
+            finally:
+                if cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+            return data
+
+        # Another worker is loading this version.
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            data = cache.get(key)
+            if data is not None:
+                return data
+        return self.load()
+
+    def reset(self):
+        """ Drop this worker's copy so the next get() reloads it. """
+        with self._lock:
+            self._index = None
@@ -1,14 +1,25 @@
 
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy
-from .models import Product, Category, Brand, Wishlist
+from .models import Product, ProductCard, Category, Brand, Wishlist
+from .pagecache import CSRF_PLACEHOLDER, cached_rendering, is_personalized, with_csrf_token
+from .facets import facet_counts
 from .filters import ProductFilter
-from cart.models import Cart, CartItem
+from .fuzzy import fuzzy_search
+from .homepage import get_homepage
+from .pagination import CatalogPaginationMixin
+from .recommendations import bought_together
+from .search import search_products
+from .tree import get_tree
+from .wishlists import add_products, remove_products, request_wishlist_ids
+from cart.services import add_item, clean_quantity, session_cart
 from django.views.generic import TemplateView, ListView, DetailView
-from django.db.models import Count
-from django.db.models import Q
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.db.models import prefetch_related_objects
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from django.contrib.auth.mixins import LoginRequiredMixin
 
 
@@ -17,7 +28,8 @@ class HomeView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['latest_products'] = Product.objects.filter(is_active=True).order_by('-created_at')[:8]
+        # Built in the background and served stale-while-revalidate (see catalog.homepage).
+        context['homepage'] = get_homepage()
         return context
 
 class CategoryListView(ListView):
@@ -26,8 +38,8 @@ class CategoryListView(ListView):
     context_object_name = 'categories'
 
     def get_queryset(self):
-        """ Returns categories that have associated products. """
-        return Category.objects.annotate(product_count=Count('products')).filter(product_count__gt=0)
+        """ Returns categories with products in their subtree, in tree order. """
+        return [node for node in get_tree().walk() if node['product_count']]
 
 class BrandListView(ListView):
     model = Brand
@@ -36,54 +48,63 @@ class BrandListView(ListView):
 
     def get_queryset(self):
         """ Returns brands that have associated products. """
-        return Brand.objects.annotate(product_count=Count('products')).filter(product_count__gt=0)
+        return Brand.objects.filter(product_count__gt=0)
 
-class CategoryDetailView(ListView):
-    model = Product
+class CategoryDetailView(CatalogPaginationMixin, ListView):
+    model = ProductCard
     template_name = 'catalog/category_detail.html'
     context_object_name = 'products'
     paginate_by = 12
 
     def get_queryset(self):
-        """Return the products for the current category."""
-        self.category = get_object_or_404(Category, slug=self.kwargs['slug'])
-        return Product.objects.filter(category=self.category, is_active=True).prefetch_related('images')
+        """Return the product cards for the current category and its subcategories."""
+        tree = get_tree()
+        self.category = tree.get_by_slug(self.kwargs['slug'])
+        if self.category is None:
+            raise Http404('No category matches the given query.')
+        self.ancestors = tree.ancestors(self.category['id'])
+        self.subcategories = tree.children(self.category['id'])
+        product_ids = Category.products_in_range(self.category['tree_id'], self.category['lft'], self.category['rght'])
+        return ProductCard.objects.filter(pk__in=product_ids)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['category'] = self.category
+        context['ancestors'] = self.ancestors
+        context['subcategories'] = self.subcategories
         return context
 
-class BrandDetailView(ListView):
-    model = Product
+class BrandDetailView(CatalogPaginationMixin, ListView):
+    model = ProductCard
     template_name = 'catalog/brand_detail.html'
     context_object_name = 'products'
     paginate_by = 12
 
     def get_queryset(self):
-        """Return the products for the current brand."""
+        """Return the product cards for the current brand."""
         self.brand = get_object_or_404(Brand, slug=self.kwargs['slug'])
-        return Product.objects.filter(brand=self.brand, is_active=True).prefetch_related('images')
+        return ProductCard.objects.filter(brand=self.brand)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['brand'] = self.brand
         return context
 
-class ProductListView(ListView):
-    model = Product
+class ProductListView(CatalogPaginationMixin, ListView):
+    model = ProductCard
     template_name = 'catalog/product/list.html'
     context_object_name = 'products'
     paginate_by = 12
 
     def get_queryset(self):
-        queryset = Product.objects.filter(is_active=True).prefetch_related('images').distinct()
-        self.filter = ProductFilter(self.request.GET, queryset=queryset)
+        # Cards only exist for active products and carry everything a listing renders.
+        self.filter = ProductFilter(self.request.GET, queryset=ProductCard.objects.all())
         return self.filter.qs
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['filter'] = self.filter
+        context['facets'] = facet_counts(self.filter.qs)
         return context
 
 class ProductDetailView(DetailView):
@@ -91,101 +112,124 @@ class ProductDetailView(DetailView):
     template_name = 'catalog/product/detail.html'
     context_object_name = 'product'
 
+    fragment_template_name = 'catalog/product/_detail.html'
+
     def get_queryset(self):
-        """Prefetch related images and variants to optimize performance."""
-        return super().get_queryset().prefetch_related('images', 'variants').filter(is_active=True)
+        return super().get_queryset().filter(is_active=True)
+
+    def get(self, request, *args, **kwargs):
+        """
+        Serve the cached page to anonymous visitors and render the page around
+        the cached product fragment for everyone with something of their own
+        to show (see catalog.pagecache).
+        """
+        self.object = self.get_object()
+        if is_personalized(request):
+            fragment = with_csrf_token(self.get_fragment(), request)
+            context = self.get_context_data(object=self.object, product_fragment=mark_safe(fragment))
+            return self.render_to_response(context)
+        page = cached_rendering('page', self.object.pk, self.render_page)
+        return HttpResponse(with_csrf_token(page, request))
+
+    def get_fragment(self):
+        return cached_rendering('fragment', self.object.pk, self.render_fragment)
+
+    def render_fragment(self):
+        """Render the product markup, prefetching images and variants only now."""
+        prefetch_related_objects([self.object], 'images', 'variants')
+        context = {
+            'product': self.object,
+            'bought_together': list(bought_together(self.object.pk)),
+            'csrf_token': CSRF_PLACEHOLDER,
+        }
+        return render_to_string(self.fragment_template_name, context)
+
+    def render_page(self):
+        """Render the shared page without the request, so no visitor's state ends up in it."""
+        context = self.get_context_data(
+            object=self.object, product_fragment=mark_safe(self.get_fragment()), csrf_token=CSRF_PLACEHOLDER
+        )
+        return render_to_string(self.get_template_names(), context)
 
     def post(self, request, *args, **kwargs):
         """Handle adding the product variant to the cart."""
         self.object = self.get_object()
         variant_id = request.POST.get('variant_id')
-        quantity = int(request.POST.get('quantity', 1))
 
         if not variant_id:
             # Handle case where no variant is selected
             # You might want to add a message to the user
             return redirect(self.object.get_absolute_url())
+        try:
+            quantity = clean_quantity(request.POST.get('quantity', 1))
+        except ValidationError as error:
+            return HttpResponseBadRequest(error.messages[0])
 
         variant = get_object_or_404(self.object.variants, id=variant_id)
 
-        cart_id = request.session.get('cart_id')
-        if cart_id:
-            try:
-                cart = Cart.objects.get(id=cart_id)
-            except Cart.DoesNotExist:
-                cart = self.create_cart(request.user)
-        else:
-            cart = self.create_cart(request.user)
-        
-        request.session['cart_id'] = str(cart.id)
-
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart, 
-            variant=variant,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        cart = session_cart(request, create=True)
+        add_item(cart.id, variant.id, quantity)
             
         return redirect('cart:cart_detail')
 
-    def create_cart(self, user):
-        """Create a new cart, associated with a user if authenticated."""
-        if user.is_authenticated:
-            return Cart.objects.create(user=user)
-        return Cart.objects.create()
-
-class SearchResultsView(ListView):
-    model = Product
+class SearchResultsView(CatalogPaginationMixin, ListView):
+    model = ProductCard
     template_name = 'catalog/product/search_results.html'
     context_object_name = 'products'
     paginate_by = 12
 
     def get_queryset(self):
+        # Misspelt queries with no exact results fall back to near matches.
+        self.did_you_mean = None
         query = self.request.GET.get('q')
-        if query:
-            return Product.objects.filter(
-                Q(name__icontains=query) | Q(description__icontains=query),
-                is_active=True
-            ).prefetch_related('images').distinct()
-        return Product.objects.none()
+        if not query:
+            return ProductCard.objects.none()
+        results = search_products(query, ProductCard.objects.all())
+        if not results.exists():
+            results, self.did_you_mean = fuzzy_search(query, ProductCard.objects.all())
+        return results
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['query'] = self.request.GET.get('q', '')
+        context['did_you_mean'] = self.did_you_mean
         return context
 
-class WishlistView(LoginRequiredMixin, ListView):
+class WishlistView(LoginRequiredMixin, CatalogPaginationMixin, ListView):
     model = Wishlist
     template_name = 'catalog/wishlist.html'
     context_object_name = 'wishlist_items'
+    paginate_by = 12
 
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user)
+        return (
+            Wishlist.objects.filter(user=self.request.user)
+            .select_related('product__brand')
+            .prefetch_related('product__images')
+        )
+
+def _posted_product_id(request):
+    try:
+        return int(request.POST.get('product_id'))
+    except (TypeError, ValueError):
+        raise Http404
 
 @login_required
 def add_to_wishlist(request):
     if request.method == 'POST':
-        product_id = request.POST.get('product_id')
-        product = get_object_or_404(Product, id=product_id)
-        wishlist_item, created = Wishlist.objects.get_or_create(user=request.user, product=product)
-        if created:
-            return JsonResponse({'status': 'success', 'message': 'Product added to wishlist.'})
-        else:
+        product_id = _posted_product_id(request)
+        if product_id in request_wishlist_ids(request):
             return JsonResponse({'status': 'warning', 'message': 'Product already in wishlist.'})
+        if not add_products(request.user, [product_id]):
+            raise Http404
+        return JsonResponse({'status': 'success', 'message': 'Product added to wishlist.'})
     return JsonResponse({'status': 'error', 'message': 'Invalid request.'})
 
 @login_required
 def remove_from_wishlist(request):
     if request.method == 'POST':
-        product_id = request.POST.get('product_id')
-        product = get_object_or_404(Product, id=product_id)
-        try:
-            wishlist_item = Wishlist.objects.get(user=request.user, product=product)
-            wishlist_item.delete()
+        product_id = _posted_product_id(request)
+        if remove_products(request.user, [product_id]):
             return JsonResponse({'status': 'success', 'message': 'Product removed from wishlist.'})
-        except Wishlist.DoesNotExist:
-            return JsonResponse({'status': 'warning', 'message': 'Product not in wishlist.'})
+        return JsonResponse({'status': 'warning', 'message': 'Product not in wishlist.'})
     return JsonResponse({'status': 'error', 'message': 'Invalid request.'})
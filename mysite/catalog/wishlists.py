@@ -0,0 +1,65 @@
+"""
+Wishlist membership.
+
+The ids of the products on a user's wishlist are cached as one set per user,
+so listings can show which products are wishlisted without a query per card:
+the set is read at most once per request (request_wishlist_ids) and checked
+in memory. Adding and removing any number of products is one INSERT or one
+DELETE, after which the cached set is dropped once the change commits. Ids
+of deleted products may linger in a cached set until it expires, which is
+harmless as they never match a listed product.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Product, Wishlist
+
+WISHLIST_CACHE_KEY = 'catalog:wishlist:{user_id}'
+WISHLIST_TIMEOUT = 60 * 60 * 24
+MAX_BULK_PRODUCTS = 500
+
+
+def wishlist_ids(user):
+    """ The set of product ids on a user's wishlist (empty for anonymous users). """
+    if not user.is_authenticated:
+        return frozenset()
+    key = WISHLIST_CACHE_KEY.format(user_id=user.pk)
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(Wishlist.objects.filter(user=user).values_list('product_id', flat=True))
+        cache.set(key, ids, timeout=WISHLIST_TIMEOUT)
+    return ids
+
+
+def request_wishlist_ids(request):
+    """ wishlist_ids() of the request's user, loaded once per request. """
+    if not hasattr(request, '_wishlist_ids'):
+        request._wishlist_ids = wishlist_ids(request.user)
+    return request._wishlist_ids
+
+
+def invalidate_wishlist(user_id):
+    transaction.on_commit(lambda: cache.delete(WISHLIST_CACHE_KEY.format(user_id=user_id)))
+
+
+def add_products(user, product_ids):
+    """ Add existing products to a user's wishlist; returns the ids that were added. """
+    ids = set(product_ids) - wishlist_ids(user)
+    if not ids:
+        return set()
+    ids = set(Product.objects.filter(pk__in=ids).values_list('pk', flat=True))
+    Wishlist.objects.bulk_create(
+        [Wishlist(user=user, product_id=pk) for pk in ids], ignore_conflicts=True
+    )
+    invalidate_wishlist(user.pk)
+    return ids
+
+
+def remove_products(user, product_ids):
+    """ Remove products from a user's wishlist; returns the number removed. """
+    if not product_ids:
+        return 0
+    # Wishlist has no dependent rows or delete signals, so this is a single DELETE.
+    removed, _ = Wishlist.objects.filter(user=user, product_id__in=product_ids).delete()
+    invalidate_wishlist(user.pk)
+    return removed
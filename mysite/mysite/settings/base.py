@@ -14,6 +14,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 import environ
 from pathlib import Path
 from datetime import timedelta
+from celery.schedules import crontab
 
 # Initialize environment variables
 env = environ.Env(
@@ -87,6 +88,8 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'cart.context_processors.cart',
+                'catalog.context_processors.categories',
+                'catalog.context_processors.wishlist',
             ],
         },
     },
@@ -144,6 +147,22 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Directory the catalog import API reads image files from
+CATALOG_IMPORT_IMAGES_DIR = env('CATALOG_IMPORT_IMAGES_DIR', default=None)
+
+# Currency of the prices in the merchant feed
+CATALOG_FEED_CURRENCY = env('CATALOG_FEED_CURRENCY', default='USD')
+
+# Stored images and logos are deleted once unreferenced for this many hours
+CATALOG_MEDIA_GRACE_HOURS = env.int('CATALOG_MEDIA_GRACE_HOURS', default=24)
+
+# Where cart items are kept: 'database', or 'redis' to keep active carts in
+# Redis and persist them to the database write-behind
+CART_STORE = env('CART_STORE', default='database')
+
+# Anonymous carts left unchanged for this many days are deleted
+CART_ABANDONED_DAYS = env.int('CART_ABANDONED_DAYS', default=30)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -221,6 +240,32 @@ CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+CELERY_BEAT_SCHEDULE = {
+    'update-bought-together': {
+        'task': 'catalog.tasks.update_bought_together',
+        'schedule': 60 * 60,
+    },
+    'refresh-homepage': {
+        'task': 'catalog.tasks.refresh_homepage',
+        'schedule': 60 * 5,
+    },
+    'flush-carts': {
+        'task': 'cart.tasks.flush_carts',
+        'schedule': 60,
+    },
+    'delete-abandoned-carts': {
+        'task': 'cart.tasks.delete_abandoned_carts',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'sweep-released-media': {
+        'task': 'catalog.tasks.sweep_released_files',
+        'schedule': 60 * 60,
+    },
+    'rebuild-bought-together': {
+        'task': 'catalog.tasks.rebuild_bought_together',
+        'schedule': crontab(hour=3, minute=30),
+    },
+}
 
 # Caching
 CACHES = {
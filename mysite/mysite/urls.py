@@ -3,11 +3,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from pages.views import IndexView # Import the IndexView directly
+from catalog.views import HomeView
 
 urlpatterns = [
     # Homepage
-    path('', IndexView.as_view(), name='index'), # Map the root URL to IndexView
+    path('', HomeView.as_view(), name='index'), # The home page with its catalog sections
 
     # Django Admin
     path('admin/', admin.site.urls),
@@ -17,6 +17,7 @@ urlpatterns = [
     
     # Other app URLs
     path('', include('pages.urls')),
+    path('', include('catalog.urls', namespace='catalog')),
     path('accounts/', include('accounts.urls')),
     path('cart/', include('cart.urls')),
     path('orders/', include('orders.urls')),
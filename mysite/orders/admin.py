@@ -20,20 +20,40 @@ class PaymentInline(admin.TabularInline):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'status', 'total', 'placed_at')
+    list_display = ('id', 'user', 'status', 'line_count', 'items_quantity', 'total', 'placed_at')
     list_filter = ('status', 'placed_at')
+    list_select_related = ('user',)
     search_fields = ('id', 'user__email', 'tracking_number')
     readonly_fields = ('placed_at', 'total')
     autocomplete_fields = ['user', 'shipping_address', 'billing_address']
     inlines = [OrderItemInline, PaymentInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
+
+    @admin.display(description='Lines', ordering='line_count')
+    def line_count(self, obj):
+        return obj.line_count
+
+    @admin.display(description='Quantity', ordering='items_quantity')
+    def items_quantity(self, obj):
+        return obj.items_quantity
+
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ('order', 'variant', 'quantity', 'price_at_purchase')
+    list_display = ('order', 'variant', 'quantity', 'price_at_purchase', 'line_subtotal')
+    list_select_related = ('order__user', 'variant__product')
     search_fields = ('order__id', 'variant__sku', 'variant__name')
     autocomplete_fields = ['order', 'variant']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_subtotals()
+
+    @admin.display(description='Subtotal', ordering='line_subtotal')
+    def line_subtotal(self, obj):
+        return obj.line_subtotal
+
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
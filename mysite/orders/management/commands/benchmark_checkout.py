@@ -0,0 +1,111 @@
+
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from catalog.models import Product, ProductVariant
+from orders.checkout import CheckoutError, place_order
+from orders.models import Order
+
+BENCHMARK_SLUG = 'checkout-benchmark'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks concurrent checkouts of overlapping variants, on a throwaway product '
+        'that is deleted afterwards with its orders. Use a database that supports row locks.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=500, help='Number of orders placed.')
+        parser.add_argument('--workers', type=int, default=16, help='Number of concurrent checkouts.')
+        parser.add_argument('--variants', type=int, default=10, help='Number of variants the orders share.')
+        parser.add_argument('--lines', type=int, default=5, help='Number of lines per order.')
+        parser.add_argument(
+            '--stock',
+            type=int,
+            default=None,
+            help='Initial stock per variant (default: enough for every order, so none runs out).'
+        )
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for the orders placed.')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            raise CommandError('SQLite serializes writers; benchmark against PostgreSQL or MySQL.')
+        if Product.objects.filter(slug=BENCHMARK_SLUG).exists():
+            raise CommandError(f'A product "{BENCHMARK_SLUG}" exists already; is another benchmark running?')
+        lines = min(options['lines'], options['variants'])
+        stock = options['stock']
+        if stock is None:
+            stock = options['orders'] * 3
+
+        user, created_user = get_user_model().objects.get_or_create(username=BENCHMARK_SLUG)
+        product = Product.objects.create(name='Checkout benchmark', slug=BENCHMARK_SLUG, is_active=False)
+        ProductVariant.objects.bulk_create([
+            ProductVariant(
+                product=product, sku=f'{BENCHMARK_SLUG}-{i}', name=str(i), price=Decimal('10.00'), stock=stock
+            )
+            for i in range(options['variants'])
+        ])
+        variants = list(product.variants.all())
+
+        # Every order takes the shared variants in a random order, the case that deadlocks with per-line locks.
+        rng = random.Random(options['seed'])
+        orders = [
+            [(variant.pk, rng.randint(1, 3)) for variant in rng.sample(variants, lines)]
+            for _ in range(options['orders'])
+        ]
+
+        def checkout(items):
+            started = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    place_order(user, items)
+                outcome = 'placed'
+            except CheckoutError:
+                outcome = 'out of stock'
+            except DatabaseError:
+                # Deadlocks and lock timeouts.
+                outcome = 'failed'
+            finally:
+                close_old_connections()
+            return outcome, time.perf_counter() - started
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                results = list(executor.map(checkout, orders))
+            elapsed = time.perf_counter() - started
+
+            sold = Order.objects.filter(user=user, items__variant__product=product).distinct().count()
+            remaining = sum(ProductVariant.objects.filter(product=product).values_list('stock', flat=True))
+            ordered = sum(
+                quantity for items, (outcome, _) in zip(orders, results) if outcome == 'placed'
+                for _, quantity in items
+            )
+        finally:
+            Order.objects.filter(user=user, items__variant__product=product).delete()
+            product.delete()
+            if created_user:
+                user.delete()
+
+        outcomes = {outcome: sum(1 for o, _ in results if o == outcome) for outcome in ('placed', 'out of stock', 'failed')}
+        latencies = sorted(duration for _, duration in results)
+        p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+        self.stdout.write(
+            f"{len(orders)} orders of {lines} lines over {options['variants']} variants, "
+            f"{options['workers']} workers: {elapsed:.2f}s, {len(orders) / elapsed:.1f} orders/s"
+        )
+        self.stdout.write(
+            f"placed {outcomes['placed']}, out of stock {outcomes['out of stock']}, failed {outcomes['failed']}; "
+            f"latency median {statistics.median(latencies) * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms"
+        )
+        consistent = sold == outcomes['placed'] and remaining == stock * len(variants) - ordered
+        if not consistent:
+            raise CommandError(f'Stock is inconsistent: {remaining} left after {ordered} units were sold.')
+        self.stdout.write(self.style.SUCCESS('Successfully benchmarked checkout; stock is consistent.'))
@@ -1,11 +1,48 @@
 
 import uuid
 from django.db import models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from catalog.models import ProductVariant
 from accounts.models import Address
 
 
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotate each order with its line count (`line_count`), number of
+        units (`items_quantity`) and the sum of its lines at purchase prices
+        (`items_total`), all computed by one aggregate query.
+        """
+        return self.annotate(
+            line_count=Count('items'),
+            items_quantity=Coalesce(Sum('items__quantity'), 0),
+            items_total=Coalesce(
+                Sum(F('items__quantity') * F('items__price_at_purchase'), output_field=DecimalField()), 0,
+                output_field=DecimalField(),
+            ),
+        )
+
+    def update_totals(self):
+        """ Set the total of every order to the sum of its lines, in one UPDATE. """
+        line_totals = (
+            OrderItem.objects.filter(order=OuterRef('pk'))
+            .values('order')
+            .annotate(total=Sum(F('quantity') * F('price_at_purchase'), output_field=DecimalField()))
+            .values('total')
+        )
+        return self.update(total=Coalesce(Subquery(line_totals), 0, output_field=DecimalField()))
+
+
+class OrderItemQuerySet(models.QuerySet):
+    def with_subtotals(self):
+        """ Annotate each line with `line_subtotal`, its quantity times the purchase price. """
+        return self.annotate(
+            line_subtotal=ExpressionWrapper(F('quantity') * F('price_at_purchase'), output_field=DecimalField())
+        )
+
+
 class Order(models.Model):
     class OrderStatus(models.TextChoices):
         PENDING = 'PENDING', 'Pending'
@@ -27,6 +64,8 @@ class Order(models.Model):
     placed_at = models.DateTimeField(auto_now_add=True)
     tracking_number = models.CharField(max_length=100, blank=True, null=True)
 
+    objects = OrderQuerySet.as_manager()
+
     class Meta:
         ordering = ['-placed_at']
 
@@ -34,9 +73,9 @@ class Order(models.Model):
         return f"Order {self.id} by {self.user.email if self.user else 'Guest'}"
 
     def update_total(self):
-        """Recalculates the order total based on its items."""
-        self.total = sum(item.subtotal for item in self.items.all()) or 0
-        self.save()
+        """Recalculates the order total based on its items, in the database."""
+        Order.objects.filter(pk=self.pk).update_totals()
+        self.refresh_from_db(fields=['total'])
 
 
 class OrderItem(models.Model):
@@ -45,11 +84,15 @@ class OrderItem(models.Model):
     quantity = models.PositiveIntegerField()
     price_at_purchase = models.DecimalField(max_digits=10, decimal_places=2)
 
+    objects = OrderItemQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.quantity} x {self.variant.name if self.variant else 'Deleted Product'} for Order {self.order.id}"
 
     @property
     def subtotal(self):
+        if hasattr(self, 'line_subtotal'):
+            return self.line_subtotal
         return self.price_at_purchase * self.quantity
 
 
@@ -1,3 +1,34 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from catalog import cards
+from catalog.models import Product, ProductCard, ProductVariant
+from catalog.utils import catalog_version
+from .checkout import place_order
+
+
+class PlaceOrderTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('buyer')
+        self.product = Product.objects.create(name='Submariner', slug='submariner')
+        self.variant = ProductVariant.objects.create(
+            product=self.product, sku='RLX-126610', name='Black', price=10, stock=1
+        )
+        cards.refresh_product_cards([self.product.pk])
+
+    def test_selling_out_refreshes_only_stock(self):
+        version = catalog_version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            place_order(self.user, [(self.variant.pk, 1)])
+        with CaptureQueriesContext(connection) as queries:
+            for callback in callbacks:
+                callback()
+        self.assertFalse(ProductCard.objects.get(pk=self.product.pk).in_stock)
+        self.assertEqual(catalog_version(), version)
+        # Stamping the product and refreshing its card's stock flag.
+        self.assertEqual(len(queries), 2)
@@ -2,9 +2,9 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum, Count
+from django.db.models import Prefetch, Sum, Count
 from django.utils import timezone
-from .models import Order
+from .models import Order, OrderItem
 from catalog.models import ProductVariant
 
 @staff_member_required
@@ -60,7 +60,9 @@ def order_list(request):
 @login_required
 def order_detail(request, order_id):
     """Display the details of a specific order."""
-    order = get_object_or_404(Order, id=order_id, user=request.user) # Ensure order belongs to user
+    items = OrderItem.objects.with_subtotals().select_related('variant__product')
+    orders = Order.objects.prefetch_related(Prefetch('items', queryset=items))
+    order = get_object_or_404(orders, id=order_id, user=request.user) # Ensure order belongs to user
     context = {
         'order': order
     }
@@ -1,5 +1,6 @@
 
 from django.contrib import admin
+from catalog.signals import mark_products_changed
 from .models import Review
 
 
@@ -14,4 +15,6 @@ class ReviewAdmin(admin.ModelAdmin):
 
     def approve_reviews(self, request, queryset):
         queryset.update(approved=True)
+        # update() skips model signals, so notify the catalog explicitly.
+        mark_products_changed(queryset.values_list('product_id', flat=True))
     approve_reviews.short_description = "Approve selected reviews"
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from catalog.signals import mark_products_changed
+from .models import Review
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_saved_or_deleted(sender, instance, **kwargs):
+    # Ratings are part of the product's derived catalog data (e.g. its card).
+    mark_products_changed([instance.product_id])